@@ -113,6 +113,44 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+#
+# Unread-notification counters, cohort participant counts and the dashboard
+# and bracket versions live in the cache and are written by the web
+# processes and by the payment/callback workers alike, so in production
+# every process must share one cache. Set REDIS_URL to use Redis (atomic
+# counters, needs the redis package); otherwise production uses the
+# database cache, which needs `python manage.py createcachetable` once.
+# Development falls back to a process-local cache, which workers started
+# in another process do not see.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+elif ENVIRONMENT == 'production':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cod_cache',
+            'OPTIONS': {
+                # One counter per user and section; the default of 300 would cull them constantly
+                'MAX_ENTRIES': 200000,
+            }
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
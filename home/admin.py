@@ -1,22 +1,148 @@
 from django.contrib import admin
-from .models import Cohort, GameMode, TeamUP, GameStage, StageParticipants, Round, RoundPlayerStats, TeamUPRound, TeamUPRoundStats, Fixture, TeamUPFixture, TeamUPPlayerRoundStats, Notification, MPesaTransaction, TeamUPInvite, FreeAgent, SquadRecruitment, JoinRequest
+from django.db import transaction
+
+from . import brackets, career, dashboard, leaderboard
+from .models import Cohort, GameMode, TeamUP, GameStage, StageParticipants, Round, RoundPlayerStats, TeamUPRound, TeamUPRoundStats, Fixture, TeamUPFixture, TeamUPPlayerRoundStats, Notification, MPesaTransaction, TeamUPInvite, FreeAgent, SquadRecruitment, JoinRequest, LeaderboardEntry, TeamLeaderboardEntry, SquadCohortReadiness, PaymentRequest, MPesaCallback, PlayerModeRank, RankRecomputeRequest
+
+
+
+class CareerStatsAdmin(admin.ModelAdmin):
+    """Keeps PersonalProfile career totals in step with edits and deletes made here."""
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            previous = type(obj).objects.filter(pk=obj.pk).values(*career.CAREER_FIELDS).first() if change else None
+            super().save_model(request, obj, form, change)
+            career.apply_stat(obj, previous)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            career.remove_stats([obj])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            stats = list(queryset)
+            super().delete_queryset(request, queryset)
+            career.remove_stats(stats)
+
+
+class LeaderboardStatsAdmin(admin.ModelAdmin):
+    """Keeps the denormalized leaderboard rows in step with edits and deletes made here.
+
+    An edit that moves a result to another round or owner is applied as
+    removing the old row and adding the new one.
+    """
+    owner_field = 'player_id'
+    stat_fields = leaderboard.STAT_FIELDS
+    apply_stats = staticmethod(leaderboard.apply_stats)
+    remove_stats = staticmethod(leaderboard.remove_stats)
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            old = type(obj).objects.select_related('round_instance__stage').filter(pk=obj.pk).first() if change else None
+            super().save_model(request, obj, form, change)
+            owner, previous = getattr(obj, self.owner_field), {}
+            if old is not None:
+                if (getattr(old, self.owner_field), old.round_instance_id) == (owner, obj.round_instance_id):
+                    previous[owner] = {field: getattr(old, field) for field in self.stat_fields}
+                else:
+                    self.remove_stats([old])
+            self.apply_stats(obj.round_instance, [obj], previous)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            obj.round_instance.stage  # load the scope before the row is gone
+            super().delete_model(request, obj)
+            self.remove_stats([obj])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            stats = list(queryset.select_related('round_instance__stage'))
+            super().delete_queryset(request, queryset)
+            self.remove_stats(stats)
+
+
+class RoundPlayerStatsAdmin(LeaderboardStatsAdmin, CareerStatsAdmin):
+    pass
+
+
+class TeamLeaderboardStatsAdmin(LeaderboardStatsAdmin):
+    owner_field = 'team_id'
+    stat_fields = leaderboard.TEAM_STAT_FIELDS
+    apply_stats = staticmethod(leaderboard.apply_team_stats)
+    remove_stats = staticmethod(leaderboard.remove_team_stats)
+
+
+class BracketAdmin(admin.ModelAdmin):
+    """Invalidates the cached bracket of the cohort a stage or fixture belongs to."""
+
+    def save_related(self, request, form, formsets, change):
+        # After the players/teamups m2m is written, so the re-render sees it
+        super().save_related(request, form, formsets, change)
+        cohort_ids = {form.instance.cohort_id}
+        if change and 'cohort' in form.changed_data:
+            cohort_ids.add(form.initial.get('cohort'))
+        brackets.bump(cohort_ids - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        brackets.bump([obj.cohort_id])
+
+    def delete_queryset(self, request, queryset):
+        cohort_ids = set(queryset.values_list('cohort_id', flat=True))
+        super().delete_queryset(request, queryset)
+        brackets.bump(cohort_ids - {None})
+
+
+class FixtureAdmin(BracketAdmin):
+    """Also invalidates the dashboard fixtures section of everyone in the fixture, before and after the edit."""
+
+    def player_ids(self, fixture_ids):
+        if self.model is Fixture:
+            return set(Fixture.players.through.objects.filter(fixture_id__in=fixture_ids).values_list('user_id', flat=True))
+        squads = TeamUPFixture.teamups.through.objects.filter(teamupfixture_id__in=fixture_ids).values('teamup_id')
+        return set(TeamUP.players.through.objects.filter(teamup_id__in=squads).values_list('user_id', flat=True))
+
+    def save_related(self, request, form, formsets, change):
+        before = self.player_ids([form.instance.id]) if change else set()
+        super().save_related(request, form, formsets, change)
+        dashboard.bump(before | self.player_ids([form.instance.id]), 'fixtures')
+
+    def delete_model(self, request, obj):
+        player_ids = self.player_ids([obj.id])
+        super().delete_model(request, obj)
+        dashboard.bump(player_ids, 'fixtures')
+
+    def delete_queryset(self, request, queryset):
+        player_ids = self.player_ids(queryset.values('id'))
+        super().delete_queryset(request, queryset)
+        dashboard.bump(player_ids, 'fixtures')
+
 
 # Register your models here.
 admin.site.register(Cohort)
 admin.site.register(GameMode)
 admin.site.register(TeamUP)
-admin.site.register(GameStage)
+admin.site.register(GameStage, BracketAdmin)
 admin.site.register(StageParticipants)
 admin.site.register(Round)
-admin.site.register(RoundPlayerStats)
+admin.site.register(RoundPlayerStats, RoundPlayerStatsAdmin)
 admin.site.register(TeamUPRound)
-admin.site.register(TeamUPRoundStats)
-admin.site.register(TeamUPPlayerRoundStats)
+admin.site.register(TeamUPRoundStats, TeamLeaderboardStatsAdmin)
+admin.site.register(TeamUPPlayerRoundStats, CareerStatsAdmin)
 admin.site.register(Notification)
-admin.site.register(Fixture)
-admin.site.register(TeamUPFixture)
+admin.site.register(Fixture, FixtureAdmin)
+admin.site.register(TeamUPFixture, FixtureAdmin)
 admin.site.register(MPesaTransaction)
 admin.site.register(TeamUPInvite)
 admin.site.register(FreeAgent)
 admin.site.register(SquadRecruitment)
-admin.site.register(JoinRequest)
\ No newline at end of file
+admin.site.register(JoinRequest)
+admin.site.register(LeaderboardEntry)
+admin.site.register(TeamLeaderboardEntry)
+admin.site.register(SquadCohortReadiness)
+admin.site.register(PaymentRequest)
+admin.site.register(MPesaCallback)
+admin.site.register(PlayerModeRank)
+admin.site.register(RankRecomputeRequest)
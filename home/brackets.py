@@ -0,0 +1,61 @@
+import time
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from users.models import User
+from .models import Fixture, GameStage, TeamUP, TeamUPFixture
+
+# Edits that bypass bump() (shell, raw SQL) reach the bracket within this many seconds
+BRACKET_TIMEOUT = 60 * 60
+
+
+def _version_key(cohort_id):
+    return f'bracket-version:{cohort_id}'
+
+
+def version(cohort_id):
+    """Returns the version the cohort's rendered bracket is cached under.
+
+    Like the dashboard counters, a missing version is seeded from the
+    clock so an evicted counter never reuses an old bracket's version.
+    """
+    key = _version_key(cohort_id)
+    found = cache.get(key)
+    if found is None:
+        cache.add(key, time.time_ns(), None)
+        found = cache.get(key)
+    return found
+
+
+def bump(cohort_ids):
+    """Invalidates the cached brackets of every cohort in cohort_ids."""
+    for cohort_id in cohort_ids:
+        try:
+            cache.incr(_version_key(cohort_id))
+        except ValueError:
+            pass
+
+
+def load(cohort):
+    """Returns the cohort's stages with their solo and team fixtures in five queries.
+
+    Each stage carries solo_fixtures and team_fixtures lists whose players
+    and teamups are prefetched, whatever the number of stages or fixtures.
+    """
+    return GameStage.objects.filter(cohort=cohort).order_by('order').prefetch_related(
+        Prefetch(
+            'fixtures',
+            queryset=Fixture.objects.filter(cohort=cohort).order_by('match_date', 'id').prefetch_related(
+                Prefetch('players', queryset=User.objects.only('id', 'gamer_tag'))
+            ),
+            to_attr='solo_fixtures',
+        ),
+        Prefetch(
+            'teamup_fixtures',
+            queryset=TeamUPFixture.objects.filter(cohort=cohort).order_by('match_date', 'id').prefetch_related(
+                Prefetch('teamups', queryset=TeamUP.objects.only('id', 'name'))
+            ),
+            to_attr='team_fixtures',
+        ),
+    )
@@ -0,0 +1,212 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Case, Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+
+from users.models import PersonalProfile
+from .models import RoundPlayerStats, TeamUPPlayerRoundStats, TeamUPRoundStats
+
+SUMMARY_TIMEOUT = 60 * 60 * 24
+RECENT_RESULTS = 10
+
+# RoundPlayerStats / TeamUPPlayerRoundStats field -> PersonalProfile counter
+CAREER_FIELDS = {'kills': 'total_kills', 'xp': 'total_xp', 'deaths': 'deaths'}
+
+
+def _as_int(value):
+    return int(value or 0)
+
+
+def _stat_deltas(stat, previous=None, sign=1):
+    previous = previous or {}
+    return {
+        counter: sign * (_as_int(getattr(stat, field)) - _as_int(previous.get(field)))
+        for field, counter in CAREER_FIELDS.items()
+    }
+
+
+def _ensure_profiles(player_ids):
+    existing = set(PersonalProfile.objects.filter(user_id__in=player_ids).values_list('user_id', flat=True))
+    PersonalProfile.objects.bulk_create(
+        [PersonalProfile(user_id=player_id) for player_id in player_ids if player_id not in existing],
+        ignore_conflicts=True,
+    )
+
+
+def _apply(deltas_by_player):
+    """Adds {player_id: {counter: delta}} to PersonalProfile in a single UPDATE.
+
+    Each counter is incremented with F() plus a per-player CASE, so
+    concurrent writers never overwrite each other's totals. Every listed
+    player's stats_version is bumped too, since any change to a result
+    (damage or rank included) invalidates their cached summary. Players
+    without a profile get one first.
+    """
+    if not deltas_by_player:
+        return
+    changed = {player_id: deltas for player_id, deltas in deltas_by_player.items() if any(deltas.values())}
+    with transaction.atomic():
+        _ensure_profiles(deltas_by_player)
+        PersonalProfile.objects.filter(user_id__in=deltas_by_player).update(
+            stats_version=F('stats_version') + 1,
+            **{
+                counter: F(counter) + Case(
+                    *[When(user_id=player_id, then=Value(deltas[counter])) for player_id, deltas in changed.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+                for counter in CAREER_FIELDS.values()
+            } if changed else {}
+        )
+
+
+def touch(player_ids):
+    """Invalidates the cached summaries of players whose results changed without a stat row write.
+
+    player_ids may be a list or a values_list queryset.
+    """
+    PersonalProfile.objects.filter(user_id__in=player_ids).update(stats_version=F('stats_version') + 1)
+
+
+def apply_stat(stat, previous=None):
+    """Folds a saved solo or team player stat row into its player's career totals.
+
+    previous holds the row's kills/xp/deaths before the save, or None when
+    the row was just created.
+    """
+    _apply({stat.player_id: _stat_deltas(stat, previous)})
+
+
+def _sum_deltas(stats, previous, sign=1):
+    deltas_by_player = {}
+    for stat in stats:
+        deltas = _stat_deltas(stat, previous.get(stat.player_id), sign)
+        totals = deltas_by_player.setdefault(stat.player_id, dict.fromkeys(CAREER_FIELDS.values(), 0))
+        for counter, delta in deltas.items():
+            totals[counter] += delta
+    return deltas_by_player
+
+
+def apply_stats(stats, previous):
+    """Bulk counterpart of apply_stat; previous maps player_id to its values before the save."""
+    _apply(_sum_deltas(stats, previous))
+
+
+def remove_stats(stats):
+    """Takes deleted stat rows back out of their players' career totals."""
+    _apply(_sum_deltas(stats, {}, sign=-1))
+
+
+def compute_totals():
+    """Returns {player_id: {counter: total}} recomputed from every solo and team stat row."""
+    totals = {}
+    for model in (RoundPlayerStats, TeamUPPlayerRoundStats):
+        rows = model.objects.values('player_id').annotate(
+            **{counter: Sum(field) for field, counter in CAREER_FIELDS.items()}
+        ).order_by()
+        for row in rows:
+            player_totals = totals.setdefault(row['player_id'], dict.fromkeys(CAREER_FIELDS.values(), 0))
+            for counter in CAREER_FIELDS.values():
+                player_totals[counter] += row[counter] or 0
+    return totals
+
+
+def rebuild(fix=True, batch_size=1000):
+    """Compares every profile's counters with compute_totals and, if fix, corrects them.
+
+    Returns the list of profiles that had drifted.
+    """
+    totals = compute_totals()
+    zero = dict.fromkeys(CAREER_FIELDS.values(), 0)
+    with transaction.atomic():
+        existing = set(PersonalProfile.objects.filter(user_id__in=totals).values_list('user_id', flat=True))
+        missing = [PersonalProfile(user_id=player_id, **totals[player_id]) for player_id in totals if player_id not in existing]
+        if fix:
+            PersonalProfile.objects.bulk_create(missing, ignore_conflicts=True, batch_size=batch_size)
+        created = {profile.user_id for profile in missing}
+
+        drifted = []
+        for profile in PersonalProfile.objects.only('id', 'user_id', *CAREER_FIELDS.values()).iterator(chunk_size=batch_size):
+            if profile.user_id in created:
+                continue
+            expected = totals.get(profile.user_id, zero)
+            if any(getattr(profile, counter) != value for counter, value in expected.items()):
+                for counter, value in expected.items():
+                    setattr(profile, counter, value)
+                drifted.append(profile)
+        if fix:
+            PersonalProfile.objects.bulk_update(drifted, list(CAREER_FIELDS.values()), batch_size=batch_size)
+    return missing + drifted
+
+
+def _recent(stats, rank_field):
+    return [
+        {
+            'match_date': stat.round_instance.match_date,
+            'stage_name': stat.round_instance.stage.name,
+            'team_name': stat.team.name if hasattr(stat, 'team_id') else None,
+            'rank': getattr(stat, rank_field),
+            'kills': stat.kills,
+            'damage': stat.damage,
+            'xp': stat.xp,
+            'time_alive': getattr(stat, 'time_alive_seconds', None),
+        }
+        for stat in stats
+    ]
+
+
+def build_summary(user):
+    """Computes a player's solo and team career stats plus their latest results from the stat rows."""
+    solo_stats = RoundPlayerStats.objects.filter(player=user).aggregate(
+        total_kills=Sum('kills'),
+        total_damage=Sum('damage'),
+        total_xp=Sum('xp'),
+        matches_played=Count('id'),
+        wins=Count('id', filter=Q(rank=1)),
+        total_time_alive=Sum('time_alive_seconds'),
+        avg_time_alive=Avg('time_alive_seconds'),
+    )
+    team_rank = Subquery(TeamUPRoundStats.objects.filter(
+        round_instance=OuterRef('round_instance'),
+        team=OuterRef('team')
+    ).values('rank')[:1])
+    team_rows = TeamUPPlayerRoundStats.objects.filter(player=user).annotate(team_rank=team_rank)
+    # Matches and wins come from the player's own rows, so a squad's
+    # results only count for the members who actually played
+    team_stats = team_rows.aggregate(
+        total_kills=Sum('kills'),
+        total_damage=Sum('damage'),
+        total_xp=Sum('xp'),
+        matches_played=Count('id'),
+        wins=Count('id', filter=Q(team_rank=1)),
+    )
+    recent_solo = RoundPlayerStats.objects.filter(player=user).select_related(
+        'round_instance__stage'
+    ).order_by('-round_instance__match_date')[:RECENT_RESULTS]
+    recent_team = team_rows.select_related('team', 'round_instance__stage').order_by(
+        '-round_instance__match_date'
+    )[:RECENT_RESULTS]
+    return {
+        'solo_stats': {
+            **{key: value or 0 for key, value in solo_stats.items()},
+            # None (rather than 0:00) when no round has a recorded time
+            'avg_time_alive': solo_stats['avg_time_alive'] and round(solo_stats['avg_time_alive']),
+        },
+        'team_stats': {key: value or 0 for key, value in team_stats.items()},
+        'recent_solo': _recent(recent_solo, 'rank'),
+        'recent_team': _recent(recent_team, 'team_rank'),
+    }
+
+
+def summary(user, profile=None):
+    """Returns build_summary(user), cached under the profile's stats_version.
+
+    Result writes bump the version instead of deleting the entry, so a
+    stale summary is never served and old keys simply expire.
+    """
+    version = profile.stats_version if profile is not None else 0
+    key = f'career-summary:{user.id}:{version}'
+    data = cache.get(key)
+    if data is None:
+        data = build_summary(user)
+        cache.set(key, data, SUMMARY_TIMEOUT)
+    return data
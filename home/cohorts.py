@@ -0,0 +1,54 @@
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Cohort
+
+PARTICIPANTS_TIMEOUT = 60 * 60 * 24
+
+
+def _key(cohort_id):
+    return f'cohort-participants:{cohort_id}'
+
+
+def join(cohort, profile):
+    """Enrols profile in cohort. Returns False if they were already enrolled.
+
+    The through row is written with get_or_create, so a double submit
+    never counts the same entrant twice.
+    """
+    _, created = Cohort.participants.through.objects.get_or_create(cohort_id=cohort.id, personalprofile_id=profile.id)
+    if created:
+        try:
+            cache.incr(_key(cohort.id))
+        except ValueError:
+            # Not cached yet: the next read counts it
+            pass
+    return created
+
+
+def forget(cohort_ids):
+    """Drops cached counters after enrolments whose number is unknown, e.g. bulk inserts ignoring conflicts."""
+    cache.delete_many([_key(cohort_id) for cohort_id in cohort_ids])
+
+
+def participant_counts(cohort_ids):
+    """Returns {cohort_id: participants}, counting only cache misses, in a single grouped query."""
+    cohort_ids = list(cohort_ids)
+    cached = cache.get_many([_key(cohort_id) for cohort_id in cohort_ids])
+    counts = {cohort_id: cached[_key(cohort_id)] for cohort_id in cohort_ids if _key(cohort_id) in cached}
+    missing = [cohort_id for cohort_id in cohort_ids if cohort_id not in counts]
+    if missing:
+        found = dict(
+            Cohort.participants.through.objects.filter(cohort_id__in=missing)
+            .values('cohort_id').annotate(count=Count('id')).order_by()
+            .values_list('cohort_id', 'count')
+        )
+        for cohort_id in missing:
+            counts[cohort_id] = found.get(cohort_id, 0)
+            # add() so a count that raced with a join never overwrites its increment
+            cache.add(_key(cohort_id), counts[cohort_id], PARTICIPANTS_TIMEOUT)
+    return counts
+
+
+def participant_count(cohort_id):
+    return participant_counts([cohort_id])[cohort_id]
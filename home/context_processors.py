@@ -1,4 +1,14 @@
+from django.core.handlers.asgi import ASGIRequest
+
+from . import notifications
+
+
 def unread_notifications(request):
     if request.user.is_authenticated:
-        return {'unread_count': request.user.notifications.filter(is_read=False).count()}
-    return {'unread_count': 0}
+        return {
+            # Served from a cached per-user counter, so most pages cost no query here
+            'unread_count': notifications.unread_count(request.user.id),
+            # Under WSGI a stream holds a worker for its whole lifetime, so only ASGI pages open one
+            'live_notifications': isinstance(request, ASGIRequest),
+        }
+    return {'unread_count': 0, 'live_notifications': False}
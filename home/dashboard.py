@@ -0,0 +1,122 @@
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from . import cohorts, readiness
+from .models import Cohort, Fixture, GameMode, RoundPlayerStats, TeamUP, TeamUPFixture, TeamUPInvite, TeamUPRoundStats
+
+FIXTURE_LIMIT = 10
+RESULT_LIMIT = 5
+
+# Sections rendered into per-user fragment caches. Pending invites stay
+# uncached: they are cheap and carry CSRF tokens.
+SECTIONS = ('cohorts', 'squads', 'fixtures', 'results')
+# Edits that bump no version (cohorts or game modes changed in the admin,
+# the shell) reach the dashboard within this many seconds
+FRAGMENT_TIMEOUT = 60 * 10
+
+
+def _version_key(section, user_id):
+    return f'dashboard-version:{section}:{user_id}'
+
+
+def versions(user_id):
+    """Returns {section: version} for user_id's dashboard fragments.
+
+    A missing counter is seeded from the clock rather than 0, so a counter
+    that was evicted never comes back at a version an old fragment used.
+    """
+    keys = {section: _version_key(section, user_id) for section in SECTIONS}
+    found = cache.get_many(keys.values())
+    for key in keys.values():
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return {section: found[key] for section, key in keys.items()}
+
+
+def bump(user_ids, *sections):
+    """Invalidates the given dashboard sections of every user in user_ids."""
+    for user_id in user_ids:
+        for section in sections:
+            try:
+                cache.incr(_version_key(section, user_id))
+            except ValueError:
+                # Never rendered, or evicted: the next read seeds a fresh version
+                pass
+
+
+def load(user):
+    """Returns the dashboard_view context for user in a fixed number of queries.
+
+    Everything the template touches is fetched up front: related rows via
+    select_related/prefetch_related, squad sizes as an annotation and cohort
+    membership as a set of ids, so the query count does not grow with the
+    number of squads, cohorts or fixtures. Sections are loaded lazily, so a
+    fragment served from the cache never runs its queries.
+    """
+    profile = getattr(user, 'profile', None)
+
+    def open_cohorts():
+        found = list(Cohort.objects.filter(is_open_to_join=True).order_by('-start_date'))
+        counts = cohorts.participant_counts(cohort.id for cohort in found)
+        for cohort in found:
+            cohort.participant_count = counts[cohort.id]
+        return found
+    active_cohorts = SimpleLazyObject(open_cohorts)
+
+    def joined_cohort_ids():
+        if profile is None:
+            return set()
+        return set(
+            profile.cohort_participants.filter(id__in=[cohort.id for cohort in active_cohorts]).values_list('id', flat=True)
+        )
+
+    def squads():
+        # Annotating before filtering keeps the count over every member, not just user
+        squads = list(
+            TeamUP.objects.annotate(player_count=Count('players')).filter(players=user).select_related('game_mode')
+        )
+        # Squad readiness for active cohorts, read from the persisted readiness table
+        resolved = readiness.lookup(squads, active_cohorts)
+        for squad in squads:
+            squad.readiness = [resolved[(squad.id, cohort.id)] for cohort in active_cohorts]
+        return squads
+    user_squads = SimpleLazyObject(squads)
+
+    # Fixtures from yesterday onwards, so just-played matches stay visible
+    since = timezone.now() - timedelta(days=1)
+    solo_fixtures = Fixture.objects.filter(players=user, match_date__gte=since).select_related('stage').order_by('match_date')[:FIXTURE_LIMIT]
+    # Filtering on a through-table subquery avoids joining players and a DISTINCT
+    squad_ids = TeamUP.players.through.objects.filter(user=user).values('teamup_id')
+    team_fixture_ids = TeamUPFixture.teamups.through.objects.filter(teamup_id__in=squad_ids).values('teamupfixture_id')
+    team_fixtures = TeamUPFixture.objects.filter(id__in=team_fixture_ids, match_date__gte=since).select_related(
+        'stage'
+    ).prefetch_related('teamups').order_by('match_date')[:FIXTURE_LIMIT]
+
+    recent_solo_results = RoundPlayerStats.objects.filter(player=user).select_related(
+        'round_instance__stage'
+    ).order_by('-round_instance__match_date')[:RESULT_LIMIT]
+    recent_team_results = TeamUPRoundStats.objects.filter(team_id__in=squad_ids).select_related(
+        'team'
+    ).order_by('-round_instance__match_date')[:RESULT_LIMIT]
+
+    return {
+        'profile': profile,
+        'dashboard_versions': versions(user.id),
+        'fragment_timeout': FRAGMENT_TIMEOUT,
+        'active_cohorts': active_cohorts,
+        'joined_cohort_ids': SimpleLazyObject(joined_cohort_ids),
+        'game_modes': GameMode.objects.all(),
+        'solo_fixtures': solo_fixtures,
+        'team_fixtures': team_fixtures,
+        'recent_solo_results': recent_solo_results,
+        'recent_team_results': recent_team_results,
+        'user_squads': user_squads,
+        'pending_invites': TeamUPInvite.objects.filter(invitee=user, status='PENDING').select_related('team', 'inviter'),
+        'squad_readiness': SimpleLazyObject(lambda: [row for squad in user_squads for row in squad.readiness]),
+    }
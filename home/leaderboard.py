@@ -0,0 +1,305 @@
+from itertools import product
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import LeaderboardEntry, RoundPlayerStats, TeamLeaderboardEntry, TeamUPRoundStats
+
+SCOPE_FIELDS = ('game_mode_id', 'cohort_id', 'stage_id')
+TOTAL_FIELDS = ('total_kills', 'total_damage', 'total_xp', 'matches_played', 'total_time_alive', 'timed_matches')
+TEAM_TOTAL_FIELDS = ('total_kills', 'total_damage', 'total_xp', 'wins', 'matches_played')
+# RoundPlayerStats fields the leaderboard totals are derived from
+STAT_FIELDS = ('kills', 'damage', 'xp', 'time_alive_seconds')
+TEAM_STAT_FIELDS = ('rank', 'kills', 'damage', 'xp')
+
+
+def _as_int(value):
+    return int(value or 0)
+
+
+def scopes_for(game_mode_id, cohort_id, stage_id):
+    """Yields every leaderboard scope a single result contributes to.
+
+    Each filter is either pinned to the result's value or left as None ("all"),
+    so one result feeds up to eight rows. A filter the result has no value for
+    (e.g. a round without a cohort) only ever contributes to the "all" rows.
+    """
+    values = dict(zip(SCOPE_FIELDS, (game_mode_id, cohort_id, stage_id)))
+    for mask in product((False, True), repeat=len(SCOPE_FIELDS)):
+        if any(pinned and values[field] is None for field, pinned in zip(SCOPE_FIELDS, mask)):
+            continue
+        yield {field: values[field] if pinned else None for field, pinned in zip(SCOPE_FIELDS, mask)}
+
+
+def scope_filter(mode_id=None, cohort_id=None, stage_id=None):
+    """Returns the queryset for one leaderboard filter combination, best first."""
+    return LeaderboardEntry.objects.filter(
+        game_mode_id=mode_id or None,
+        cohort_id=cohort_id or None,
+        stage_id=stage_id or None,
+        matches_played__gt=0,
+    ).order_by('-total_xp', '-total_kills', '-id')
+
+
+def team_scope_filter(mode_id=None, cohort_id=None, stage_id=None):
+    """Team counterpart of scope_filter."""
+    return TeamLeaderboardEntry.objects.filter(
+        game_mode_id=mode_id or None,
+        cohort_id=cohort_id or None,
+        stage_id=stage_id or None,
+        matches_played__gt=0,
+    ).order_by('-total_xp', '-total_kills', '-id')
+
+
+def _round_scope(round_instance):
+    return round_instance.stage.game_mode_id, round_instance.cohort_id, round_instance.stage_id
+
+
+def _lock_owners(model, owner_field, owner_ids):
+    """Locks the players' or squads' own rows until the transaction ends.
+
+    Scope rows are created on first write and their "all" columns are NULL,
+    which a unique constraint cannot guard, so writers of the same owner's
+    rows are serialized on the owner instead. Ids are locked in order so
+    concurrent writers cannot deadlock.
+    """
+    owner_model = model._meta.get_field(owner_field.removesuffix('_id')).related_model
+    list(owner_model.objects.select_for_update().filter(id__in=owner_ids).order_by('id').values_list('id', flat=True))
+
+
+def _apply_deltas(model, owner, round_instance, deltas):
+    """Adds deltas to every scope row of owner for round_instance, creating missing rows."""
+    if not any(deltas.values()):
+        return
+    with transaction.atomic():
+        (owner_field, owner_id), = owner.items()
+        _lock_owners(model, owner_field, [owner_id])
+        for scope in scopes_for(*_round_scope(round_instance)):
+            updated = model.objects.filter(**owner, **scope).update(
+                **{field: F(field) + delta for field, delta in deltas.items()}
+            )
+            if not updated:
+                model.objects.create(**owner, **scope, **deltas)
+
+
+def _apply_bulk_deltas(model, owner_field, round_instance, deltas_by_owner):
+    """Applies {owner_id: deltas} for one round with a single read and two bulk writes.
+
+    The owners are locked for the duration of the transaction, so
+    concurrent writers can neither lose each other's updates nor both
+    create the same missing scope row.
+    """
+    deltas_by_owner = {owner: deltas for owner, deltas in deltas_by_owner.items() if any(deltas.values())}
+    if not deltas_by_owner:
+        return
+    scopes = list(scopes_for(*_round_scope(round_instance)))
+    in_scope = Q()
+    for scope in scopes:
+        in_scope |= Q(**scope)
+    fields = list(next(iter(deltas_by_owner.values())))
+    now = timezone.now()
+
+    with transaction.atomic():
+        _lock_owners(model, owner_field, deltas_by_owner)
+        existing = {
+            (getattr(entry, owner_field),) + tuple(getattr(entry, field) for field in SCOPE_FIELDS): entry
+            for entry in model.objects.filter(in_scope, **{f'{owner_field}__in': deltas_by_owner})
+        }
+        changed, missing = [], []
+        for owner, deltas in deltas_by_owner.items():
+            for scope in scopes:
+                entry = existing.get((owner,) + tuple(scope[field] for field in SCOPE_FIELDS))
+                if entry is None:
+                    missing.append(model(**{owner_field: owner}, **scope, **deltas))
+                    continue
+                for field, delta in deltas.items():
+                    setattr(entry, field, getattr(entry, field) + delta)
+                entry.updated_at = now
+                changed.append(entry)
+        model.objects.bulk_update(changed, fields + ['updated_at'])
+        model.objects.bulk_create(missing)
+
+
+def _remove(model, owner_field, stats, deltas_for):
+    """Subtracts deleted stat rows from their owners' scope rows, one bulk write per round."""
+    by_round = {}
+    for stat in stats:
+        _, deltas_by_owner = by_round.setdefault(stat.round_instance_id, (stat.round_instance, {}))
+        totals = deltas_by_owner.setdefault(getattr(stat, owner_field), {})
+        for field, delta in deltas_for(stat, None).items():
+            totals[field] = totals.get(field, 0) - delta
+    for round_instance, deltas_by_owner in by_round.values():
+        _apply_bulk_deltas(model, owner_field, round_instance, deltas_by_owner)
+
+
+def _rollup(rows, owner_field, totals_for):
+    """Folds grouped aggregate rows into {(owner, *scope): [totals]} across all scopes."""
+    totals = {}
+    for row in rows:
+        for scope in scopes_for(
+            row['round_instance__stage__game_mode_id'],
+            row['round_instance__cohort_id'],
+            row['round_instance__stage_id'],
+        ):
+            key = (row[owner_field],) + tuple(scope[field] for field in SCOPE_FIELDS)
+            bucket = totals.setdefault(key, [0] * len(totals_for(row)))
+            for i, value in enumerate(totals_for(row)):
+                bucket[i] += value or 0
+    return totals
+
+
+def _replace_all(model, owner_field, totals, total_fields, batch_size):
+    entries = [
+        model(
+            **{owner_field: key[0]},
+            **dict(zip(SCOPE_FIELDS, key[1:])),
+            **dict(zip(total_fields, bucket))
+        )
+        for key, bucket in totals.items()
+    ]
+    with transaction.atomic():
+        model.objects.all().delete()
+        model.objects.bulk_create(entries, batch_size=batch_size)
+    return len(entries)
+
+
+def _stat_deltas(stat, previous):
+    previous = previous or {}
+    return {
+        'total_kills': _as_int(stat.kills) - _as_int(previous.get('kills')),
+        'total_damage': _as_int(stat.damage) - _as_int(previous.get('damage')),
+        'total_xp': _as_int(stat.xp) - _as_int(previous.get('xp')),
+        'matches_played': 0 if previous else 1,
+        'total_time_alive': _as_int(stat.time_alive_seconds) - _as_int(previous.get('time_alive_seconds')),
+        'timed_matches': int(stat.time_alive_seconds is not None) - int(previous.get('time_alive_seconds') is not None),
+    }
+
+
+def apply_stat(stat, previous=None):
+    """Folds a saved RoundPlayerStats into the leaderboard.
+
+    previous holds the row's kills/damage/xp/time_alive_seconds before the
+    save (None when the row was just created) so edits only apply their
+    difference.
+    """
+    _apply_deltas(LeaderboardEntry, {'player_id': stat.player_id}, stat.round_instance, _stat_deltas(stat, previous))
+
+
+def apply_stats(round_instance, stats, previous):
+    """Bulk counterpart of apply_stat for many players' results in one round.
+
+    previous maps player_id to that player's values before the save, and
+    omits players whose row was just created.
+    """
+    _apply_bulk_deltas(LeaderboardEntry, 'player_id', round_instance, {
+        stat.player_id: _stat_deltas(stat, previous.get(stat.player_id)) for stat in stats
+    })
+
+
+def remove_stats(stats):
+    """Takes deleted RoundPlayerStats rows back out of the leaderboard."""
+    _remove(LeaderboardEntry, 'player_id', stats, _stat_deltas)
+
+
+def _team_stat_deltas(team_stat, previous):
+    previous = previous or {}
+    was_win = bool(previous) and _as_int(previous.get('rank')) == 1
+    return {
+        'total_kills': _as_int(team_stat.kills) - _as_int(previous.get('kills')),
+        'total_damage': _as_int(team_stat.damage) - _as_int(previous.get('damage')),
+        'total_xp': _as_int(team_stat.xp) - _as_int(previous.get('xp')),
+        'wins': int(_as_int(team_stat.rank) == 1) - int(was_win),
+        'matches_played': 0 if previous else 1,
+    }
+
+
+def apply_team_stat(team_stat, previous=None):
+    """Folds a saved TeamUPRoundStats into the team leaderboard.
+
+    previous holds the row's rank/kills/damage/xp before the save, or None
+    when the row was just created.
+    """
+    _apply_deltas(TeamLeaderboardEntry, {'team_id': team_stat.team_id}, team_stat.round_instance,
+                  _team_stat_deltas(team_stat, previous))
+
+
+def apply_team_stats(round_instance, team_stats, previous):
+    """Bulk counterpart of apply_team_stat; previous maps team_id to its values before the save."""
+    _apply_bulk_deltas(TeamLeaderboardEntry, 'team_id', round_instance, {
+        team_stat.team_id: _team_stat_deltas(team_stat, previous.get(team_stat.team_id)) for team_stat in team_stats
+    })
+
+
+def remove_team_stats(team_stats):
+    """Takes deleted TeamUPRoundStats rows back out of the team leaderboard."""
+    _remove(TeamLeaderboardEntry, 'team_id', team_stats, _team_stat_deltas)
+
+
+def rebuild_leaderboard(batch_size=1000):
+    """Recomputes every LeaderboardEntry from RoundPlayerStats in one pass."""
+    rows = RoundPlayerStats.objects.values(
+        'player_id',
+        'round_instance__stage__game_mode_id',
+        'round_instance__cohort_id',
+        'round_instance__stage_id',
+    ).annotate(
+        kills=Sum('kills'),
+        damage=Sum('damage'),
+        xp=Sum('xp'),
+        matches=Count('id'),
+        time_alive=Sum('time_alive_seconds'),
+        timed=Count('time_alive_seconds'),
+    ).order_by()
+    totals = _rollup(rows, 'player_id', lambda row: (
+        row['kills'], row['damage'], row['xp'], row['matches'], row['time_alive'], row['timed']
+    ))
+    return _replace_all(LeaderboardEntry, 'player_id', totals, TOTAL_FIELDS, batch_size)
+
+
+def rebuild_team_leaderboard(batch_size=1000):
+    """Recomputes every TeamLeaderboardEntry from TeamUPRoundStats in one pass."""
+    rows = TeamUPRoundStats.objects.values(
+        'team_id',
+        'round_instance__stage__game_mode_id',
+        'round_instance__cohort_id',
+        'round_instance__stage_id',
+    ).annotate(
+        kills=Sum('kills'),
+        damage=Sum('damage'),
+        xp=Sum('xp'),
+        wins=Count('id', filter=Q(rank=1)),
+        matches=Count('id'),
+    ).order_by()
+    totals = _rollup(rows, 'team_id', lambda row: (row['kills'], row['damage'], row['xp'], row['wins'], row['matches']))
+    return _replace_all(TeamLeaderboardEntry, 'team_id', totals, TEAM_TOTAL_FIELDS, batch_size)
+
+
+def encode_cursor(entry, rank):
+    """Serializes the keyset position after entry, plus its display rank."""
+    return f"{entry.total_xp}:{entry.total_kills}:{entry.id}:{rank}"
+
+
+def decode_cursor(value):
+    """Parses an encode_cursor value into (xp, kills, id, rank), or None if malformed."""
+    try:
+        xp, kills, entry_id, rank = (int(part) for part in (value or '').split(':'))
+    except ValueError:
+        return None
+    return xp, kills, entry_id, rank
+
+
+def keyset_page(queryset, cursor, size):
+    """Returns (entries, has_more) for the page after cursor without an OFFSET scan.
+
+    queryset must be ordered by scope_filter's (-total_xp, -total_kills, -id).
+    """
+    if cursor:
+        xp, kills, entry_id = cursor[:3]
+        queryset = queryset.filter(
+            Q(total_xp__lt=xp)
+            | Q(total_xp=xp, total_kills__lt=kills)
+            | Q(total_xp=xp, total_kills=kills, id__lt=entry_id)
+        )
+    entries = list(queryset[:size + 1])
+    return entries[:size], len(entries) > size
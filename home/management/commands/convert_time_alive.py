@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from home import career, leaderboard, results
+from home.models import RoundPlayerStats
+
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = 'Parses legacy free-text RoundPlayerStats.time_alive values into time_alive_seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report values that cannot be parsed')
+
+    def handle(self, *args, **options):
+        pending = RoundPlayerStats.objects.filter(
+            time_alive_seconds__isnull=True, time_alive__gt=''
+        ).only('id', 'player_id', 'time_alive')
+
+        converted, errors = [], []
+        for stat in pending.iterator(chunk_size=options['batch_size']):
+            row_errors = []
+            stat.time_alive_seconds = results.parse_duration(stat.time_alive, f"Stat {stat.id}: {stat.time_alive!r}", row_errors)
+            if row_errors:
+                errors.extend(row_errors)
+            else:
+                converted.append(stat)
+
+        for error in errors[:MAX_REPORTED_ERRORS]:
+            self.stderr.write(error)
+        if len(errors) > MAX_REPORTED_ERRORS:
+            self.stderr.write(f"... and {len(errors) - MAX_REPORTED_ERRORS} more.")
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {len(converted)} values can be converted, {len(errors)} cannot.")
+            return
+
+        with transaction.atomic():
+            RoundPlayerStats.objects.bulk_update(converted, ['time_alive_seconds'], batch_size=options['batch_size'])
+            # Survival totals are denormalized per scope, so rebuild rather than apply deltas row by row
+            leaderboard.rebuild_leaderboard(batch_size=options['batch_size'])
+            career.touch({stat.player_id for stat in converted})
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted {len(converted)} time alive values; {len(errors)} could not be parsed."
+        ))
@@ -5,6 +5,8 @@ from django.utils import timezone
 from django.contrib.auth import get_user_model
 from home.models import Cohort, GameMode, GameStage, TeamUP, Fixture, TeamUPFixture, Round, RoundPlayerStats, TeamUPRound, TeamUPRoundStats, Counties
 from users.models import PersonalProfile
+from home.leaderboard import rebuild_leaderboard, rebuild_team_leaderboard
+from home import career, ranking
 
 User = get_user_model()
 
@@ -197,4 +199,9 @@ class Command(BaseCommand):
             )
             future_team_fixture.teamups.set(random.sample(teams, 3))
 
+        rebuild_leaderboard()
+        rebuild_team_leaderboard()
+        career.rebuild()
+        ranking.recompute()
+
         self.stdout.write(self.style.SUCCESS("Mock data generated successfully!"))
@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from home import career, dashboard, leaderboard, ranking, results
+from home.models import Fixture, Notification, RoundPlayerStats, TeamUP, TeamUPFixture, TeamUPPlayerRoundStats, TeamUPRoundStats
+from users.models import User
+from users.search import normalize_tag
+
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = "Imports a lobby's results from a CSV or JSON-lines file exported by the game client"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--fixture', type=int, help='Solo Fixture id; rows need gamer_tag and rank')
+        target.add_argument('--team-fixture', type=int, help='TeamUPFixture id; rows need team, team_rank and gamer_tag')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Validate and time the import, then roll it back')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'jsonl')
+        if not os.path.exists(options['path']):
+            raise CommandError(f"No such file: {options['path']}")
+
+        # One query maps every gamer tag to its user, so rows never hit the users table
+        self.users = {
+            tag: (user_id, gamer_tag)
+            for tag, user_id, gamer_tag in User.objects.values_list('gamer_tag_normalized', 'id', 'gamer_tag')
+        }
+        self.errors = []
+        self.chunk_size = options['chunk_size']
+
+        started = time.monotonic()
+        with transaction.atomic():
+            if options['fixture']:
+                fixture = Fixture.objects.select_related('stage__game_mode', 'cohort').filter(id=options['fixture']).first()
+                if fixture is None:
+                    raise CommandError(f"Fixture {options['fixture']} does not exist.")
+                imported = self.import_solo(fixture, self.read_rows(options['path'], fmt))
+            else:
+                fixture = TeamUPFixture.objects.select_related('stage__game_mode', 'cohort').filter(id=options['team_fixture']).first()
+                if fixture is None:
+                    raise CommandError(f"Team fixture {options['team_fixture']} does not exist.")
+                imported = self.import_team(fixture, self.read_rows(options['path'], fmt))
+
+            if self.errors:
+                for error in self.errors[:MAX_REPORTED_ERRORS]:
+                    self.stderr.write(error)
+                if len(self.errors) > MAX_REPORTED_ERRORS:
+                    self.stderr.write(f"... and {len(self.errors) - MAX_REPORTED_ERRORS} more.")
+                raise CommandError(f"{len(self.errors)} invalid rows; nothing was imported.")
+            if options['dry_run']:
+                transaction.set_rollback(True)
+            else:
+                ranking.recompute([fixture.stage.game_mode_id])
+
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else imported
+        prefix = "Dry run: validated" if options['dry_run'] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {imported} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)."
+        ))
+
+    def read_rows(self, path, fmt):
+        """Yields (line number, row dict or None) without reading the whole file into memory."""
+        with open(path, newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                reader = csv.DictReader(f)
+                for row in reader:
+                    yield reader.line_num, row
+                return
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+
+    def resolve_player(self, line_number, row):
+        player = self.users.get(normalize_tag(str(row.get('gamer_tag') or '')))
+        if player is None:
+            self.errors.append(f"Line {line_number}: unknown gamer tag {row.get('gamer_tag')!r}.")
+        return player
+
+    def parse_stats(self, line_number, row, fields):
+        errors = []
+        values = {
+            field: results.parse_count(row.get(field) or 0, f"Line {line_number}: {field}", errors)
+            for field in fields
+        }
+        self.errors.extend(errors)
+        return None if errors else values
+
+    def import_solo(self, fixture, rows):
+        round_instance = results.round_for_fixture(fixture)
+        recorded = set(round_instance.teamup_stats.values_list('player_id', flat=True))
+        entrants = set(fixture.players.values_list('id', flat=True))
+        seen, ranks, chunk, imported = set(), set(), [], 0
+
+        for line_number, row in rows:
+            if row is None:
+                self.errors.append(f"Line {line_number}: not a JSON object.")
+                continue
+            player = self.resolve_player(line_number, row)
+            values = self.parse_stats(line_number, row, results.SOLO_STAT_FIELDS)
+            errors = []
+            time_alive = results.parse_duration(row.get('time_alive'), f"Line {line_number}: time_alive", errors)
+            self.errors.extend(errors)
+            if player is None or values is None or errors:
+                continue
+            player_id, gamer_tag = player
+            if player_id not in entrants:
+                self.errors.append(f"Line {line_number}: {gamer_tag} is not playing this fixture.")
+                continue
+            if player_id in recorded:
+                self.errors.append(f"Line {line_number}: {gamer_tag} already has results for this round.")
+                continue
+            if player_id in seen:
+                self.errors.append(f"Line {line_number}: {gamer_tag} appears more than once.")
+                continue
+            if values['rank'] < 1 or values['rank'] in ranks:
+                self.errors.append(f"Line {line_number}: rank {values['rank']} is invalid or already taken.")
+                continue
+            seen.add(player_id)
+            ranks.add(values['rank'])
+
+            chunk.append((gamer_tag, RoundPlayerStats(
+                round_instance=round_instance, player_id=player_id,
+                time_alive_seconds=time_alive, **values
+            )))
+            if len(chunk) >= self.chunk_size:
+                imported += self.flush_solo(round_instance, chunk)
+                chunk = []
+        return imported + self.flush_solo(round_instance, chunk)
+
+    def flush_solo(self, round_instance, chunk):
+        # Once a row is invalid the import will roll back, so stop writing and just validate
+        if not chunk or self.errors:
+            return len(chunk)
+        stats = [stat for _, stat in chunk]
+        RoundPlayerStats.objects.bulk_create(stats)
+        round_instance.participants.add(*[stat.player_id for stat in stats])
+        leaderboard.apply_stats(round_instance, stats, {})
+        career.apply_stats(stats, {})
+        Notification.objects.bulk_create([
+            Notification(
+                recipient_id=stat.player_id,
+                message=f"Your stats for {round_instance.stage.name} have been updated.",
+                notification_type='RESULT',
+                link=f"/analytics/{gamer_tag}/"
+            )
+            for gamer_tag, stat in chunk
+        ])
+        return len(chunk)
+
+    def import_team(self, fixture, rows):
+        round_instance = results.team_round_for_fixture(fixture)
+        teams = {team.name.lower(): team for team in fixture.teamups.all()}
+        rosters = {team.id: set() for team in teams.values()}
+        for team_id, user_id in TeamUP.players.through.objects.filter(teamup_id__in=rosters).values_list('teamup_id', 'user_id'):
+            rosters[team_id].add(user_id)
+        recorded = set(round_instance.team_stats.values_list('team_id', flat=True))
+        seen, team_ranks, totals, chunk, imported = set(), {}, {}, [], 0
+
+        for line_number, row in rows:
+            if row is None:
+                self.errors.append(f"Line {line_number}: not a JSON object.")
+                continue
+            team = teams.get(str(row.get('team') or '').strip().lower())
+            if team is None:
+                self.errors.append(f"Line {line_number}: {row.get('team')!r} is not playing this fixture.")
+                continue
+            if team.id in recorded:
+                self.errors.append(f"Line {line_number}: {team.name} already has results for this round.")
+                continue
+            player = self.resolve_player(line_number, row)
+            rank = self.parse_stats(line_number, {'team_rank': row.get('team_rank')}, ('team_rank',))
+            values = self.parse_stats(line_number, row, results.TEAM_MEMBER_FIELDS)
+            if player is None or rank is None or values is None:
+                continue
+            player_id, gamer_tag = player
+            if player_id not in rosters[team.id]:
+                self.errors.append(f"Line {line_number}: {gamer_tag} is not on {team.name}'s roster.")
+                continue
+            if team_ranks.setdefault(team.id, rank['team_rank']) != rank['team_rank']:
+                self.errors.append(f"Line {line_number}: {team.name} has conflicting squad ranks.")
+                continue
+            if player_id in seen:
+                self.errors.append(f"Line {line_number}: {gamer_tag} appears more than once.")
+                continue
+            seen.add(player_id)
+
+            team_totals = totals.setdefault(team.id, dict.fromkeys(results.TEAM_MEMBER_FIELDS, 0))
+            for field, value in values.items():
+                team_totals[field] += value
+            chunk.append((gamer_tag, TeamUPPlayerRoundStats(
+                round_instance=round_instance, team=team, player_id=player_id, **values
+            )))
+            if len(chunk) >= self.chunk_size:
+                imported += self.flush_team(round_instance, chunk)
+                chunk = []
+        imported += self.flush_team(round_instance, chunk)
+
+        ranks = list(team_ranks.values())
+        if any(rank < 1 for rank in ranks) or len(set(ranks)) != len(ranks):
+            self.errors.append("Squad ranks must be unique and at least 1.")
+        if not self.errors:
+            team_stats = TeamUPRoundStats.objects.bulk_create([
+                TeamUPRoundStats(round_instance=round_instance, team_id=team_id, rank=team_ranks[team_id], **team_totals)
+                for team_id, team_totals in totals.items()
+            ])
+            leaderboard.apply_team_stats(round_instance, team_stats, {})
+            dashboard.bump(
+                TeamUP.players.through.objects.filter(teamup_id__in=totals).values_list('user_id', flat=True), 'results'
+            )
+        return imported
+
+    def flush_team(self, round_instance, chunk):
+        if not chunk or self.errors:
+            return len(chunk)
+        stats = [stat for _, stat in chunk]
+        TeamUPPlayerRoundStats.objects.bulk_create(stats)
+        career.apply_stats(stats, {})
+        Notification.objects.bulk_create([
+            Notification(
+                recipient_id=stat.player_id,
+                message=f"Results recorded for your team match in {round_instance.stage.name}.",
+                notification_type='RESULT',
+                link=f"/analytics/{gamer_tag}/"
+            )
+            for gamer_tag, stat in chunk
+        ])
+        return len(chunk)
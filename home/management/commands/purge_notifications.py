@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from home import notifications
+
+
+class Command(BaseCommand):
+    help = 'Deletes read notifications older than the retention window in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Keep read notifications for this many days')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = notifications.purge_read(timedelta(days=options['days']), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} read notifications older than {options['days']} days."))
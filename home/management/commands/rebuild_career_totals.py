@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from home.career import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recomputes PersonalProfile career kills, XP and deaths from every solo and team stat row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report drifted profiles; exit non-zero if any')
+
+    def handle(self, *args, **options):
+        drifted = rebuild(fix=not options['check'])
+        if options['check']:
+            for profile in drifted[:20]:
+                self.stdout.write(f"Player {profile.user_id}: expected kills={profile.total_kills} xp={profile.total_xp} deaths={profile.deaths}")
+            if drifted:
+                raise CommandError(f"{len(drifted)} profiles have drifted career totals.")
+            self.stdout.write(self.style.SUCCESS("Career totals are consistent."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Career totals corrected for {len(drifted)} profiles."))
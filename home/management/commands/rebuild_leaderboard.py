@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from home.leaderboard import rebuild_leaderboard, rebuild_team_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized solo and squad leaderboard tables from recorded stats'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding leaderboard entries...")
+        count = rebuild_leaderboard()
+        team_count = rebuild_team_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f"Leaderboard rebuilt with {count} player and {team_count} squad entries."))
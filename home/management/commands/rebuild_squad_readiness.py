@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from home.readiness import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recomputes persisted squad readiness from successful M-Pesa payments and current rosters'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding squad readiness...")
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Squad readiness rebuilt for {count} squad/cohort pairs."))
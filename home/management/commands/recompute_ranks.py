@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import ranking
+
+
+class Command(BaseCommand):
+    help = 'Recomputes per-game-mode player ranks and the overall PersonalProfile.rank'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', type=int, action='append', dest='modes', help='Only re-rank this game mode id (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        changed = ranking.recompute(options['modes'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Ranks recomputed in {time.monotonic() - started:.2f}s; {changed} overall ranks changed."
+        ))
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import mpesa, payments
+
+
+class Command(BaseCommand):
+    help = 'Queries Daraja for M-Pesa transactions stuck in PENDING and settles the ones that finished'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=5, help='Only query transactions pending for this many minutes')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent STK queries')
+        parser.add_argument('--rate', type=float, default=5.0, help='Maximum STK queries per second')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds to sleep between passes')
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+
+    def handle(self, *args, **options):
+        client = mpesa.get_client()
+        if client is None:
+            raise CommandError("M-Pesa credentials not configured.")
+
+        while True:
+            started = time.monotonic()
+            metrics = payments.reconcile(
+                older_than=timedelta(minutes=options['older_than']),
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                rate=options['rate'],
+                client=client,
+            )
+            if metrics['queried']:
+                self.stdout.write(
+                    f"Queried {metrics['queried']} pending transactions in {time.monotonic() - started:.1f}s: "
+                    f"{metrics['success']} succeeded, {metrics['failed']} failed, "
+                    f"{metrics['pending']} still pending, {metrics['errors']} errors."
+                )
+            if options['once']:
+                break
+            time.sleep(options['interval'])
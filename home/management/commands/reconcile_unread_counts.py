@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import notifications
+
+
+class Command(BaseCommand):
+    help = 'Corrects cached unread-notification counters that drifted from the notifications table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=600.0, help='Seconds to sleep between passes')
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            corrected = notifications.reconcile(batch_size=options['batch_size'])
+            if corrected or options['once']:
+                self.stdout.write(f"Corrected {corrected} unread-notification counters.")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import payments
+
+
+class Command(BaseCommand):
+    help = 'Applies queued M-Pesa callbacks from the inbox in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the inbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the inbox once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = payments.apply_callbacks(batch_size=options['batch_size'])
+            if processed:
+                self.stdout.write(f"Processed {processed} callbacks.")
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import payments
+
+
+class Command(BaseCommand):
+    help = 'Sends queued M-Pesa STK pushes in the background'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = payments.dispatch(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} STK pushes, {failed} failed.")
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
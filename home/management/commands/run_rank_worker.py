@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import ranking
+
+
+class Command(BaseCommand):
+    help = 'Recomputes player ranks for game modes queued by results submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            game_mode_ids = ranking.process_pending()
+            if game_mode_ids:
+                self.stdout.write(
+                    f"Re-ranked game modes {', '.join(map(str, game_mode_ids))} in {time.monotonic() - started:.2f}s."
+                )
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
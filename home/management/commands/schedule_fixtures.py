@@ -0,0 +1,41 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from home import scheduler
+from home.models import GameStage
+
+
+class Command(BaseCommand):
+    help = "Snake-seeds a GameStage's StageParticipants into lobbies and bulk-creates their fixtures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('stage', type=int, help='GameStage id')
+        parser.add_argument('--start', required=True, help='First time slot, e.g. "2026-11-01 18:00"')
+        parser.add_argument('--slots', type=int, default=1, help='Number of time slots lobbies are spread over')
+        parser.add_argument('--interval', type=int, default=60, help='Minutes between time slots')
+        parser.add_argument('--lobby-size', type=int, help='Entrants per lobby; defaults to one derived from the game mode')
+        parser.add_argument('--replace', action='store_true', help="Delete the stage's existing fixtures first")
+
+    def handle(self, *args, **options):
+        stage = GameStage.objects.select_related('game_mode').filter(id=options['stage']).first()
+        if stage is None:
+            raise CommandError(f"Stage {options['stage']} does not exist.")
+        try:
+            start = datetime.fromisoformat(options['start'])
+        except ValueError:
+            raise CommandError(f"Invalid --start: {options['start']}")
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        slots = [start + timedelta(minutes=options['interval'] * i) for i in range(options['slots'])]
+
+        started = time.monotonic()
+        try:
+            fixtures = scheduler.schedule(stage, slots, options['lobby_size'], options['replace'])
+        except scheduler.SchedulingError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Scheduled {len(fixtures)} lobbies for {stage.name} in {time.monotonic() - started:.2f}s."
+        ))
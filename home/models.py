@@ -50,35 +50,13 @@ class TeamUP(models.Model):
     
     def get_payment_status(self, cohort):
         """Returns a list of dictionaries with player payment status for a cohort."""
-        status = []
-        for player in self.players.all():
-            has_paid = MPesaTransaction.objects.filter(
-                user=player,
-                cohort=cohort,
-                game_mode=self.game_mode,
-                team=self,
-                status='SUCCESS'
-            ).exists()
-            status.append({'player': player, 'paid': has_paid})
-        return status
+        from .readiness import resolve
+        return resolve([(self, cohort)])[(self.id, cohort.id)]['statuses']
 
     def is_ready(self, cohort):
         """Checks if the squad is full and all members have paid for the cohort."""
-        if self.players.count() < self.game_mode.max_players:
-            return False
-        
-        # Check if all players have at least one successful payment for this specific cohort and team
-        for player in self.players.all():
-            paid = MPesaTransaction.objects.filter(
-                user=player,
-                cohort=cohort,
-                game_mode=self.game_mode,
-                team=self,
-                status='SUCCESS'
-            ).exists()
-            if not paid:
-                return False
-        return True
+        from .readiness import resolve
+        return resolve([(self, cohort)])[(self.id, cohort.id)]['is_ready']
 
     def __str__(self):
         return self.name    
@@ -136,13 +114,49 @@ class RoundPlayerStats(models.Model):
     kills = models.IntegerField()
     deaths = models.IntegerField()
     damage = models.IntegerField(default=0, null=True, blank=True)
+    # Free-text value from before time_alive_seconds existed; convert_time_alive parses it
     time_alive = models.CharField(max_length=20, null=True, blank=True, help_text="e.g. 12:45")
+    time_alive_seconds = models.PositiveIntegerField(null=True, blank=True)
     xp= models.IntegerField()
     
     def __str__(self):
         return f"{self.player.gamer_tag} - {self.round_instance.stage.name} - {self.rank}"
     
 
+class LeaderboardEntry(models.Model):
+    """Denormalized solo totals for one player within one leaderboard scope.
+
+    A null game_mode, cohort or stage means the row spans every value of that
+    filter, so each filter combination on the leaderboard is a plain indexed
+    ORDER BY over its own rows. Maintained by home.leaderboard.
+    """
+    player = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='leaderboard_entries')
+    game_mode = models.ForeignKey(GameMode, null=True, blank=True, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    cohort = models.ForeignKey(Cohort, null=True, blank=True, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    stage = models.ForeignKey(GameStage, null=True, blank=True, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    total_kills = models.IntegerField(default=0)
+    total_damage = models.IntegerField(default=0)
+    total_xp = models.IntegerField(default=0)
+    matches_played = models.IntegerField(default=0)
+    # Survival totals only count rounds with a recorded time alive
+    total_time_alive = models.IntegerField(default=0)
+    timed_matches = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['game_mode', 'cohort', 'stage', '-total_xp', '-total_kills', '-id'], name='leaderboard_scope_rank_idx'),
+            models.Index(fields=['player', 'game_mode', 'cohort', 'stage'], name='leaderboard_player_scope_idx'),
+        ]
+
+    @property
+    def avg_time_alive(self):
+        return self.total_time_alive // self.timed_matches if self.timed_matches else None
+
+    def __str__(self):
+        return f"{self.player.gamer_tag} - {self.total_xp} XP"
+
+
 class TeamUPRound(models.Model):
     fixture = models.OneToOneField(TeamUPFixture, on_delete=models.SET_NULL, null=True, blank=True, related_name='round_result')
     cohort = models.ForeignKey(Cohort,null=True, blank=True, on_delete=models.CASCADE, related_name='teamup_cohort')
@@ -178,6 +192,28 @@ class TeamUPPlayerRoundStats(models.Model):
     def __str__(self):
         return f"{self.player.gamer_tag} in {self.team.name} - {self.kills} Kills"
 
+class TeamLeaderboardEntry(models.Model):
+    """Denormalized squad totals per (game mode, cohort, stage) scope, mirroring LeaderboardEntry."""
+    team = models.ForeignKey('home.TeamUP', on_delete=models.CASCADE, related_name='leaderboard_entries')
+    game_mode = models.ForeignKey(GameMode, null=True, blank=True, on_delete=models.CASCADE, related_name='team_leaderboard_entries')
+    cohort = models.ForeignKey(Cohort, null=True, blank=True, on_delete=models.CASCADE, related_name='team_leaderboard_entries')
+    stage = models.ForeignKey(GameStage, null=True, blank=True, on_delete=models.CASCADE, related_name='team_leaderboard_entries')
+    total_kills = models.IntegerField(default=0)
+    total_damage = models.IntegerField(default=0)
+    total_xp = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    matches_played = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['game_mode', 'cohort', 'stage', '-total_xp', '-total_kills', '-id'], name='team_lb_scope_rank_idx'),
+            models.Index(fields=['team', 'game_mode', 'cohort', 'stage'], name='team_lb_team_scope_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.team.name} - {self.total_xp} XP"
+
 class TeamUPInvite(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -193,6 +229,14 @@ class TeamUPInvite(models.Model):
     def __str__(self):
         return f"Invite: {self.inviter} -> {self.invitee} for {self.team.name}"
 
+class NotificationManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        from .notifications import count_new
+        objs = super().bulk_create(objs, *args, **kwargs)
+        count_new(objs)
+        return objs
+
+
 class Notification(models.Model):
     TYPE_CHOICES = [
         ('FIXTURE', 'New Fixture'),
@@ -209,8 +253,22 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = NotificationManager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read', 'created_at'], name='notification_inbox_idx'),
+            models.Index(fields=['is_read', 'created_at'], name='notification_retention_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Saves and, for a new notification, bumps the recipient's cached unread counter."""
+        from .notifications import count_new
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            count_new([self])
 
 class MPesaTransaction(models.Model):
     STATUS_CHOICES = [
@@ -232,9 +290,115 @@ class MPesaTransaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at', 'id'], name='mpesa_status_age_idx'),
+        ]
+
     def __str__(self):
         return f"Payment {self.checkout_request_id} - {self.status}"
 
+class MPesaCallback(models.Model):
+    """Append-only inbox of raw Daraja STK callbacks, applied in batches by home.payments."""
+    checkout_request_id = models.CharField(max_length=100, blank=True, db_index=True)
+    payload = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='mpesa_callback_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id or self.id} - {self.outcome or 'unprocessed'}"
+
+class PaymentRequest(models.Model):
+    """A queued STK push, sent to Daraja by the payment worker (see home.payments)."""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    ]
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='payment_requests')
+    cohort = models.ForeignKey(Cohort, on_delete=models.CASCADE, related_name='payment_requests')
+    game_mode = models.ForeignKey(GameMode, on_delete=models.CASCADE, related_name='payment_requests')
+    team = models.ForeignKey(TeamUP, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_requests')
+    phone_number = models.CharField(max_length=15)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    transaction = models.OneToOneField(MPesaTransaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_request')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='payment_request_queue_idx'),
+        ]
+
+    @property
+    def progress(self):
+        """Player-facing state: the request's own status until Safaricom reports back on the push."""
+        if self.status == 'SENT' and self.transaction and self.transaction.status != 'PENDING':
+            return 'COMPLETED' if self.transaction.status == 'SUCCESS' else 'FAILED'
+        return self.status
+
+    @property
+    def is_final(self):
+        return self.progress in ('COMPLETED', 'FAILED')
+
+    def __str__(self):
+        return f"Payment request {self.id} - {self.status}"
+
+class SquadCohortReadiness(models.Model):
+    """Persisted payment readiness of a squad for a cohort, refreshed by home.readiness."""
+    team = models.ForeignKey(TeamUP, on_delete=models.CASCADE, related_name='cohort_readiness')
+    cohort = models.ForeignKey(Cohort, on_delete=models.CASCADE, related_name='squad_readiness')
+    paid_count = models.PositiveIntegerField(default=0)
+    roster_size = models.PositiveIntegerField(default=0)
+    total_needed = models.PositiveIntegerField(default=0)
+    is_ready = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('team', 'cohort')
+
+    def __str__(self):
+        return f"{self.team.name} in {self.cohort.name}: {self.paid_count}/{self.total_needed} paid"
+
+class PlayerModeRank(models.Model):
+    """A player's standing within one game mode, recomputed in bulk by home.ranking.
+
+    A null game_mode holds the overall standing, which is copied onto
+    PersonalProfile.rank.
+    """
+    player = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='mode_ranks')
+    game_mode = models.ForeignKey(GameMode, null=True, blank=True, on_delete=models.CASCADE, related_name='player_ranks')
+    rank = models.PositiveIntegerField()
+    total_xp = models.IntegerField(default=0)
+    total_kills = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('player', 'game_mode')
+        indexes = [
+            models.Index(fields=['game_mode', 'rank'], name='player_mode_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.player.gamer_tag} - #{self.rank} in {self.game_mode or 'Overall'}"
+
+class RankRecomputeRequest(models.Model):
+    """A game mode whose standings are stale, queued by result saves for the rank worker (see home.ranking)."""
+    game_mode = models.ForeignKey(GameMode, on_delete=models.CASCADE, related_name='rank_recompute_requests')
+    requested_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Re-rank {self.game_mode} requested {self.requested_at:%Y-%m-%d %H:%M}"
+
 class FreeAgent(models.Model):
     user = models.OneToOneField('users.User', on_delete=models.CASCADE, related_name='free_agent_profile')
     game_modes = models.ManyToManyField(GameMode, related_name='free_agents')
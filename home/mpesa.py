@@ -0,0 +1,155 @@
+import base64
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PRODUCTION_URL = "https://api.safaricom.co.ke"
+SANDBOX_URL = "https://sandbox.safaricom.co.ke"
+
+
+class MPesaError(Exception):
+    """Raised when Daraja cannot be reached or returns an unusable response."""
+
+
+class MPesaClient:
+    """Daraja API client sharing one keep-alive connection pool and access token.
+
+    The OAuth token is cached until TOKEN_REFRESH_MARGIN seconds before it
+    expires; concurrent callers that find it stale wait on a single refresh
+    instead of each requesting their own.
+    """
+    TOKEN_REFRESH_MARGIN = 60
+    DEFAULT_TIMEOUT = (3.05, 15)  # (connect, read) seconds
+
+    def __init__(self, consumer_key, consumer_secret, shortcode, passkey, callback_url, base_url=SANDBOX_URL,
+                 timeout=DEFAULT_TIMEOUT, pool_size=10):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.shortcode = shortcode
+        self.passkey = passkey
+        self.callback_url = callback_url
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Builds a client from the MPESA_* environment variables, or returns None if any are missing."""
+        credentials = {
+            'consumer_key': os.getenv('MPESA_CONSUMER_KEY'),
+            'consumer_secret': os.getenv('MPESA_CONSUMER_SECRET'),
+            'shortcode': os.getenv('MPESA_PAYBILL'),
+            'passkey': os.getenv('MPESA_PASSKEY'),
+            'callback_url': os.getenv('MPESA_CALLBACK_URL'),
+        }
+        if not all(credentials.values()):
+            return None
+        mpesa_env = os.getenv('MPESA_ENVIRONMENT', 'sandbox')
+        base_url = os.getenv('MPESA_BASE_URL') or (PRODUCTION_URL if mpesa_env == 'production' else SANDBOX_URL)
+        return cls(base_url=base_url, **credentials)
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise MPesaError(f"Daraja request to {path} failed: {e}") from e
+
+    def get_access_token(self):
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        with self._token_lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._token and time.monotonic() < self._token_expires_at:
+                return self._token
+            data = self._request(
+                'GET', '/oauth/v1/generate',
+                params={'grant_type': 'client_credentials'},
+                auth=(self.consumer_key, self.consumer_secret),
+            )
+            token = data.get('access_token')
+            if not token:
+                raise MPesaError(f"Daraja returned no access token: {data}")
+            expires_in = int(data.get('expires_in') or 3599)
+            self._token = token
+            self._token_expires_at = time.monotonic() + max(expires_in - self.TOKEN_REFRESH_MARGIN, 0)
+            return token
+
+    def _authorized(self, method, path, payload):
+        headers = {"Authorization": f"Bearer {self.get_access_token()}"}
+        return self._request(method, path, json=payload, headers=headers)
+
+    def _password(self, timestamp):
+        return base64.b64encode(f"{self.shortcode}{self.passkey}{timestamp}".encode()).decode()
+
+    def stk_push(self, amount, phone_number, account_reference, description):
+        """Sends an STK push prompt and returns Daraja's response body."""
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return self._authorized('POST', '/mpesa/stkpush/v1/processrequest', {
+            "BusinessShortCode": self.shortcode,
+            "Password": self._password(timestamp),
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": amount,
+            "PartyA": phone_number,
+            "PartyB": self.shortcode,
+            "PhoneNumber": phone_number,
+            "CallBackURL": self.callback_url,
+            "AccountReference": account_reference,
+            "TransactionDesc": description,
+        })
+
+    def stk_query(self, checkout_request_id):
+        """Asks Daraja for the outcome of an earlier STK push and returns its response body."""
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return self._authorized('POST', '/mpesa/stkpushquery/v1/query', {
+            "BusinessShortCode": self.shortcode,
+            "Password": self._password(timestamp),
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        })
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at most rate per second apart across all callers."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next_at = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide client so every request reuses the same pool and token, or None if unconfigured."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MPesaClient.from_env()
+    return _client
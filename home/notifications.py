@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+from collections import Counter
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from users.models import User
+from .models import Notification
+
+UNREAD_TIMEOUT = 60 * 60 * 24 * 7
+STREAM_QUEUE_SIZE = 100
+
+
+class Broker:
+    """In-process pub/sub delivering notification events to open SSE streams.
+
+    Subscribers are asyncio queues owned by the ASGI event loop, while
+    publishers are usually sync views running in a worker thread, so
+    events are handed over with call_soon_threadsafe. Only clients
+    connected to the process that created a notification receive it;
+    the others catch up from the unread count on their next event or
+    page load.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_deliver, queue, event)
+            except RuntimeError:
+                # The stream's loop has shut down; its finally block will unsubscribe it
+                pass
+
+
+def _deliver(queue, event):
+    # A client too slow to drain its queue misses events rather than growing memory
+    if not queue.full():
+        queue.put_nowait(event)
+
+
+broker = Broker()
+
+
+def _key(user_id):
+    return f'unread-notifications:{user_id}'
+
+
+def unread_count(user_id):
+    """Returns the user's unread notification count, counting in the database only on a cache miss."""
+    count = cache.get(_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+        # add() so a count that raced with an increment never overwrites it
+        cache.add(_key(user_id), count, UNREAD_TIMEOUT)
+    return count
+
+
+def _adjust(deltas):
+    """Applies {user_id: delta} to the cached counters that exist.
+
+    Missing counters are left alone: the next unread_count recounts them.
+    A counter that would go negative has drifted, so it is dropped instead.
+    """
+    for user_id, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            count = cache.incr(_key(user_id), delta)
+        except ValueError:
+            continue
+        if count < 0:
+            cache.delete(_key(user_id))
+
+
+def format_event(event):
+    """Encodes an event dict as one Server-Sent Events message named after its type."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def _publish_unread(user_id):
+    if broker.has_subscribers(user_id):
+        broker.publish(user_id, {'type': 'unread', 'unread': cache.get(_key(user_id))})
+
+
+def _publish_new(notifications):
+    for notification in notifications:
+        if broker.has_subscribers(notification.recipient_id):
+            broker.publish(notification.recipient_id, {
+                'type': 'notification',
+                'id': notification.id,
+                'message': notification.message,
+                'notification_type': notification.notification_type,
+                'link': notification.link,
+                'unread': cache.get(_key(notification.recipient_id)),
+            })
+
+
+def count_new(notifications):
+    """Bumps the recipients' counters for freshly created notifications and pushes them to open streams.
+
+    Both wait for the surrounding transaction to commit, so a rolled-back
+    insert (an aborted import, a dry run) never leaves the counter ahead
+    of the table and clients never see a notification that doesn't exist.
+    """
+    def committed():
+        _adjust(Counter(n.recipient_id for n in notifications if not n.is_read))
+        _publish_new(notifications)
+    transaction.on_commit(committed)
+
+
+def mark_read(notification):
+    """Marks one notification read, decrementing the counter on commit only if this call flipped it."""
+    updated = Notification.objects.filter(id=notification.id, is_read=False).update(is_read=True)
+    notification.is_read = True
+    if updated:
+        def committed():
+            _adjust({notification.recipient_id: -1})
+            _publish_unread(notification.recipient_id)
+        transaction.on_commit(committed)
+    return bool(updated)
+
+
+def mark_all_read(user_id):
+    """Marks every unread notification of the user read in a single UPDATE. Returns how many changed."""
+    updated = Notification.objects.filter(recipient_id=user_id, is_read=False).update(is_read=True)
+    def committed():
+        cache.set(_key(user_id), 0, UNREAD_TIMEOUT)
+        _publish_unread(user_id)
+    transaction.on_commit(committed)
+    return updated
+
+
+def encode_cursor(notification):
+    """Serializes the keyset position after notification."""
+    return f"{notification.created_at.isoformat()}|{notification.id}"
+
+
+def decode_cursor(value):
+    """Parses an encode_cursor value into (created_at, id), or None if malformed."""
+    try:
+        created_at, notification_id = (value or '').split('|')
+        return datetime.fromisoformat(created_at), int(notification_id)
+    except ValueError:
+        return None
+
+
+def inbox_page(user_id, cursor, size):
+    """Returns (notifications, has_more) for the user's inbox page after cursor, newest first.
+
+    Pages are keyset-based over (created_at, id) so deep pages never scan
+    the rows before them.
+    """
+    queryset = Notification.objects.filter(recipient_id=user_id).select_related('actor').order_by('-created_at', '-id')
+    if cursor:
+        created_at, notification_id = cursor
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=notification_id))
+    page = list(queryset[:size + 1])
+    return page[:size], len(page) > size
+
+
+def purge_read(older_than, batch_size=1000):
+    """Deletes read notifications created more than older_than ago, batch_size rows per DELETE.
+
+    Short batches keep each delete's locks brief on a busy table. Unread
+    notifications are never purged. Returns the number deleted.
+    """
+    cutoff = timezone.now() - older_than
+    deleted = 0
+    while True:
+        ids = list(
+            Notification.objects.filter(is_read=True, created_at__lt=cutoff)
+            .order_by().values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += Notification.objects.filter(id__in=ids).delete()[0]
+
+
+def reconcile(batch_size=1000):
+    """Corrects cached counters that drifted from the database, e.g. after a rolled-back create.
+
+    Only counters currently cached are checked. Returns the number corrected.
+    """
+    corrected = 0
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        cached = cache.get_many([_key(user_id) for user_id in batch])
+        if not cached:
+            continue
+        cached_ids = [user_id for user_id in batch if _key(user_id) in cached]
+        actual = dict(
+            Notification.objects.filter(recipient_id__in=cached_ids, is_read=False)
+            .values('recipient_id').annotate(count=Count('id')).order_by()
+            .values_list('recipient_id', 'count')
+        )
+        drifted = {
+            _key(user_id): actual.get(user_id, 0)
+            for user_id in cached_ids
+            if cached[_key(user_id)] != actual.get(user_id, 0)
+        }
+        cache.set_many(drifted, UNREAD_TIMEOUT)
+        corrected += len(drifted)
+    return corrected
@@ -0,0 +1,337 @@
+import json
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import PersonalProfile
+from . import cohorts, dashboard, mpesa, readiness
+from .models import Cohort, MPesaCallback, MPesaTransaction, Notification, PaymentRequest
+
+logger = logging.getLogger(__name__)
+
+# Slack on top of a batch's worst-case push time before a SENDING request counts as abandoned
+SENDING_GRACE = timedelta(minutes=1)
+
+
+def enqueue(user, cohort, game_mode, phone_number, team=None):
+    """Records an STK push for the worker to send and returns it immediately."""
+    return PaymentRequest.objects.create(
+        user=user,
+        cohort=cohort,
+        game_mode=game_mode,
+        team=team,
+        phone_number=phone_number,
+        amount=game_mode.amount,
+    )
+
+
+def claim_batch(batch_size):
+    """Moves up to batch_size QUEUED requests to SENDING and returns them.
+
+    Rows are locked with SKIP LOCKED where the database supports it, so
+    several workers can drain the queue without sending a push twice.
+    """
+    with transaction.atomic():
+        ids = list(
+            PaymentRequest.objects.select_for_update(skip_locked=True)
+            .filter(status='QUEUED').order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        PaymentRequest.objects.filter(id__in=ids).update(status='SENDING', updated_at=timezone.now())
+    return list(PaymentRequest.objects.filter(id__in=ids).select_related('game_mode').order_by('id'))
+
+
+def sending_timeout(batch_size, client=None):
+    """Returns how long a request may stay SENDING before expire_stale fails it.
+
+    A worker pushes its batch one request at a time and each push may fetch
+    a token first, so the last request of a batch can wait for batch_size
+    pushes of two Daraja calls, each running to the client's timeout.
+    """
+    timeout = getattr(client, 'timeout', None) or mpesa.MPesaClient.DEFAULT_TIMEOUT
+    per_call = sum(timeout) if isinstance(timeout, (tuple, list)) else timeout
+    return timedelta(seconds=batch_size * 2 * per_call) + SENDING_GRACE
+
+
+def _finish(payment_request, **fields):
+    """Records an outcome for a SENDING request. Returns False if expire_stale failed it first."""
+    fields['updated_at'] = timezone.now()
+    if not PaymentRequest.objects.filter(id=payment_request.id, status='SENDING').update(**fields):
+        return False
+    for name, value in fields.items():
+        setattr(payment_request, name, value)
+    return True
+
+
+def send(payment_request, client):
+    """Performs the STK push for one claimed request and records the outcome.
+
+    The request's updated_at is refreshed just before the push, and every
+    outcome is only written while it is still SENDING, so a request that
+    expire_stale already failed is neither pushed nor marked SENT.
+    """
+    if not _finish(payment_request):
+        return False
+    mode = payment_request.game_mode
+    try:
+        res_data = client.stk_push(
+            amount=int(payment_request.amount),
+            phone_number=payment_request.phone_number,
+            account_reference=f"GM{mode.id}",
+            description=f"Participation in {mode.name}",
+        )
+    except mpesa.MPesaError as e:
+        logger.warning("STK push for payment request %s failed: %s", payment_request.id, e)
+        _finish(payment_request, status='FAILED', error="Could not reach M-Pesa. Please try again in a moment.")
+        return False
+
+    if res_data.get('ResponseCode') != '0':
+        _finish(
+            payment_request, status='FAILED',
+            error=f"Failed to initiate payment: {res_data.get('ResponseDescription')}",
+        )
+        return False
+
+    with transaction.atomic():
+        # The conditional update locks the row, so expire_stale cannot fail it until this commits
+        if not _finish(payment_request, status='SENT'):
+            logger.warning("Payment request %s expired while its STK push was in flight", payment_request.id)
+            return False
+        payment_request.transaction = MPesaTransaction.objects.create(
+            merchant_request_id=res_data.get('MerchantRequestID'),
+            checkout_request_id=res_data.get('CheckoutRequestID'),
+            amount=payment_request.amount,
+            phone_number=payment_request.phone_number,
+            user_id=payment_request.user_id,
+            cohort_id=payment_request.cohort_id,
+            game_mode=mode,
+            team_id=payment_request.team_id,
+            status='PENDING'
+        )
+        PaymentRequest.objects.filter(id=payment_request.id).update(transaction=payment_request.transaction)
+    return True
+
+
+def expire_stale(timeout, now=None):
+    """Fails requests whose updated_at is more than timeout ago while still SENDING. Returns how many.
+
+    They are failed rather than requeued: the dead worker may already have
+    sent the push, and sending it again could charge the player twice.
+    """
+    now = now or timezone.now()
+    return PaymentRequest.objects.filter(status='SENDING', updated_at__lt=now - timeout).update(
+        status='FAILED',
+        error="We could not confirm that the payment prompt was sent. Please try again.",
+        updated_at=now,
+    )
+
+
+def dispatch(batch_size=20, client=None):
+    """Fails stale pushes, then sends one batch of queued ones. Returns (sent, failed)."""
+    client = client or mpesa.get_client()
+    expired = expire_stale(sending_timeout(batch_size, client))
+    batch = claim_batch(batch_size)
+    if client is None:
+        PaymentRequest.objects.filter(id__in=[r.id for r in batch]).update(
+            status='FAILED', error="M-Pesa credentials not configured."
+        )
+        return 0, expired + len(batch)
+    sent = sum(1 for payment_request in batch if send(payment_request, client))
+    return sent, expired + len(batch) - sent
+
+
+def receive_callback(body):
+    """Stores a raw Daraja callback in the inbox; parsing and side effects happen in apply_callbacks."""
+    payload = body.decode('utf-8', errors='replace') if isinstance(body, bytes) else body
+    stk_callback = _parse_callback(payload) or {}
+    return MPesaCallback.objects.create(
+        checkout_request_id=str(stk_callback.get('CheckoutRequestID') or '')[:100],
+        payload=payload,
+    )
+
+
+def _parse_callback(payload):
+    try:
+        stk_callback = json.loads(payload).get('Body', {}).get('stkCallback')
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(stk_callback, dict) or not stk_callback.get('CheckoutRequestID'):
+        return None
+    return stk_callback
+
+
+def _profile_ids(user_ids):
+    """Returns {user_id: PersonalProfile id}, creating missing profiles with one bulk insert."""
+    profile_ids = dict(PersonalProfile.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+    missing = [user_id for user_id in user_ids if user_id not in profile_ids]
+    if missing:
+        PersonalProfile.objects.bulk_create([PersonalProfile(user_id=user_id) for user_id in missing], ignore_conflicts=True)
+        profile_ids.update(PersonalProfile.objects.filter(user_id__in=missing).values_list('user_id', 'id'))
+    return profile_ids
+
+
+def settle(results, now=None):
+    """Applies final Daraja results to PENDING transactions with bulk writes.
+
+    results is a list of (transaction, result_code, result_description);
+    a result code of 0 marks the payment successful, enrols the payer in the
+    cohort, notifies them and refreshes their squad's readiness. Payers'
+    profiles are looked up, and created if missing, once per batch.
+    """
+    now = now or timezone.now()
+    profile_ids = _profile_ids({payment.user_id for payment, result_code, _ in results if result_code == 0})
+    applied, enrolments, notifications, paid_squads = [], [], [], {}
+    for payment, result_code, result_description in results:
+        payment.result_code = result_code
+        payment.result_description = result_description
+        payment.status = 'SUCCESS' if result_code == 0 else 'FAILED'
+        payment.updated_at = now
+        applied.append(payment)
+
+        if payment.status == 'SUCCESS':
+            enrolments.append(Cohort.participants.through(
+                cohort_id=payment.cohort_id, personalprofile_id=profile_ids[payment.user_id]
+            ))
+            notifications.append(Notification(
+                recipient_id=payment.user_id,
+                message=f"Payment of KSh {payment.amount} successful! You are now enrolled in {payment.cohort.name}.",
+                notification_type='RESULT'
+            ))
+            if payment.team:
+                paid_squads.setdefault(payment.team.id, (payment.team, set()))[1].add(payment.cohort)
+
+    with transaction.atomic():
+        MPesaTransaction.objects.bulk_update(applied, ['status', 'result_code', 'result_description', 'updated_at'])
+        Cohort.participants.through.objects.bulk_create(enrolments, ignore_conflicts=True)
+        Notification.objects.bulk_create(notifications)
+        for team, squad_cohorts in paid_squads.values():
+            readiness.refresh(team, squad_cohorts)
+    cohorts.forget({enrolment.cohort_id for enrolment in enrolments})
+    dashboard.bump({payment.user_id for payment in applied if payment.status == 'SUCCESS'}, 'cohorts')
+
+
+def apply_callbacks(batch_size=100):
+    """Applies one batch of unprocessed inbox callbacks. Returns how many were processed.
+
+    Callbacks are deduplicated by CheckoutRequestID, both within the batch and
+    against transactions that already left PENDING, so Safaricom retries are
+    no-ops. Enrolments and notifications are written with bulk inserts.
+    """
+    with transaction.atomic():
+        inbox = list(
+            MPesaCallback.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True).order_by('id')[:batch_size]
+        )
+        if not inbox:
+            return 0
+
+        outcomes = {}
+        callbacks = {}
+        for callback in inbox:
+            stk_callback = _parse_callback(callback.payload)
+            if stk_callback is None:
+                outcomes[callback.id] = 'invalid payload'
+            elif stk_callback['CheckoutRequestID'] in callbacks:
+                outcomes[callback.id] = 'duplicate'
+            else:
+                callbacks[stk_callback['CheckoutRequestID']] = (callback, stk_callback)
+
+        # Locked like reconcile's reads, so a concurrent reconcile pass cannot settle these twice
+        transactions = MPesaTransaction.objects.select_for_update().filter(
+            checkout_request_id__in=callbacks, status='PENDING'
+        ).select_related('cohort', 'team__game_mode').in_bulk(field_name='checkout_request_id')
+        settled = set(
+            MPesaTransaction.objects.filter(checkout_request_id__in=callbacks.keys() - transactions.keys())
+            .values_list('checkout_request_id', 'merchant_request_id')
+        ) if len(transactions) < len(callbacks) else set()
+
+        now = timezone.now()
+        results = []
+        for checkout_request_id, (callback, stk_callback) in callbacks.items():
+            payment = transactions.get(checkout_request_id)
+            if (checkout_request_id, stk_callback.get('MerchantRequestID')) in settled:
+                outcomes[callback.id] = 'duplicate'
+            elif payment is None or payment.merchant_request_id != stk_callback.get('MerchantRequestID'):
+                outcomes[callback.id] = 'transaction not found'
+            else:
+                results.append((payment, stk_callback.get('ResultCode'), stk_callback.get('ResultDesc')))
+                outcomes[callback.id] = 'success' if stk_callback.get('ResultCode') == 0 else 'failed'
+        settle(results, now)
+
+        by_outcome = {}
+        for callback_id, outcome in outcomes.items():
+            by_outcome.setdefault(outcome, []).append(callback_id)
+        for outcome, ids in by_outcome.items():
+            MPesaCallback.objects.filter(id__in=ids).update(processed_at=now, outcome=outcome)
+    return len(inbox)
+
+
+def _query(client, limiter, checkout_request_id):
+    """Returns (result_code, result_description) for one push, or None while Daraja is still processing it."""
+    limiter.wait()
+    try:
+        data = client.stk_query(checkout_request_id)
+    except mpesa.MPesaError as e:
+        logger.warning("STK query for %s failed: %s", checkout_request_id, e)
+        raise
+    if data.get('ResultCode') in (None, ''):
+        return None
+    return int(data['ResultCode']), data.get('ResultDesc')
+
+
+def reconcile(older_than=timedelta(minutes=5), batch_size=50, workers=4, rate=5, client=None):
+    """Queries Daraja for PENDING transactions older than older_than and settles the final ones.
+
+    Rows are scanned oldest first in batches of batch_size; each batch is
+    queried concurrently on workers threads sharing the client's session, at
+    no more than rate requests per second, then applied through settle.
+    Returns a Counter of queried, success, failed, pending and errors.
+    """
+    client = client or mpesa.get_client()
+    metrics = Counter()
+    if client is None:
+        return metrics
+
+    limiter = mpesa.RateLimiter(rate)
+    cutoff = timezone.now() - older_than
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            batch = list(
+                MPesaTransaction.objects.filter(status='PENDING', created_at__lt=cutoff, id__gt=last_id)
+                .order_by('id').values_list('id', 'checkout_request_id')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            futures = {
+                transaction_id: executor.submit(_query, client, limiter, checkout_request_id)
+                for transaction_id, checkout_request_id in batch
+            }
+            outcomes = {}
+            for transaction_id, future in futures.items():
+                metrics['queried'] += 1
+                try:
+                    outcome = future.result()
+                except mpesa.MPesaError:
+                    metrics['errors'] += 1
+                    continue
+                if outcome is None:
+                    metrics['pending'] += 1
+                else:
+                    outcomes[transaction_id] = outcome
+
+            with transaction.atomic():
+                # A callback may have settled some of these while we were querying
+                pending = MPesaTransaction.objects.select_for_update().filter(
+                    id__in=outcomes, status='PENDING'
+                ).select_related('cohort', 'team__game_mode')
+                results = [(payment, *outcomes[payment.id]) for payment in pending]
+                settle(results)
+            for _, result_code, _ in results:
+                metrics['success' if result_code == 0 else 'failed'] += 1
+    return metrics
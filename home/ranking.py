@@ -0,0 +1,136 @@
+from django.db import connection, transaction
+from django.db.models import OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from users.models import PersonalProfile
+from .models import GameMode, LeaderboardEntry, PlayerModeRank, RankRecomputeRequest, TeamUPPlayerRoundStats
+
+BATCH_SIZE = 1000
+
+
+def _standings(totals):
+    """Returns [(player_id, rank, xp, kills)] for {player_id: (xp, kills)}, ordered like the leaderboard.
+
+    Ties on XP and kills fall back to the older account, so every player
+    gets a distinct position.
+    """
+    ordered = sorted(totals.items(), key=lambda item: (-item[1][0], -item[1][1], item[0]))
+    return [(player_id, rank, xp, kills) for rank, (player_id, (xp, kills)) in enumerate(ordered, start=1)]
+
+
+def _replace(game_mode_id, totals):
+    """Swaps the stored standings of one game mode (None for overall) for freshly sorted ones.
+
+    Every rank below a mover shifts, so the scope is rewritten wholesale.
+    Rows go in through executemany rather than bulk_create: building and
+    preparing 100k model instances costs far more than the inserts themselves.
+    """
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (player_id, game_mode_id, rank, xp, kills, now)
+        for player_id, rank, xp, kills in _standings(totals)
+    ]
+    meta = PlayerModeRank._meta
+    columns = ', '.join(
+        connection.ops.quote_name(meta.get_field(name).column)
+        for name in ('player', 'game_mode', 'rank', 'total_xp', 'total_kills', 'updated_at')
+    )
+    insert = f"INSERT INTO {connection.ops.quote_name(meta.db_table)} ({columns}) VALUES (%s, %s, %s, %s, %s, %s)"
+    with transaction.atomic():
+        PlayerModeRank.objects.filter(game_mode_id=game_mode_id).delete()
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), BATCH_SIZE):
+                cursor.executemany(insert, rows[start:start + BATCH_SIZE])
+    return len(rows)
+
+
+def mode_totals(game_mode_id):
+    """Returns {player_id: (xp, kills)} for one game mode from solo and team results."""
+    totals = {
+        player_id: (xp, kills)
+        for player_id, xp, kills in LeaderboardEntry.objects.filter(
+            game_mode_id=game_mode_id, cohort__isnull=True, stage__isnull=True, matches_played__gt=0
+        ).values_list('player_id', 'total_xp', 'total_kills')
+    }
+    team_rows = TeamUPPlayerRoundStats.objects.filter(
+        round_instance__stage__game_mode_id=game_mode_id
+    ).values('player_id').annotate(xp=Sum('xp'), kills=Sum('kills')).order_by()
+    for row in team_rows:
+        xp, kills = totals.get(row['player_id'], (0, 0))
+        totals[row['player_id']] = (xp + (row['xp'] or 0), kills + (row['kills'] or 0))
+    return totals
+
+
+def recompute_mode(game_mode_id):
+    """Re-ranks every player in one game mode. Returns how many players are ranked."""
+    return _replace(game_mode_id, mode_totals(game_mode_id))
+
+
+def recompute_overall():
+    """Re-ranks every player across all modes and copies the result onto PersonalProfile.rank.
+
+    Players with no results get rank 0. Returns the number of profiles
+    whose rank changed.
+    """
+    totals = {
+        row['player_id']: (row['xp'] or 0, row['kills'] or 0)
+        for row in PlayerModeRank.objects.filter(game_mode__isnull=False).values('player_id').annotate(
+            xp=Sum('total_xp'), kills=Sum('total_kills')
+        ).order_by()
+    }
+    overall = Coalesce(
+        Subquery(
+            PlayerModeRank.objects.filter(player_id=OuterRef('user_id'), game_mode__isnull=True).values('rank')[:1]
+        ),
+        Value(0),
+    )
+    with transaction.atomic():
+        _replace(None, totals)
+        existing = set(PersonalProfile.objects.filter(user_id__in=totals).values_list('user_id', flat=True))
+        PersonalProfile.objects.bulk_create(
+            [PersonalProfile(user_id=player_id) for player_id in totals if player_id not in existing],
+            ignore_conflicts=True, batch_size=BATCH_SIZE,
+        )
+        # One set-based UPDATE instead of a row-by-row bulk_update across every profile
+        return PersonalProfile.objects.filter(~Q(rank=overall)).update(rank=overall)
+
+
+def recompute(game_mode_ids=None):
+    """Re-ranks the given game modes (all of them when None) and then the overall standings.
+
+    Each touched mode and the overall standings are rewritten wholesale,
+    which takes seconds at 100k players, so request handlers queue modes
+    with request() instead of calling this.
+    """
+    if game_mode_ids is None:
+        game_mode_ids = list(GameMode.objects.values_list('id', flat=True))
+    for game_mode_id in game_mode_ids:
+        recompute_mode(game_mode_id)
+    return recompute_overall()
+
+
+def request(game_mode_ids):
+    """Queues game modes for the rank worker.
+
+    The insert is part of the caller's transaction, so results that roll
+    back never trigger a recompute.
+    """
+    RankRecomputeRequest.objects.bulk_create(
+        [RankRecomputeRequest(game_mode_id=game_mode_id) for game_mode_id in set(game_mode_ids)]
+    )
+
+
+def process_pending():
+    """Recomputes every queued game mode once, then the overall standings. Returns the modes recomputed.
+
+    Only the requests read here are cleared afterwards, so anything queued
+    during the recompute is picked up by the next pass.
+    """
+    pending = list(RankRecomputeRequest.objects.order_by('id').values_list('id', 'game_mode_id'))
+    if not pending:
+        return []
+    game_mode_ids = sorted({game_mode_id for _, game_mode_id in pending})
+    recompute(game_mode_ids)
+    RankRecomputeRequest.objects.filter(id__in=[request_id for request_id, _ in pending]).delete()
+    return game_mode_ids
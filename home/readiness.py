@@ -0,0 +1,121 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import dashboard
+from .models import Cohort, MPesaTransaction, SquadCohortReadiness, TeamUP
+
+
+def resolve(pairs):
+    """Payment and readiness status for many (team, cohort) pairs in two queries.
+
+    Teams should come with game_mode selected. Returns a dict keyed by
+    (team.id, cohort.id) whose values carry the same 'player'/'paid' status
+    rows as TeamUP.get_payment_status plus paid_count, total_needed and
+    is_ready.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return {}
+    team_ids = {team.id for team, _ in pairs}
+    cohort_ids = {cohort.id for _, cohort in pairs}
+
+    rosters = defaultdict(list)
+    memberships = TeamUP.players.through.objects.filter(teamup_id__in=team_ids).select_related('user').order_by('id')
+    for membership in memberships:
+        rosters[membership.teamup_id].append(membership.user)
+
+    paid = set(MPesaTransaction.objects.filter(
+        status='SUCCESS',
+        team_id__in=team_ids,
+        cohort_id__in=cohort_ids,
+    ).values_list('team_id', 'cohort_id', 'game_mode_id', 'user_id').distinct())
+
+    results = {}
+    for team, cohort in pairs:
+        statuses = [
+            {'player': player, 'paid': (team.id, cohort.id, team.game_mode_id, player.id) in paid}
+            for player in rosters[team.id]
+        ]
+        paid_count = sum(1 for status in statuses if status['paid'])
+        total_needed = team.game_mode.max_players
+        results[(team.id, cohort.id)] = {
+            'squad': team,
+            'cohort': cohort,
+            'statuses': statuses,
+            'paid_count': paid_count,
+            'total_needed': total_needed,
+            'is_ready': len(statuses) >= total_needed and paid_count == len(statuses),
+        }
+    return results
+
+
+def refresh(team, cohorts):
+    """Recomputes the persisted SquadCohortReadiness rows of team for cohorts."""
+    statuses = resolve((team, cohort) for cohort in cohorts).values()
+    for status in statuses:
+        SquadCohortReadiness.objects.update_or_create(
+            team=status['squad'],
+            cohort=status['cohort'],
+            defaults={
+                'paid_count': status['paid_count'],
+                'roster_size': len(status['statuses']),
+                'total_needed': status['total_needed'],
+                'is_ready': status['is_ready'],
+            }
+        )
+    dashboard.bump({row['player'].id for status in statuses for row in status['statuses']}, 'squads')
+
+
+def refresh_team(team):
+    """Refreshes team everywhere its roster matters: open cohorts and any cohort it already has a row for."""
+    cohorts = Cohort.objects.filter(Q(is_open_to_join=True) | Q(squad_readiness__team=team)).distinct()
+    refresh(team, list(cohorts))
+    # A roster change also changes which team fixtures and results its members see
+    dashboard.bump(team.players.values_list('id', flat=True), 'squads', 'fixtures', 'results')
+
+
+def lookup(teams, cohorts):
+    """Persisted readiness for every (team, cohort) pair in one query.
+
+    Pairs without a row have no successful payments yet and get an unsaved
+    placeholder, so templates can treat every value the same way.
+    """
+    teams, cohorts = list(teams), list(cohorts)
+    rows = {
+        (row.team_id, row.cohort_id): row
+        for row in SquadCohortReadiness.objects.filter(team__in=teams, cohort__in=cohorts)
+    }
+    results = {}
+    for team in teams:
+        for cohort in cohorts:
+            row = rows.get((team.id, cohort.id)) or SquadCohortReadiness(
+                team=team, cohort=cohort, total_needed=team.game_mode.max_players
+            )
+            row.team, row.cohort = team, cohort
+            results[(team.id, cohort.id)] = row
+    return results
+
+
+def rebuild(batch_size=500):
+    """Recomputes SquadCohortReadiness for every squad that has taken a payment. Returns the row count."""
+    pairs = set(MPesaTransaction.objects.filter(status='SUCCESS', team__isnull=False).values_list('team_id', 'cohort_id'))
+    teams = TeamUP.objects.select_related('game_mode').in_bulk({team_id for team_id, _ in pairs})
+    cohorts = Cohort.objects.in_bulk({cohort_id for _, cohort_id in pairs})
+    resolved = resolve((teams[team_id], cohorts[cohort_id]) for team_id, cohort_id in pairs)
+    rows = [
+        SquadCohortReadiness(
+            team=status['squad'],
+            cohort=status['cohort'],
+            paid_count=status['paid_count'],
+            roster_size=len(status['statuses']),
+            total_needed=status['total_needed'],
+            is_ready=status['is_ready'],
+        )
+        for status in resolved.values()
+    ]
+    with transaction.atomic():
+        SquadCohortReadiness.objects.all().delete()
+        SquadCohortReadiness.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
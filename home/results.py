@@ -0,0 +1,280 @@
+from django.db import transaction
+
+from . import career, dashboard, leaderboard
+from .models import Notification, Round, RoundPlayerStats, TeamUPPlayerRoundStats, TeamUPRound, TeamUPRoundStats
+
+SOLO_STAT_FIELDS = ('rank', 'kills', 'deaths', 'damage', 'xp')
+TEAM_MEMBER_FIELDS = ('kills', 'deaths', 'damage', 'xp')
+
+
+def round_for_fixture(fixture):
+    """Returns the solo Round recording fixture's results, creating it with the fixture's players."""
+    round_instance, created = Round.objects.get_or_create(
+        fixture=fixture,
+        defaults={
+            'cohort': fixture.cohort,
+            'stage': fixture.stage,
+            'match_date': fixture.match_date,
+        }
+    )
+    if created:
+        round_instance.participants.add(*fixture.players.all())
+    return round_instance
+
+
+def team_round_for_fixture(fixture):
+    """Team counterpart of round_for_fixture."""
+    round_instance, created = TeamUPRound.objects.get_or_create(
+        fixture=fixture,
+        defaults={
+            'cohort': fixture.cohort,
+            'stage': fixture.stage,
+            'match_date': fixture.match_date,
+        }
+    )
+    if created:
+        round_instance.teamup.add(*fixture.teamups.all())
+    return round_instance
+
+
+def parse_count(value, label, errors):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        errors.append(f"{label} must be a whole number.")
+        return None
+    if number < 0:
+        errors.append(f"{label} cannot be negative.")
+        return None
+    return number
+
+
+def parse_duration(value, label, errors):
+    """Parses a time alive given as seconds ("765"), M:SS ("12:45") or H:MM:SS into seconds.
+
+    Blank values return None, meaning no time was recorded.
+    """
+    value = str(value or '').strip()
+    if not value:
+        return None
+    parts = value.split(':')
+    if len(parts) > 3 or not all(part.isdigit() for part in parts) or any(int(part) > 59 for part in parts[1:]):
+        errors.append(f"{label} must be seconds, M:SS or H:MM:SS.")
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_duration(seconds):
+    """Renders seconds the way parse_duration reads them back, e.g. 765 -> "12:45"."""
+    if seconds in (None, ''):
+        return ''
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def _unchanged(stat, values):
+    return all(getattr(stat, field) == value for field, value in values.items())
+
+
+def _claim_rank(rank, label, ranks, errors):
+    if rank == 0:
+        errors.append(f"{label}: rank must be at least 1.")
+    elif rank in ranks:
+        errors.append(f"{label}: rank {rank} is already taken by {ranks[rank]}.")
+    elif rank is not None:
+        ranks[rank] = label
+
+
+def parse_solo_grid(data, players):
+    """Validates a whole-lobby results grid posted as <field>-<player_id> inputs.
+
+    Players whose row is left completely blank are skipped. Returns
+    ({player: values}, errors); nothing should be saved if errors is non-empty.
+    """
+    rows, errors, ranks = {}, [], {}
+    for player in players:
+        raw = {field: str(data.get(f'{field}-{player.id}') or '').strip() for field in SOLO_STAT_FIELDS + ('time_alive',)}
+        if not any(raw.values()):
+            continue
+        if not raw['rank']:
+            errors.append(f"{player.gamer_tag}: rank is required.")
+            continue
+
+        values = {}
+        for field in SOLO_STAT_FIELDS:
+            values[field] = parse_count(raw[field] or 0, f"{player.gamer_tag}: {field}", errors)
+        _claim_rank(values['rank'], player.gamer_tag, ranks, errors)
+        values['time_alive_seconds'] = parse_duration(raw['time_alive'], f"{player.gamer_tag}: time alive", errors)
+        rows[player] = values
+    return rows, errors
+
+
+def parse_team_grid(data, teams):
+    """Validates every squad's rank and every member's stats for a team round.
+
+    Inputs are named rank-<team_id> and <field>-<team_id>-<player_id>; teams
+    must have their players prefetched. Squads left completely blank are
+    skipped, as are blank member rows. Returns ({team: {'rank', 'members':
+    {player: values}}}, errors).
+    """
+    rows, errors, ranks = {}, [], {}
+    for team in teams:
+        rank = str(data.get(f'rank-{team.id}') or '').strip()
+        members = {}
+        for player in team.players.all():
+            raw = {field: str(data.get(f'{field}-{team.id}-{player.id}') or '').strip() for field in TEAM_MEMBER_FIELDS}
+            if any(raw.values()):
+                members[player] = {
+                    field: parse_count(raw[field] or 0, f"{team.name} / {player.gamer_tag}: {field}", errors)
+                    for field in TEAM_MEMBER_FIELDS
+                }
+        if not rank and not members:
+            continue
+        if not rank:
+            errors.append(f"{team.name}: squad rank is required.")
+            continue
+        rank = parse_count(rank, f"{team.name}: rank", errors)
+        _claim_rank(rank, team.name, ranks, errors)
+        rows[team] = {'rank': rank, 'members': members}
+    return rows, errors
+
+
+def save_solo_results(round_instance, rows, actor):
+    """Upserts every player's RoundPlayerStats for round_instance in one transaction.
+
+    Rows are written with bulk_create/bulk_update, the leaderboard is updated
+    with a single bulk pass and players are notified with one insert. The
+    grid resends rows that are already recorded, so rows whose values are
+    unchanged are skipped entirely: no write, no notification.
+    Returns (created, updated).
+    """
+    with transaction.atomic():
+        existing = {
+            stat.player_id: stat
+            for stat in RoundPlayerStats.objects.select_for_update().filter(
+                round_instance=round_instance, player__in=rows
+            )
+        }
+        previous, created, updated = {}, [], []
+        for player, values in rows.items():
+            stat = existing.get(player.id)
+            if stat is None:
+                created.append(RoundPlayerStats(round_instance=round_instance, player=player, **values))
+                continue
+            if _unchanged(stat, values):
+                continue
+            previous[player.id] = {
+                'kills': stat.kills, 'deaths': stat.deaths, 'damage': stat.damage, 'xp': stat.xp,
+                'time_alive_seconds': stat.time_alive_seconds,
+            }
+            for field, value in values.items():
+                setattr(stat, field, value)
+            updated.append(stat)
+
+        RoundPlayerStats.objects.bulk_create(created)
+        RoundPlayerStats.objects.bulk_update(updated, list(SOLO_STAT_FIELDS) + ['time_alive_seconds'])
+        leaderboard.apply_stats(round_instance, created + updated, previous)
+        career.apply_stats(created + updated, previous)
+        written = {stat.player_id for stat in created + updated}
+        Notification.objects.bulk_create([
+            Notification(
+                recipient=player,
+                actor=actor,
+                message=f"Your stats for {round_instance.stage.name} have been updated.",
+                notification_type='RESULT',
+                link=f"/analytics/{player.gamer_tag}/"
+            )
+            for player in rows
+            if player.id in written
+        ])
+    return len(created), len(updated)
+
+
+def save_team_results(round_instance, rows, actor):
+    """Writes a whole team round from parse_team_grid output in a fixed number of queries.
+
+    Member rows are upserted in bulk, each squad's totals are summed in
+    memory from its member rows and upserted in bulk, and the team
+    leaderboard is updated in one pass. Member rows and squads whose values
+    are unchanged are skipped, and only members whose row or squad result
+    changed are notified. Returns the number of squads saved.
+    """
+    with transaction.atomic():
+        member_stats = {
+            (stat.team_id, stat.player_id): stat
+            for stat in TeamUPPlayerRoundStats.objects.select_for_update().filter(
+                round_instance=round_instance, team__in=rows
+            )
+        }
+        new_members, changed_members, previous_members = [], [], {}
+        for team, row in rows.items():
+            for player, values in row['members'].items():
+                stat = member_stats.get((team.id, player.id))
+                if stat is None:
+                    stat = TeamUPPlayerRoundStats(round_instance=round_instance, team=team, player=player, **values)
+                    member_stats[(team.id, player.id)] = stat
+                    new_members.append(stat)
+                    continue
+                if _unchanged(stat, values):
+                    continue
+                previous_members[player.id] = {field: getattr(stat, field) for field in TEAM_MEMBER_FIELDS}
+                for field, value in values.items():
+                    setattr(stat, field, value)
+                changed_members.append(stat)
+        TeamUPPlayerRoundStats.objects.bulk_create(new_members)
+        TeamUPPlayerRoundStats.objects.bulk_update(changed_members, list(TEAM_MEMBER_FIELDS))
+        career.apply_stats(new_members + changed_members, previous_members)
+
+        totals = {team.id: dict.fromkeys(TEAM_MEMBER_FIELDS, 0) for team in rows}
+        for (team_id, _), stat in member_stats.items():
+            for field in TEAM_MEMBER_FIELDS:
+                totals[team_id][field] += getattr(stat, field)
+
+        existing = {
+            stat.team_id: stat
+            for stat in TeamUPRoundStats.objects.select_for_update().filter(round_instance=round_instance, team__in=rows)
+        }
+        previous, new_teams, changed_teams = {}, [], []
+        for team, row in rows.items():
+            stat = existing.get(team.id)
+            if stat is None:
+                new_teams.append(TeamUPRoundStats(
+                    round_instance=round_instance, team=team, rank=row['rank'], **totals[team.id]
+                ))
+                continue
+            if _unchanged(stat, {'rank': row['rank'], **totals[team.id]}):
+                continue
+            previous[team.id] = {'rank': stat.rank, 'kills': stat.kills, 'damage': stat.damage, 'xp': stat.xp}
+            stat.rank = row['rank']
+            for field, value in totals[team.id].items():
+                setattr(stat, field, value)
+            changed_teams.append(stat)
+        TeamUPRoundStats.objects.bulk_create(new_teams)
+        TeamUPRoundStats.objects.bulk_update(changed_teams, ['rank'] + list(TEAM_MEMBER_FIELDS))
+        leaderboard.apply_team_stats(round_instance, new_teams + changed_teams, previous)
+
+        saved = {stat.team_id for stat in new_teams + changed_teams}
+        written = {stat.player_id for stat in new_members + changed_members}
+        # Members left out of this submission still see their squad's rank change
+        career.touch([
+            player_id for team_id, player_id in member_stats if team_id in saved and player_id not in written
+        ])
+        dashboard.bump({player.id for team in rows if team.id in saved for player in team.players.all()}, 'results')
+
+        Notification.objects.bulk_create([
+            Notification(
+                recipient=player,
+                actor=actor,
+                message=f"Results recorded for your team match in {round_instance.stage.name}.",
+                notification_type='RESULT',
+                link=f"/analytics/{player.gamer_tag}/"
+            )
+            for team, row in rows.items()
+            for player in row['members']
+            if team.id in saved or player.id in written
+        ])
+    return len(saved)
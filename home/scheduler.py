@@ -0,0 +1,107 @@
+import math
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from . import brackets, dashboard
+from .models import Fixture, StageParticipants, TeamLeaderboardEntry, TeamUP, TeamUPFixture
+
+# Players a lobby holds when no lobby size is given; squads fill it max_players at a time
+LOBBY_PLAYERS = 100
+
+
+class SchedulingError(Exception):
+    pass
+
+
+def snake(seeded, lobby_count):
+    """Deals seeded entrants (strongest first) into lobby_count lobbies in snake order.
+
+    Seeds go 1..n across the lobbies, then n..1 back, and so on, so every
+    lobby gets a similar spread of strong and weak entrants and lobby sizes
+    differ by at most one.
+    """
+    lobbies = [[] for _ in range(lobby_count)]
+    for position, entrant in enumerate(seeded):
+        lap, offset = divmod(position, lobby_count)
+        lobbies[offset if lap % 2 == 0 else lobby_count - 1 - offset].append(entrant)
+    return lobbies
+
+
+def _seeded_players(stage):
+    """Entered players' user ids, highest career XP first, in one query."""
+    rows = StageParticipants.objects.filter(stage=stage, participant__isnull=False).values_list(
+        'participant__user_id', 'participant__total_xp'
+    )
+    xp = dict(rows)
+    return sorted(xp, key=lambda user_id: (-xp[user_id], user_id))
+
+
+def _seeded_teams(stage):
+    """Entered squads' ids, highest all-time team XP first, in one query."""
+    all_time_xp = TeamLeaderboardEntry.objects.filter(
+        team=OuterRef('teamup_id'), game_mode=None, cohort=None, stage=None
+    ).values('total_xp')[:1]
+    rows = StageParticipants.objects.filter(stage=stage, teamup__isnull=False).annotate(
+        xp=Subquery(all_time_xp)
+    ).values_list('teamup_id', 'xp')
+    xp = {team_id: team_xp or 0 for team_id, team_xp in rows}
+    return sorted(xp, key=lambda team_id: (-xp[team_id], team_id))
+
+
+def schedule(stage, slots, lobby_size=None, replace=False, batch_size=1000):
+    """Generates the fixtures of stage from its StageParticipants.
+
+    Entrants are players for a solo game mode and squads otherwise. They are
+    snake-seeded on XP into lobbies of at most lobby_size entrants, which
+    defaults to LOBBY_PLAYERS worth of the mode's max_players. Lobbies take
+    the datetimes in slots in turn. Fixtures and their player or squad links
+    are written with bulk inserts, so the query count does not depend on the
+    number of entrants. Existing fixtures of the stage are only deleted if
+    replace is set. Returns the created fixtures.
+    """
+    if not slots:
+        raise SchedulingError("At least one time slot is required.")
+    team_mode = stage.game_mode.max_players > 1
+    lobby_size = lobby_size or max(LOBBY_PLAYERS // stage.game_mode.max_players, 2)
+    if lobby_size < 2:
+        raise SchedulingError("A lobby needs room for at least two entrants.")
+
+    model = TeamUPFixture if team_mode else Fixture
+    links = model.teamups.through if team_mode else model.players.through
+    link_field = 'teamup_id' if team_mode else 'user_id'
+    seeded = _seeded_teams(stage) if team_mode else _seeded_players(stage)
+    if not seeded:
+        raise SchedulingError(f"{stage.name} has no entrants to schedule.")
+
+    lobbies = snake(seeded, math.ceil(len(seeded) / lobby_size))
+    with transaction.atomic():
+        existing = model.objects.filter(stage=stage)
+        if existing.exists():
+            if not replace:
+                raise SchedulingError(f"{stage.name} already has fixtures; pass replace to regenerate them.")
+            existing.delete()
+        match_dates = [slots[i % len(slots)] for i in range(len(lobbies))]
+        model.objects.bulk_create(
+            [model(cohort_id=stage.cohort_id, stage=stage, match_date=match_date) for match_date in match_dates],
+            batch_size=batch_size,
+        )
+        # bulk_create only sets primary keys on backends that return them (not
+        # MySQL), so read the new fixtures back. Lobbies sharing a slot are
+        # interchangeable, so pairing both sides in match date order is enough.
+        fixtures = list(model.objects.filter(stage=stage).order_by('match_date', 'id'))
+        order = sorted(range(len(lobbies)), key=lambda i: match_dates[i])
+        links.objects.bulk_create([
+            links(**{f'{model._meta.model_name}_id': fixture.id, link_field: entrant_id})
+            for fixture, i in zip(fixtures, order)
+            for entrant_id in lobbies[i]
+        ], batch_size=batch_size)
+
+    if team_mode:
+        entered = StageParticipants.objects.filter(stage=stage).values('teamup_id')
+        player_ids = TeamUP.players.through.objects.filter(teamup_id__in=entered).values_list('user_id', flat=True)
+    else:
+        player_ids = seeded
+    dashboard.bump(set(player_ids), 'fixtures')
+    brackets.bump([stage.cohort_id])
+    return fixtures
@@ -1,5 +1,7 @@
 from django import template
 
+from home.results import format_duration
+
 register = template.Library()
 
 @register.filter
@@ -13,3 +15,8 @@ def get_item_team(dictionary, team_id):
     # Actually, let's just make one filter that takes both if possible, or just build a nested dict in view.
     # Let's fix the view to provide a nested dict.
     return dictionary.get(team_id, {})
+
+@register.filter
+def duration(seconds):
+    """Formats a number of seconds as M:SS or H:MM:SS."""
+    return format_duration(seconds)
@@ -1,5 +1,27 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from users.models import User, PersonalProfile
+from . import brackets, career, cohorts, leaderboard, mpesa, notifications, payments, ranking, readiness, results, scheduler
+from .models import Cohort, GameMode, GameStage, Fixture, LeaderboardEntry, Round, RoundPlayerStats, TeamLeaderboardEntry, TeamUP, TeamUPFixture, TeamUPInvite, TeamUPRound, TeamUPRoundStats, TeamUPPlayerRoundStats, MPesaTransaction, SquadCohortReadiness, PaymentRequest, MPesaCallback, Notification, PlayerModeRank, RankRecomputeRequest, StageParticipants
 
 class HomeTests(TestCase):
     def test_landing_page_status_code(self):
@@ -14,3 +36,1518 @@ class HomeTests(TestCase):
         response = self.client.get(reverse('home'))
         self.assertContains(response, "ELITE TOURNAMENTS")
         self.assertContains(response, "Dominate the Competitive Scene")
+
+
+class TournamentDataMixin:
+    def setUp(self):
+        # Ids are reused between tests, so cached per-player data must not leak across them
+        cache.clear()
+        now = timezone.now()
+        self.staff = User.objects.create_user(
+            email='staff@example.com', phone_number='0700000000', password='password123',
+            gamer_tag='Overseer', is_staff=True
+        )
+        self.solo_mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        self.cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.stage = GameStage.objects.create(cohort=self.cohort, name='Qualifiers', game_mode=self.solo_mode)
+        self.fixture = Fixture.objects.create(cohort=self.cohort, stage=self.stage, match_date=now)
+        self.players = [
+            User.objects.create_user(
+                email=f'player{i}@example.com', phone_number=f'07110000{i:02d}', password='password123',
+                gamer_tag=f'Operator{i}'
+            )
+            for i in range(3)
+        ]
+        self.fixture.players.set(self.players)
+
+    def record_solo(self, player, **stats):
+        self.client.force_login(self.staff)
+        data = {'player_id': player.id, 'rank': 1, 'kills': 0, 'deaths': 0, 'damage': 0, 'xp': 0}
+        data.update(stats)
+        return self.client.post(reverse('record_solo_stats', args=[self.fixture.id]), data)
+
+
+class LeaderboardTests(TournamentDataMixin, TestCase):
+    def test_recording_stats_updates_every_scope(self):
+        self.record_solo(self.players[0], kills=5, damage=800, xp=300)
+        # global, mode, cohort, stage and their combinations
+        self.assertEqual(LeaderboardEntry.objects.filter(player=self.players[0]).count(), 8)
+        entry = leaderboard.scope_filter(cohort_id=self.cohort.id).get()
+        self.assertEqual((entry.total_kills, entry.total_damage, entry.total_xp, entry.matches_played), (5, 800, 300, 1))
+
+    def test_editing_stats_applies_only_the_difference(self):
+        self.record_solo(self.players[0], kills=5, xp=300)
+        self.record_solo(self.players[0], kills=2, xp=500)
+        entry = leaderboard.scope_filter().get()
+        self.assertEqual((entry.total_kills, entry.total_xp, entry.matches_played), (2, 500, 1))
+
+    def test_leaderboard_orders_by_xp_then_kills(self):
+        self.record_solo(self.players[0], kills=1, xp=100)
+        self.record_solo(self.players[1], kills=9, xp=400)
+        self.record_solo(self.players[2], kills=3, xp=400)
+        response = self.client.get(reverse('leaderboard'), {'mode': self.solo_mode.id})
+        ranked = [entry.player for entry in response.context['podium']]
+        self.assertEqual(ranked, [self.players[1], self.players[2], self.players[0]])
+
+    def test_rebuild_matches_incremental_totals(self):
+        self.record_solo(self.players[0], kills=4, damage=100, xp=250)
+        self.record_solo(self.players[1], kills=7, damage=300, xp=150)
+        incremental = sorted(LeaderboardEntry.objects.values_list(
+            'player_id', 'game_mode_id', 'cohort_id', 'stage_id', 'total_kills', 'total_damage', 'total_xp', 'matches_played'
+        ), key=str)
+        leaderboard.rebuild_leaderboard()
+        rebuilt = sorted(LeaderboardEntry.objects.values_list(
+            'player_id', 'game_mode_id', 'cohort_id', 'stage_id', 'total_kills', 'total_damage', 'total_xp', 'matches_played'
+        ), key=str)
+        self.assertEqual(incremental, rebuilt)
+
+    def test_writers_lock_the_player_before_creating_scope_rows(self):
+        # SQLite cannot race two writers, so check the lock that serializes them is taken
+        select_for_update = QuerySet.select_for_update
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=select_for_update) as locked:
+            self.record_solo(self.players[0], kills=5, xp=300)
+        self.assertIn(User, [call.args[0].model for call in locked.call_args_list])
+        self.assertEqual(LeaderboardEntry.objects.filter(player=self.players[0]).count(), 8)
+
+    def test_admin_edits_and_deletes_reach_the_leaderboard(self):
+        def totals():
+            return sorted(LeaderboardEntry.objects.filter(matches_played__gt=0).values_list(
+                'player_id', 'game_mode_id', 'cohort_id', 'stage_id', 'total_kills', 'total_time_alive', 'total_xp', 'matches_played'
+            ), key=str)
+
+        self.record_solo(self.players[0], kills=5, xp=300)
+        self.record_solo(self.players[1], kills=2, xp=100)
+        self.staff.is_superuser = True
+        self.staff.save()
+        stat = RoundPlayerStats.objects.get(player=self.players[0])
+        self.client.post(reverse('admin:home_roundplayerstats_change', args=[stat.id]), {
+            'round_instance': stat.round_instance_id, 'player': self.players[2].id, 'rank': 1,
+            'kills': 8, 'deaths': 0, 'damage': 0, 'time_alive_seconds': 600, 'xp': 450,
+        })
+        self.assertEqual(RoundPlayerStats.objects.get(id=stat.id).player, self.players[2])
+        edited = totals()
+        leaderboard.rebuild_leaderboard()
+        self.assertEqual(edited, totals())
+
+        other = RoundPlayerStats.objects.get(player=self.players[1])
+        self.client.post(reverse('admin:home_roundplayerstats_delete', args=[other.id]), {'post': 'yes'})
+        self.assertFalse(leaderboard.scope_filter().filter(player=self.players[1]).exists())
+        deleted = totals()
+        leaderboard.rebuild_leaderboard()
+        self.assertEqual(deleted, totals())
+
+    def test_leaderboard_pages_by_cursor(self):
+        for i, player in enumerate(self.players):
+            self.record_solo(player, kills=i, xp=100 * (i + 1))
+        extra = [
+            User.objects.create_user(
+                email=f'late{i}@example.com', phone_number=f'07220000{i:02d}', password='password123',
+                gamer_tag=f'Latecomer{i}'
+            )
+            for i in range(3)
+        ]
+        self.fixture.players.add(*extra)
+        for i, player in enumerate(extra):
+            self.record_solo(player, kills=0, xp=10 - i)
+
+        with mock.patch('home.views.LEADERBOARD_PAGE_SIZE', 2):
+            response = self.client.get(reverse('leaderboard'))
+            self.assertEqual(len(response.context['podium']), 3)
+            self.assertEqual([e.position for e in response.context['rows']], [4, 5])
+            self.assertIsNotNone(response.context['next_query'])
+
+            response = self.client.get(
+                reverse('leaderboard') + '?' + response.context['next_query'], HTTP_HX_REQUEST='true'
+            )
+        self.assertTemplateUsed(response, 'home/partials/leaderboard_rows.html')
+        self.assertEqual([(e.player, e.position) for e in response.context['rows']], [(extra[2], 6)])
+        self.assertIsNone(response.context['next_query'])
+
+
+class SoloGridSubmissionTests(TournamentDataMixin, TestCase):
+    def submit_grid(self, rows):
+        self.client.force_login(self.staff)
+        data = {}
+        for player, stats in rows.items():
+            data.update({f'{field}-{player.id}': value for field, value in stats.items()})
+        return self.client.post(reverse('record_solo_stats', args=[self.fixture.id]), data)
+
+    def test_grid_saves_every_row_and_notifies_once_per_player(self):
+        self.record_solo(self.players[0], rank=3, kills=1, xp=50)
+        response = self.submit_grid({
+            self.players[0]: {'rank': 1, 'kills': 6, 'xp': 400, 'time_alive': '18:20'},
+            self.players[1]: {'rank': 2, 'kills': 3, 'damage': 900, 'xp': 250},
+            self.players[2]: {},
+        })
+        self.assertRedirects(response, reverse('record_solo_stats', args=[self.fixture.id]))
+        self.assertEqual(
+            sorted(RoundPlayerStats.objects.values_list('player__gamer_tag', 'rank', 'kills', 'time_alive_seconds')),
+            [('Operator0', 1, 6, 1100), ('Operator1', 2, 3, None)],
+        )
+        self.assertEqual(Notification.objects.filter(recipient=self.players[1]).count(), 1)
+        self.assertEqual(
+            [(e.player, e.total_kills, e.total_xp, e.matches_played) for e in leaderboard.scope_filter(stage_id=self.stage.id)],
+            [(self.players[0], 6, 400, 1), (self.players[1], 3, 250, 1)],
+        )
+
+    def test_resubmitting_recorded_rows_changes_nothing(self):
+        grid = {
+            self.players[0]: {'rank': 1, 'kills': 6, 'xp': 400, 'time_alive': '18:20'},
+            self.players[1]: {'rank': 2, 'kills': 3, 'damage': 900, 'xp': 250},
+        }
+        self.submit_grid(grid)
+        versions = dict(PersonalProfile.objects.values_list('user_id', 'stats_version'))
+        # The grid comes back pre-filled, so an edit to one row resends the other
+        grid[self.players[1]] = {**grid[self.players[1]], 'kills': 4}
+        self.submit_grid(grid)
+        self.assertEqual(Notification.objects.filter(recipient=self.players[0]).count(), 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.players[1]).count(), 2)
+        self.assertEqual(
+            dict(PersonalProfile.objects.values_list('user_id', 'stats_version')),
+            {**versions, self.players[1].id: versions[self.players[1].id] + 1},
+        )
+        self.assertEqual(RoundPlayerStats.objects.get(player=self.players[1]).kills, 4)
+
+    def test_invalid_grid_saves_nothing(self):
+        self.submit_grid({
+            self.players[0]: {'rank': 1, 'kills': 2},
+            self.players[1]: {'rank': 1, 'kills': 4},
+            self.players[2]: {'kills': 'lots'},
+        })
+        self.assertFalse(RoundPlayerStats.objects.exists())
+        self.assertFalse(LeaderboardEntry.objects.exists())
+
+    def test_query_count_does_not_grow_with_lobby_size(self):
+        round_instance = results.round_for_fixture(self.fixture)
+        round_instance = Round.objects.select_related('stage').get(id=round_instance.id)
+        PersonalProfile.objects.bulk_create([PersonalProfile(user=player) for player in self.players])
+
+        def save(rows):
+            RoundPlayerStats.objects.all().delete()
+            LeaderboardEntry.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                results.save_solo_results(round_instance, rows, self.staff)
+            return len(queries)
+
+        one_player = save({self.players[0]: {'rank': 1, 'kills': 2, 'deaths': 0, 'damage': 0, 'xp': 0, 'time_alive': ''}})
+        full_lobby = save({
+            player: {'rank': i + 1, 'kills': i + 1, 'deaths': 0, 'damage': 0, 'xp': 0, 'time_alive': ''}
+            for i, player in enumerate(self.players)
+        })
+        self.assertEqual(full_lobby, one_player)
+
+
+class TimeAliveTests(TournamentDataMixin, TestCase):
+    def test_parse_duration_formats(self):
+        errors = []
+        self.assertEqual(
+            [results.parse_duration(value, 'time', errors) for value in ('765', '12:45', '1:02:03', ' ', None)],
+            [765, 765, 3723, None, None],
+        )
+        self.assertEqual(errors, [])
+        for value in ('12:75', '1:2:3:4', 'soon', '-5'):
+            results.parse_duration(value, 'time', errors)
+        self.assertEqual(len(errors), 4)
+        self.assertEqual((results.format_duration(765), results.format_duration(3723)), ('12:45', '1:02:03'))
+
+    def test_survival_totals_follow_edits_and_rebuild(self):
+        self.record_solo(self.players[0], time_alive='10:00')
+        self.record_solo(self.players[0], time_alive='12:30')
+        entry = leaderboard.scope_filter().get()
+        self.assertEqual((entry.total_time_alive, entry.timed_matches, entry.avg_time_alive), (750, 1, 750))
+
+        self.record_solo(self.players[0], time_alive='')
+        entry = leaderboard.scope_filter().get()
+        self.assertEqual((entry.total_time_alive, entry.timed_matches, entry.avg_time_alive), (0, 0, None))
+
+        self.record_solo(self.players[0], time_alive='9:00')
+        self.record_solo(self.players[1], rank=2, time_alive='5:00')
+        leaderboard.rebuild_leaderboard()
+        self.assertEqual(
+            sorted((e.player.gamer_tag, e.total_time_alive, e.timed_matches) for e in leaderboard.scope_filter()),
+            [('Operator0', 540, 1), ('Operator1', 300, 1)],
+        )
+        response = self.client.get(reverse('player_analytics', args=[self.players[1].gamer_tag]))
+        self.assertContains(response, 'Avg Survival 5:00')
+
+        response = self.client.get(reverse('leaderboard'), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'Total Survival')
+        # Both players sit on the podium, so read the table rows from a later page
+        response = self.client.get(reverse('leaderboard'), {'after': f'{10 ** 9}:0:0:0'})
+        # One match each, so the average and total cells agree
+        self.assertContains(response, '>9:00</td>', count=2)
+
+    def test_invalid_time_alive_is_rejected(self):
+        self.record_solo(self.players[0], time_alive='forever')
+        self.assertFalse(RoundPlayerStats.objects.exists())
+
+    def test_convert_command_parses_legacy_text(self):
+        self.record_solo(self.players[0], kills=2)
+        self.record_solo(self.players[1], rank=2)
+        RoundPlayerStats.objects.filter(player=self.players[0]).update(time_alive='12:45')
+        RoundPlayerStats.objects.filter(player=self.players[1]).update(time_alive='about ten minutes')
+        err = StringIO()
+        call_command('convert_time_alive', stdout=StringIO(), stderr=err)
+        self.assertIn('about ten minutes', err.getvalue())
+        self.assertEqual(
+            sorted(RoundPlayerStats.objects.values_list('player__gamer_tag', 'time_alive_seconds')),
+            [('Operator0', 765), ('Operator1', None)],
+        )
+        entry = leaderboard.scope_filter().get(player=self.players[0])
+        self.assertEqual((entry.total_time_alive, entry.timed_matches), (765, 1))
+
+
+class CareerTotalsTests(TournamentDataMixin, TestCase):
+    def career(self, player):
+        profile = PersonalProfile.objects.get(user=player)
+        return profile.total_kills, profile.total_xp, profile.deaths
+
+    def test_solo_and_grid_results_apply_only_their_difference(self):
+        self.record_solo(self.players[0], kills=5, deaths=1, xp=300)
+        self.assertEqual(self.career(self.players[0]), (5, 300, 1))
+        self.record_solo(self.players[0], kills=2, deaths=1, xp=500)
+        self.assertEqual(self.career(self.players[0]), (2, 500, 1))
+
+        self.client.post(reverse('record_solo_stats', args=[self.fixture.id]), {
+            f'rank-{self.players[0].id}': 1, f'kills-{self.players[0].id}': 7, f'xp-{self.players[0].id}': 100,
+            f'rank-{self.players[1].id}': 2, f'kills-{self.players[1].id}': 3, f'deaths-{self.players[1].id}': 1,
+        })
+        self.assertEqual(self.career(self.players[0]), (7, 100, 0))
+        self.assertEqual(self.career(self.players[1]), (3, 0, 1))
+        self.assertEqual(career.rebuild(fix=False), [])
+
+    def test_admin_delete_takes_stats_back_out(self):
+        self.record_solo(self.players[0], kills=5, xp=300)
+        self.staff.is_superuser = True
+        self.staff.save()
+        stat = RoundPlayerStats.objects.get()
+        self.client.post(reverse('admin:home_roundplayerstats_delete', args=[stat.id]), {'post': 'yes'})
+        self.assertFalse(RoundPlayerStats.objects.exists())
+        self.assertEqual(self.career(self.players[0]), (0, 0, 0))
+
+    def test_rebuild_command_reports_and_fixes_drift(self):
+        self.record_solo(self.players[0], kills=5, xp=300)
+        PersonalProfile.objects.filter(user=self.players[0]).update(total_kills=99)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_career_totals', check=True, stdout=StringIO())
+        call_command('rebuild_career_totals', stdout=StringIO())
+        self.assertEqual(self.career(self.players[0]), (5, 300, 0))
+        call_command('rebuild_career_totals', check=True, stdout=StringIO())
+
+
+class CareerSummaryTests(TournamentDataMixin, TestCase):
+    def analytics(self, player):
+        return self.client.get(reverse('player_analytics', args=[player.gamer_tag]))
+
+    def test_cached_summary_skips_stat_queries(self):
+        self.record_solo(self.players[0], kills=5, damage=800, xp=300)
+        response = self.analytics(self.players[0])
+        self.assertEqual(response.context['solo_stats']['total_kills'], 5)
+        self.assertEqual(response.context['recent_solo'][0]['stage_name'], 'Qualifiers')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.analytics(self.players[0])
+        self.assertFalse([q for q in queries.captured_queries if 'roundplayerstats' in q['sql'].lower()])
+
+    def test_recording_results_invalidates_summary(self):
+        self.record_solo(self.players[0], kills=5, xp=300)
+        self.analytics(self.players[0])
+        # A rank-only edit changes no career counter but still wins the match
+        self.record_solo(self.players[0], rank=2, kills=5, xp=300)
+        self.assertEqual(self.analytics(self.players[0]).context['solo_stats']['wins'], 0)
+
+    def test_team_rank_change_invalidates_members(self):
+        team_mode = GameMode.objects.create(name='Duo', amount=100, max_players=2)
+        stage = GameStage.objects.create(cohort=self.cohort, name='Duo Finals', game_mode=team_mode)
+        team = TeamUP.objects.create(name='Alpha', captain=self.players[0], game_mode=team_mode)
+        team.players.set(self.players[:2])
+        fixture = TeamUPFixture.objects.create(cohort=self.cohort, stage=stage, match_date=timezone.now())
+        fixture.teamups.add(team)
+        self.client.force_login(self.staff)
+        url = reverse('record_team_stats', args=[fixture.id])
+        self.client.post(url, {'action': 'save_all', f'rank-{team.id}': 2, f'kills-{team.id}-{self.players[1].id}': 4})
+        self.assertEqual(self.analytics(self.players[1]).context['team_stats']['wins'], 0)
+
+        self.client.post(url, {'action': 'save_team_rank', 'team_id': team.id, 'rank': 1})
+        summary = self.analytics(self.players[1]).context
+        self.assertEqual((summary['team_stats']['wins'], summary['recent_team'][0]['team_name']), (1, 'Alpha'))
+        # Only members who played count the squad's result
+        self.assertEqual(self.analytics(self.players[0]).context['team_stats']['matches_played'], 0)
+
+
+class RankingTests(TournamentDataMixin, TestCase):
+    def ranks(self):
+        return list(
+            PersonalProfile.objects.filter(rank__gt=0).order_by('rank').values_list('user__gamer_tag', flat=True)
+        )
+
+    def record_solo(self, player, **stats):
+        # Submissions only queue a recompute; run the rank worker's pass right away
+        response = super().record_solo(player, **stats)
+        ranking.process_pending()
+        return response
+
+    def test_submissions_only_queue_a_recompute(self):
+        super().record_solo(self.players[0], kills=2, xp=100)
+        super().record_solo(self.players[1], rank=2, kills=5, xp=300)
+        self.assertEqual(self.ranks(), [])
+        self.assertFalse(PlayerModeRank.objects.exists())
+
+        out = StringIO()
+        call_command('run_rank_worker', once=True, stdout=out)
+        self.assertIn(f'Re-ranked game modes {self.solo_mode.id}', out.getvalue())
+        self.assertEqual(self.ranks(), ['Operator1', 'Operator0'])
+        self.assertFalse(RankRecomputeRequest.objects.exists())
+
+    def test_submissions_rerank_mode_and_overall(self):
+        self.record_solo(self.players[0], kills=2, xp=100)
+        self.record_solo(self.players[1], rank=2, kills=5, xp=300)
+        self.assertEqual(self.ranks(), ['Operator1', 'Operator0'])
+        self.assertEqual(
+            list(PlayerModeRank.objects.filter(game_mode=self.solo_mode).order_by('rank').values_list('player__gamer_tag', 'rank')),
+            [('Operator1', 1), ('Operator0', 2)],
+        )
+
+        # Equal XP falls back to kills
+        self.record_solo(self.players[2], rank=3, kills=9, xp=300)
+        self.assertEqual(self.ranks(), ['Operator2', 'Operator1', 'Operator0'])
+
+    def test_recompute_reports_moved_ranks_and_drops_empty_players(self):
+        for i, player in enumerate(self.players):
+            self.record_solo(player, rank=i + 1, xp=100 * (i + 1))
+        self.assertEqual(ranking.recompute(), 0)
+
+        RoundPlayerStats.objects.filter(player=self.players[0]).delete()
+        leaderboard.rebuild_leaderboard()
+        out = StringIO()
+        call_command('recompute_ranks', mode=[self.solo_mode.id], stdout=out)
+        self.assertIn('1 overall ranks changed', out.getvalue())
+        self.assertEqual(self.ranks(), ['Operator2', 'Operator1'])
+        self.assertEqual(PersonalProfile.objects.get(user=self.players[0]).rank, 0)
+
+
+class ImportResultsTests(TournamentDataMixin, TestCase):
+    def write(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_csv_import_writes_stats_and_leaderboard(self):
+        path = self.write('.csv', (
+            "gamer_tag,rank,kills,deaths,damage,xp,time_alive\n"
+            "operator0,2,4,1,600,300,14:10\n"
+            "OPERATOR1,1,9,0,1200,500,20:00\n"
+        ))
+        out = StringIO()
+        call_command('import_results', path, fixture=self.fixture.id, chunk_size=1, stdout=out)
+        self.assertIn('Imported 2 rows', out.getvalue())
+        self.assertIn('rows/sec', out.getvalue())
+        self.assertEqual(
+            sorted(RoundPlayerStats.objects.values_list('player__gamer_tag', 'rank', 'kills', 'time_alive_seconds')),
+            [('Operator0', 2, 4, 850), ('Operator1', 1, 9, 1200)],
+        )
+        self.assertEqual([e.player for e in leaderboard.scope_filter()], [self.players[1], self.players[0]])
+
+    def test_dry_run_and_invalid_rows_write_nothing(self):
+        path = self.write('.jsonl', json.dumps({'gamer_tag': 'Operator0', 'rank': 1, 'kills': 3}) + '\n')
+        out = StringIO()
+        call_command('import_results', path, fixture=self.fixture.id, dry_run=True, stdout=out)
+        self.assertIn('Dry run: validated 1 rows', out.getvalue())
+        self.assertFalse(RoundPlayerStats.objects.exists())
+
+        path = self.write('.jsonl', '\n'.join([
+            json.dumps({'gamer_tag': 'Operator0', 'rank': 1}),
+            json.dumps({'gamer_tag': 'Nobody', 'rank': 2}),
+            'not json',
+        ]))
+        with self.assertRaises(CommandError):
+            call_command('import_results', path, fixture=self.fixture.id, stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(RoundPlayerStats.objects.exists())
+        self.assertFalse(LeaderboardEntry.objects.exists())
+
+    def test_team_import_totals_squads(self):
+        squad_mode = GameMode.objects.create(name='Duo', amount=200, max_players=2)
+        stage = GameStage.objects.create(cohort=self.cohort, name='Duo Finals', game_mode=squad_mode)
+        fixture = TeamUPFixture.objects.create(cohort=self.cohort, stage=stage, match_date=timezone.now())
+        team = TeamUP.objects.create(name='Alpha', captain=self.players[0], game_mode=squad_mode)
+        team.players.set(self.players[:2])
+        fixture.teamups.add(team)
+        path = self.write('.jsonl', '\n'.join(
+            json.dumps({'team': 'alpha', 'team_rank': 1, 'gamer_tag': player.gamer_tag, 'kills': 2, 'xp': 100})
+            for player in self.players[:2]
+        ))
+        call_command('import_results', path, team_fixture=fixture.id, stdout=StringIO())
+        stat = TeamUPRoundStats.objects.get(team=team)
+        self.assertEqual((stat.rank, stat.kills, stat.xp), (1, 4, 200))
+        entry = leaderboard.team_scope_filter(stage_id=stage.id).get()
+        self.assertEqual((entry.wins, entry.total_xp), (1, 200))
+
+    def test_rows_for_players_outside_the_fixture_or_squad_are_rejected(self):
+        outsider = User.objects.create_user(
+            email='outsider@example.com', phone_number='0712000000', password='password123', gamer_tag='Outsider'
+        )
+        path = self.write('.jsonl', json.dumps({'gamer_tag': 'Outsider', 'rank': 1, 'kills': 3}) + '\n')
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('import_results', path, fixture=self.fixture.id, stdout=StringIO(), stderr=err)
+        self.assertIn('Outsider is not playing this fixture', err.getvalue())
+
+        squad_mode = GameMode.objects.create(name='Duo', amount=200, max_players=2)
+        stage = GameStage.objects.create(cohort=self.cohort, name='Duo Finals', game_mode=squad_mode)
+        fixture = TeamUPFixture.objects.create(cohort=self.cohort, stage=stage, match_date=timezone.now())
+        team = TeamUP.objects.create(name='Alpha', captain=self.players[0], game_mode=squad_mode)
+        team.players.set(self.players[:2])
+        fixture.teamups.add(team)
+        path = self.write('.jsonl', '\n'.join(
+            json.dumps({'team': 'alpha', 'team_rank': 1, 'gamer_tag': gamer_tag, 'kills': 2, 'xp': 100})
+            for gamer_tag in ('Operator0', 'Outsider')
+        ))
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('import_results', path, team_fixture=fixture.id, stdout=StringIO(), stderr=err)
+        self.assertIn("Outsider is not on Alpha's roster", err.getvalue())
+        self.assertFalse(TeamUPRoundStats.objects.exists())
+        self.assertFalse(TeamLeaderboardEntry.objects.exists())
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='reader@example.com', phone_number='0722000000', password='password123', gamer_tag='Reader'
+        )
+        self.client.force_login(self.user)
+
+    def notify(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(recipient=self.user, message='Hello', notification_type='SYSTEM', **kwargs)
+
+    def test_counter_follows_creates_and_reads_without_counting(self):
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+        first = self.notify()
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.bulk_create([
+                Notification(recipient=self.user, message='Bulk', notification_type='RESULT') for _ in range(2)
+            ])
+        self.notify(is_read=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('leaderboard'))
+        self.assertEqual(response.context['unread_count'], 3)
+        self.assertFalse([q for q in queries.captured_queries if 'home_notification' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('mark_notification_read', args=[first.id]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('mark_notification_read', args=[first.id]))
+        self.assertEqual(notifications.unread_count(self.user.id), 2)
+
+    def test_rolled_back_notifications_are_not_counted(self):
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    Notification.objects.create(recipient=self.user, message='Hello', notification_type='SYSTEM')
+                    raise RuntimeError('aborted import')
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+
+    def test_reconcile_corrects_drift(self):
+        self.notify()
+        self.assertEqual(notifications.unread_count(self.user.id), 1)
+        Notification.objects.update(is_read=True)
+        out = StringIO()
+        call_command('reconcile_unread_counts', once=True, stdout=out)
+        self.assertIn('Corrected 1', out.getvalue())
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+
+
+class NotificationInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='reader@example.com', phone_number='0722000000', password='password123', gamer_tag='Reader'
+        )
+        Notification.objects.bulk_create([
+            Notification(recipient=self.user, message=f'Briefing {i}', notification_type='SYSTEM') for i in range(25)
+        ])
+        self.client.force_login(self.user)
+
+    def test_cursor_pages_cover_the_inbox_once(self):
+        response = self.client.get(reverse('notifications'))
+        first = response.context['notifications']
+        self.assertEqual(len(first), 20)
+        more = self.client.get(reverse('notifications') + '?' + response.context['next_query'])
+        self.assertTemplateUsed(more, 'home/partials/notification_rows.html')
+        self.assertIsNone(more.context['next_query'])
+        seen = [n.id for n in first] + [n.id for n in more.context['notifications']]
+        self.assertEqual(sorted(seen), sorted(Notification.objects.values_list('id', flat=True)))
+
+    def test_mark_all_read_is_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('mark_all_notifications_read'))
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE "home_notification"')]), 1)
+        self.assertFalse(Notification.objects.filter(is_read=False).exists())
+        self.assertEqual(notifications.unread_count(self.user.id), 0)
+
+    def test_purge_keeps_unread_and_recent(self):
+        old = timezone.now() - timedelta(days=120)
+        ids = list(Notification.objects.order_by('id').values_list('id', flat=True))
+        Notification.objects.filter(id__in=ids[:10]).update(created_at=old, is_read=True)
+        Notification.objects.filter(id__in=ids[10:15]).update(created_at=old)
+        Notification.objects.filter(id__in=ids[15:]).update(is_read=True)
+        out = StringIO()
+        call_command('purge_notifications', batch_size=3, stdout=out)
+        self.assertIn('Deleted 10', out.getvalue())
+        self.assertEqual(Notification.objects.count(), 15)
+
+
+class NotificationStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='reader@example.com', phone_number='0722000000', password='password123', gamer_tag='Reader'
+        )
+
+    def notify(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(recipient=self.user, message='Fixture posted', notification_type='FIXTURE')
+
+    def read_all(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.mark_all_read(self.user.id)
+
+    # Streams end on their own after STREAM_LIFETIME so the browser reconnects
+    @mock.patch('home.views.STREAM_LIFETIME', 2)
+    async def test_stream_pushes_new_notifications_and_reads(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse('notification_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertIn('"unread": 0', (await anext(stream)).decode())
+
+        await sync_to_async(self.notify)()
+        pushed = (await anext(stream)).decode()
+        self.assertTrue(pushed.startswith('event: notification'))
+        self.assertIn('"unread": 1', pushed)
+
+        await sync_to_async(self.read_all)()
+        self.assertIn('"unread": 0', (await anext(stream)).decode())
+        self.assertTrue(all(chunk.startswith(b':') for chunk in [chunk async for chunk in stream]))
+        self.assertFalse(notifications.broker.has_subscribers(self.user.id))
+
+    async def test_anonymous_stream_is_rejected(self):
+        response = await self.async_client.get(reverse('notification_stream'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_wsgi_pages_do_not_open_the_stream(self):
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(reverse('notifications')), reverse('notification_stream'))
+        self.assertEqual(self.client.get(reverse('notification_stream')).status_code, 204)
+
+    async def test_asgi_pages_open_the_stream(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse('notifications'))
+        self.assertContains(response, reverse('notification_stream'))
+
+
+class InviteSuggestionTests(TestCase):
+    def setUp(self):
+        self.captain = User.objects.create_user(
+            email='captain@example.com', phone_number='0700000001', password='password123', gamer_tag='CaptainPrice'
+        )
+        self.squad_mode = GameMode.objects.create(name='Squad', amount=400, max_players=4)
+        self.team = TeamUP.objects.create(name='Task Force', captain=self.captain, game_mode=self.squad_mode)
+        self.team.players.add(self.captain)
+        for i, tag in enumerate(['CaptainMactavish', 'Ghost', 'Soap']):
+            User.objects.create_user(
+                email=f'op{i}@example.com', phone_number=f'07330000{i:02d}', password='password123', gamer_tag=tag
+            )
+        self.client.force_login(self.captain)
+
+    def test_suggestions_exclude_current_members(self):
+        response = self.client.get(reverse('invite_suggestions', args=[self.team.id]), {'gamer_tag': 'capt'})
+        self.assertEqual([u.gamer_tag for u in response.context['suggestions']], ['CaptainMactavish'])
+
+    def test_invite_lookup_ignores_case(self):
+        self.client.post(reverse('manage_squad', args=[self.team.id]), {'gamer_tag': 'GHOST'})
+        self.assertTrue(TeamUPInvite.objects.filter(team=self.team, invitee__gamer_tag='Ghost').exists())
+
+
+class TeamLeaderboardTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.staff = User.objects.create_user(
+            email='staff@example.com', phone_number='0700000000', password='password123',
+            gamer_tag='Overseer', is_staff=True
+        )
+        self.squad_mode = GameMode.objects.create(name='Squad', amount=400, max_players=2)
+        self.cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.stage = GameStage.objects.create(cohort=self.cohort, name='Group Stage', game_mode=self.squad_mode)
+        self.fixture = TeamUPFixture.objects.create(cohort=self.cohort, stage=self.stage, match_date=now)
+        self.teams = []
+        for t in range(2):
+            members = [
+                User.objects.create_user(
+                    email=f't{t}p{i}@example.com', phone_number=f'0744{t}0000{i}', password='password123',
+                    gamer_tag=f'Squad{t}Op{i}'
+                )
+                for i in range(2)
+            ]
+            team = TeamUP.objects.create(name=f'Unit {t}', captain=members[0], game_mode=self.squad_mode)
+            team.players.set(members)
+            self.teams.append(team)
+        self.fixture.teamups.set(self.teams)
+        self.client.force_login(self.staff)
+
+    def post(self, **data):
+        return self.client.post(reverse('record_team_stats', args=[self.fixture.id]), data)
+
+    def test_rank_and_player_stats_roll_into_team_totals(self):
+        team = self.teams[0]
+        self.post(action='save_team_rank', team_id=team.id, rank=1)
+        for player in team.players.all():
+            self.post(action='save_player_stats', team_id=team.id, player_id=player.id, kills=3, damage=200, xp=150)
+        entry = leaderboard.team_scope_filter(cohort_id=self.cohort.id).get(team=team)
+        self.assertEqual((entry.total_kills, entry.total_damage, entry.total_xp, entry.wins, entry.matches_played), (6, 400, 300, 1, 1))
+
+        # Demoting the squad removes the win without counting another match
+        self.post(action='save_team_rank', team_id=team.id, rank=2)
+        entry.refresh_from_db()
+        self.assertEqual((entry.wins, entry.matches_played, entry.total_xp), (0, 1, 300))
+
+    def test_team_leaderboard_page_and_rebuild_agree(self):
+        for rank, team in enumerate(self.teams, start=1):
+            self.post(action='save_team_rank', team_id=team.id, rank=rank)
+            player = team.players.first()
+            self.post(action='save_player_stats', team_id=team.id, player_id=player.id, kills=rank, xp=100 * rank)
+        response = self.client.get(reverse('team_leaderboard'))
+        self.assertEqual([entry.team for entry in response.context['rows']], [self.teams[1], self.teams[0]])
+
+        before = sorted(TeamLeaderboardEntry.objects.values_list('team_id', 'game_mode_id', 'cohort_id', 'stage_id', 'total_kills', 'total_xp', 'wins', 'matches_played'), key=str)
+        leaderboard.rebuild_team_leaderboard()
+        after = sorted(TeamLeaderboardEntry.objects.values_list('team_id', 'game_mode_id', 'cohort_id', 'stage_id', 'total_kills', 'total_xp', 'wins', 'matches_played'), key=str)
+        self.assertEqual(before, after)
+
+    def test_admin_edits_and_deletes_reach_the_team_leaderboard(self):
+        self.post(**self.grid([1, 2]))
+        self.staff.is_superuser = True
+        self.staff.save()
+        winner, runner_up = (TeamUPRoundStats.objects.get(team=team) for team in self.teams)
+        self.client.post(reverse('admin:home_teamuproundstats_change', args=[winner.id]), {
+            'round_instance': winner.round_instance_id, 'team': winner.team_id,
+            'rank': 2, 'kills': 9, 'deaths': 0, 'damage': 0, 'xp': 700,
+        })
+        self.client.post(reverse('admin:home_teamuproundstats_delete', args=[runner_up.id]), {'post': 'yes'})
+
+        entry = leaderboard.team_scope_filter().get()
+        self.assertEqual((entry.team, entry.total_kills, entry.total_xp, entry.wins), (self.teams[0], 9, 700, 0))
+        before = sorted(TeamLeaderboardEntry.objects.filter(matches_played__gt=0).values_list(
+            'team_id', 'stage_id', 'total_kills', 'total_xp', 'wins', 'matches_played'
+        ), key=str)
+        leaderboard.rebuild_team_leaderboard()
+        after = sorted(TeamLeaderboardEntry.objects.values_list(
+            'team_id', 'stage_id', 'total_kills', 'total_xp', 'wins', 'matches_played'
+        ), key=str)
+        self.assertEqual(before, after)
+
+    def grid(self, ranks, kills=2, xp=100):
+        data = {'action': 'save_all'}
+        for team, rank in zip(self.teams, ranks):
+            if rank is None:
+                continue
+            data[f'rank-{team.id}'] = rank
+            for player in team.players.all():
+                data.update({f'kills-{team.id}-{player.id}': kills, f'xp-{team.id}-{player.id}': xp})
+        return data
+
+    def test_bulk_submission_matches_per_row_totals(self):
+        self.post(**self.grid([2, 1]))
+        totals = {
+            stat.team_id: (stat.rank, stat.kills, stat.xp)
+            for stat in TeamUPRoundStats.objects.all()
+        }
+        self.assertEqual(totals, {self.teams[0].id: (2, 4, 200), self.teams[1].id: (1, 4, 200)})
+        self.assertEqual(Notification.objects.count(), 4)
+
+        # Resubmitting with new numbers edits in place
+        self.post(**self.grid([1, 2], kills=5))
+        entry = leaderboard.team_scope_filter().get(team=self.teams[0])
+        self.assertEqual((entry.total_kills, entry.wins, entry.matches_played), (10, 1, 1))
+        before = sorted(TeamLeaderboardEntry.objects.values_list('team_id', 'stage_id', 'total_kills', 'total_xp', 'wins', 'matches_played'), key=str)
+        leaderboard.rebuild_team_leaderboard()
+        after = sorted(TeamLeaderboardEntry.objects.values_list('team_id', 'stage_id', 'total_kills', 'total_xp', 'wins', 'matches_played'), key=str)
+        self.assertEqual(before, after)
+
+    def test_resubmitting_an_unchanged_grid_is_a_no_op(self):
+        self.post(**self.grid([2, 1]))
+        versions = dict(PersonalProfile.objects.values_list('user_id', 'stats_version'))
+        self.post(**self.grid([2, 1]))
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertEqual(dict(PersonalProfile.objects.values_list('user_id', 'stats_version')), versions)
+
+        # Swapping ranks re-notifies both squads even though member rows are unchanged
+        self.post(**self.grid([1, 2]))
+        self.assertEqual(Notification.objects.count(), 8)
+
+    def test_bulk_submission_rejects_duplicate_ranks(self):
+        self.post(**self.grid([1, 1]))
+        self.assertFalse(TeamUPRoundStats.objects.exists())
+        self.assertFalse(TeamUPPlayerRoundStats.objects.exists())
+
+    def test_bulk_submission_uses_constant_queries(self):
+        self.post(**self.grid([1, None]))  # create the round
+        round_instance = TeamUPRound.objects.select_related('stage').get(fixture=self.fixture)
+        teams = list(self.fixture.teamups.prefetch_related('players'))
+        PersonalProfile.objects.bulk_create(
+            [PersonalProfile(user=player) for team in teams for player in team.players.all()], ignore_conflicts=True
+        )
+
+        def save(ranks):
+            TeamUPRoundStats.objects.all().delete()
+            TeamUPPlayerRoundStats.objects.all().delete()
+            TeamLeaderboardEntry.objects.all().delete()
+            rows, errors = results.parse_team_grid(self.grid(ranks), teams)
+            self.assertEqual(errors, [])
+            with CaptureQueriesContext(connection) as queries:
+                results.save_team_results(round_instance, rows, self.staff)
+            return len(queries)
+
+        self.assertEqual(save([1, None]), save([1, 2]))
+
+
+class SquadReadinessTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.duo_mode = GameMode.objects.create(name='Duo', amount=200, max_players=2)
+        self.cohorts = [
+            Cohort.objects.create(
+                name=f'Season {i}', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+            )
+            for i in range(2)
+        ]
+        self.members = [
+            User.objects.create_user(
+                email=f'duo{i}@example.com', phone_number=f'07550000{i:02d}', password='password123', gamer_tag=f'Duo{i}'
+            )
+            for i in range(2)
+        ]
+        self.team = TeamUP.objects.create(name='Pair', captain=self.members[0], game_mode=self.duo_mode)
+        self.team.players.set(self.members)
+
+    def pay(self, user, cohort, status='SUCCESS'):
+        MPesaTransaction.objects.create(
+            merchant_request_id=f'm-{user.id}-{cohort.id}-{status}', checkout_request_id=f'c-{user.id}-{cohort.id}-{status}',
+            amount=200, phone_number='254700000000', user=user, cohort=cohort, game_mode=self.duo_mode,
+            team=self.team, status=status
+        )
+
+    def test_resolves_every_pair_in_two_queries(self):
+        self.pay(self.members[0], self.cohorts[0])
+        self.pay(self.members[1], self.cohorts[0])
+        self.pay(self.members[0], self.cohorts[1])
+        self.pay(self.members[1], self.cohorts[1], status='FAILED')
+        team = TeamUP.objects.select_related('game_mode').get(id=self.team.id)
+        with self.assertNumQueries(2):
+            resolved = readiness.resolve((team, cohort) for cohort in self.cohorts)
+        first, second = resolved[(team.id, self.cohorts[0].id)], resolved[(team.id, self.cohorts[1].id)]
+        self.assertEqual((first['paid_count'], first['is_ready']), (2, True))
+        self.assertEqual((second['paid_count'], second['is_ready']), (1, False))
+        self.assertEqual(self.team.get_payment_status(self.cohorts[1]), [
+            {'player': self.members[0], 'paid': True},
+            {'player': self.members[1], 'paid': False},
+        ])
+
+    def test_short_roster_is_never_ready(self):
+        self.team.players.remove(self.members[1])
+        self.pay(self.members[0], self.cohorts[0])
+        self.assertFalse(self.team.is_ready(self.cohorts[0]))
+
+    def test_dashboard_and_manage_squad_show_readiness(self):
+        self.pay(self.members[0], self.cohorts[0])
+        readiness.refresh(self.team, self.cohorts)
+        self.client.force_login(self.members[0])
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, '1/2 PAID')
+        response = self.client.get(reverse('manage_squad', args=[self.team.id]))
+        self.assertEqual(len(response.context['member_payments'][self.members[0].id]), 2)
+
+    def test_callback_and_roster_changes_refresh_persisted_readiness(self):
+        for i, member in enumerate(self.members):
+            self.pay(member, self.cohorts[0], status='PENDING')
+            PersonalProfile.objects.create(user=member)
+        for member in self.members:
+            self.client.post(reverse('mpesa_callback'), json.dumps({'Body': {'stkCallback': {
+                'MerchantRequestID': f'm-{member.id}-{self.cohorts[0].id}-PENDING',
+                'CheckoutRequestID': f'c-{member.id}-{self.cohorts[0].id}-PENDING',
+                'ResultCode': 0, 'ResultDesc': 'Processed',
+            }}}), content_type='application/json')
+        payments.apply_callbacks()
+        row = SquadCohortReadiness.objects.get(team=self.team, cohort=self.cohorts[0])
+        self.assertEqual((row.paid_count, row.is_ready), (2, True))
+
+        # A third operator joins without paying: the squad is no longer fully paid
+        recruit = User.objects.create_user(
+            email='recruit@example.com', phone_number='0755000099', password='password123', gamer_tag='Recruit'
+        )
+        invite = TeamUPInvite.objects.create(inviter=self.members[0], invitee=recruit, team=self.team)
+        self.client.force_login(recruit)
+        self.client.post(reverse('respond_invite', args=[invite.id]), {'action': 'accept'})
+        row.refresh_from_db()
+        self.assertEqual((row.roster_size, row.is_ready), (3, False))
+
+        readiness.rebuild()
+        self.assertEqual(SquadCohortReadiness.objects.get(team=self.team, cohort=self.cohorts[0]).paid_count, 2)
+
+
+class CohortMembershipTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        self.cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.user = User.objects.create_user(
+            email='recruit@example.com', phone_number='0734000000', password='password123', gamer_tag='Recruit'
+        )
+        self.profile, _ = PersonalProfile.objects.get_or_create(user=self.user)
+        self.client.force_login(self.user)
+
+    def test_join_checks_membership_without_loading_participants(self):
+        for i in range(20):
+            entrant = User.objects.create_user(
+                email=f'entrant{i}@example.com', phone_number=f'07350000{i:02d}', password='password123',
+                gamer_tag=f'Entrant{i}'
+            )
+            self.cohort.participants.add(PersonalProfile.objects.get_or_create(user=entrant)[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('join_cohort', args=[self.cohort.id]))
+        self.assertFalse(any('"users_personalprofile"."user_id"' in query['sql'] and 'home_cohort_participants' in query['sql']
+                             for query in queries))
+        self.assertTrue(self.cohort.participants.filter(id=self.profile.id).exists())
+
+    def test_participant_counter_counts_each_entrant_once(self):
+        self.assertEqual(cohorts.participant_count(self.cohort.id), 0)
+        self.client.post(reverse('join_cohort', args=[self.cohort.id]))
+        self.client.post(reverse('join_cohort', args=[self.cohort.id]))
+        with self.assertNumQueries(0):
+            self.assertEqual(cohorts.participant_count(self.cohort.id), 1)
+        self.assertEqual(self.cohort.participants.count(), 1)
+
+    def test_paid_enrolment_refreshes_the_counter(self):
+        self.assertEqual(cohorts.participant_count(self.cohort.id), 0)
+        payment = MPesaTransaction.objects.create(
+            merchant_request_id='merchant-1', checkout_request_id='ws_CO_1', amount=100,
+            phone_number='254734000000', user=self.user, cohort=self.cohort, game_mode=self.mode
+        )
+        payments.settle([(payment, 0, 'Processed')])
+        self.assertEqual(cohorts.participant_count(self.cohort.id), 1)
+
+
+class DashboardQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='busy@example.com', phone_number='0733000000', password='password123', gamer_tag='Busy'
+        )
+        self.profile, _ = PersonalProfile.objects.get_or_create(user=self.user)
+        self.mode = GameMode.objects.create(name='Squad', amount=100, max_players=4)
+        self.rival = User.objects.create_user(
+            email='rival@example.com', phone_number='0733000001', password='password123', gamer_tag='Rival'
+        )
+        self.added = 0
+        self.client.force_login(self.user)
+
+    def grow(self):
+        """Adds one more cohort, squad, invite, fixture of each kind and result of each kind."""
+        i, now = self.added, timezone.now()
+        self.added += 1
+        cohort = Cohort.objects.create(
+            name=f'Season {i}', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        cohort.participants.add(self.profile)
+        stage = GameStage.objects.create(cohort=cohort, name=f'Stage {i}', game_mode=self.mode)
+        squad = TeamUP.objects.create(name=f'Squad {i}', captain=self.user, game_mode=self.mode)
+        squad.players.set([self.user, self.rival])
+        rival_squad = TeamUP.objects.create(name=f'Rivals {i}', captain=self.rival, game_mode=self.mode)
+        TeamUPInvite.objects.create(inviter=self.rival, invitee=self.user, team=rival_squad)
+
+        fixture = Fixture.objects.create(cohort=cohort, stage=stage, match_date=now)
+        fixture.players.add(self.user)
+        team_fixture = TeamUPFixture.objects.create(cohort=cohort, stage=stage, match_date=now)
+        team_fixture.teamups.set([squad, rival_squad])
+        round_instance = Round.objects.create(fixture=fixture, cohort=cohort, stage=stage, match_date=now)
+        RoundPlayerStats.objects.create(round_instance=round_instance, player=self.user, rank=1, kills=1, deaths=0, xp=10)
+        team_round = TeamUPRound.objects.create(fixture=team_fixture, cohort=cohort, stage=stage, match_date=now)
+        TeamUPRoundStats.objects.create(round_instance=team_round, team=squad, rank=1)
+
+    def dashboard_queries(self, cached=False):
+        if not cached:
+            # Measure the full render rather than cached fragments
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_data(self):
+        self.grow()
+        _, baseline = self.dashboard_queries()
+        for _ in range(4):
+            self.grow()
+        response, grown = self.dashboard_queries()
+        self.assertEqual(grown, baseline)
+        self.assertEqual(len(response.context['user_squads']), 5)
+        self.assertEqual(response.context['user_squads'][0].player_count, 2)
+        self.assertEqual(len(response.context['joined_cohort_ids']), 5)
+        self.assertContains(response, 'Squad 4 <span class="text-white/20 mx-1">vs</span>')
+
+    def test_repeat_visit_serves_cached_fragments(self):
+        for _ in range(3):
+            self.grow()
+        _, first = self.dashboard_queries()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        self.assertLess(len(queries), first)
+        self.assertFalse(any('home_teamup' in query['sql'] and 'COUNT' in query['sql'] for query in queries))
+        self.assertContains(response, 'Squad 2')
+
+    def test_user_actions_invalidate_their_sections(self):
+        self.grow()
+        self.dashboard_queries()
+        now = timezone.now()
+        cohort = Cohort.objects.create(
+            name='Late Season', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.client.post(reverse('join_cohort', args=[cohort.id]))
+        self.client.post(reverse('create_squad'), {'name': 'Fresh Squad', 'game_mode': self.mode.id})
+        response, _ = self.dashboard_queries(cached=True)
+        self.assertContains(response, 'text-white">Late Season</h3>')
+        self.assertContains(response, 'text-white">Fresh Squad')
+
+    def test_admin_fixture_changes_invalidate_fixtures(self):
+        self.grow()
+        self.dashboard_queries()
+        cohort = Cohort.objects.get(name='Season 0')
+        late_stage = GameStage.objects.create(cohort=cohort, name='Late Stage', game_mode=self.mode)
+        squad_stage = GameStage.objects.create(cohort=cohort, name='Squad Showdown', game_mode=self.mode)
+        squad = TeamUP.objects.get(name='Squad 0')
+        now = timezone.localtime()
+        when = {'match_date_0': now.strftime('%Y-%m-%d'), 'match_date_1': now.strftime('%H:%M:%S')}
+        staff = User.objects.create_superuser(
+            email='staff@example.com', phone_number='0733999999', password='password123', gamer_tag='Overseer'
+        )
+        self.client.force_login(staff)
+        self.client.post(reverse('admin:home_fixture_add'), {
+            'cohort': cohort.id, 'stage': late_stage.id, 'players': [self.user.id], **when,
+        })
+        self.client.post(reverse('admin:home_teamupfixture_add'), {
+            'cohort': cohort.id, 'stage': squad_stage.id, 'teamups': [squad.id], **when,
+        })
+        self.assertEqual(Fixture.objects.filter(stage=late_stage).count(), 1)
+        self.assertEqual(TeamUPFixture.objects.filter(stage=squad_stage).count(), 1)
+
+        self.client.force_login(self.user)
+        response, _ = self.dashboard_queries(cached=True)
+        self.assertContains(response, 'Late Stage')
+        self.assertContains(response, 'Squad Showdown')
+
+
+class BracketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.solo_mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        self.squad_mode = GameMode.objects.create(name='Squad', amount=100, max_players=4)
+        self.cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.staff = User.objects.create_superuser(
+            email='staff@example.com', phone_number='0736000000', password='password123', gamer_tag='Overseer'
+        )
+        self.added = 0
+
+    def grow(self):
+        """Adds a stage holding a solo fixture of two players and a team fixture of two squads."""
+        i, now = self.added, timezone.now()
+        self.added += 1
+        stage = GameStage.objects.create(cohort=self.cohort, name=f'Stage {i}', game_mode=self.solo_mode, order=i)
+        players = [
+            User.objects.create_user(
+                email=f'bracket{i}-{n}@example.com', phone_number=f'0737{i:03d}{n:03d}', password='password123',
+                gamer_tag=f'Bracket{i}x{n}'
+            )
+            for n in range(2)
+        ]
+        Fixture.objects.create(cohort=self.cohort, stage=stage, match_date=now).players.set(players)
+        squads = [TeamUP.objects.create(name=f'Squad {i}-{n}', captain=players[n], game_mode=self.squad_mode) for n in range(2)]
+        TeamUPFixture.objects.create(cohort=self.cohort, stage=stage, match_date=now).teamups.set(squads)
+        return stage
+
+    def bracket_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('brackets', args=[self.cohort.id]))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_the_bracket(self):
+        self.grow()
+        _, baseline = self.bracket_queries()
+        for _ in range(3):
+            self.grow()
+        brackets.bump([self.cohort.id])
+        response, grown = self.bracket_queries()
+        self.assertEqual(grown, baseline)
+        self.assertContains(response, 'Bracket3x1')
+        self.assertContains(response, 'Squad 3-0')
+
+    def test_repeat_visit_serves_the_cached_bracket(self):
+        self.grow()
+        _, first = self.bracket_queries()
+        response, repeat = self.bracket_queries()
+        self.assertEqual(repeat, 1)
+        self.assertLess(repeat, first)
+        self.assertContains(response, 'Bracket0x0')
+
+    def test_admin_fixture_changes_invalidate_the_bracket(self):
+        stage = self.grow()
+        self.bracket_queries()
+        newcomer = User.objects.create_user(
+            email='newcomer@example.com', phone_number='0738000000', password='password123', gamer_tag='Newcomer'
+        )
+        now = timezone.localtime()
+        self.client.force_login(self.staff)
+        self.client.post(reverse('admin:home_fixture_add'), {
+            'cohort': self.cohort.id, 'stage': stage.id, 'players': [newcomer.id],
+            'match_date_0': now.strftime('%Y-%m-%d'), 'match_date_1': now.strftime('%H:%M:%S'),
+        })
+        self.assertTrue(Fixture.objects.filter(players=newcomer).exists())
+        response, _ = self.bracket_queries()
+        self.assertContains(response, 'Newcomer')
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.solo_mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        self.squad_mode = GameMode.objects.create(name='Squad', amount=100, max_players=4)
+        self.cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.slots = [now + timedelta(hours=1), now + timedelta(hours=2)]
+
+    def enter_players(self, stage, count, offset=0):
+        """Bulk-enters count players into stage; player i has career XP i."""
+        users = User.objects.bulk_create([
+            User(username=f'seed{offset + i}', email=f'seed{offset + i}@example.com', phone_number=f'0739{offset + i:06d}',
+                 gamer_tag=f'Seed{offset + i}')
+            for i in range(count)
+        ])
+        profiles = PersonalProfile.objects.bulk_create([
+            PersonalProfile(user=user, total_xp=i) for i, user in enumerate(users)
+        ])
+        StageParticipants.objects.bulk_create([
+            StageParticipants(cohort=self.cohort, stage=stage, participant=profile) for profile in profiles
+        ])
+        return users
+
+    def test_snake_seeding_balances_lobbies(self):
+        self.assertEqual(scheduler.snake(list(range(10)), 3), [[0, 5, 6], [1, 4, 7], [2, 3, 8, 9]])
+
+    def test_solo_stage_is_scheduled_in_a_fixed_number_of_queries(self):
+        small = GameStage.objects.create(cohort=self.cohort, name='Heats', game_mode=self.solo_mode)
+        large = GameStage.objects.create(cohort=self.cohort, name='Qualifiers', game_mode=self.solo_mode)
+        self.enter_players(small, 25)
+        users = self.enter_players(large, 250, offset=25)
+
+        with CaptureQueriesContext(connection) as small_queries:
+            scheduler.schedule(small, self.slots, lobby_size=10)
+        with CaptureQueriesContext(connection) as large_queries:
+            fixtures = scheduler.schedule(large, self.slots, lobby_size=100)
+        self.assertEqual(len(large_queries), len(small_queries))
+
+        sizes = sorted(fixture.players.count() for fixture in fixtures)
+        self.assertEqual(sizes, [83, 83, 84])
+        # The three strongest players land in different lobbies
+        top = [user.id for user in users[-3:]]
+        self.assertEqual(Fixture.objects.filter(stage=large, players__in=top).distinct().count(), 3)
+        self.assertEqual({fixture.match_date for fixture in fixtures}, set(self.slots))
+
+    def test_links_do_not_rely_on_bulk_insert_returning_ids(self):
+        stage = GameStage.objects.create(cohort=self.cohort, name='Heats', game_mode=self.solo_mode)
+        users = self.enter_players(stage, 9)
+        # As on MySQL, bulk_create leaves the new fixtures without primary keys
+        with mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False
+        ):
+            fixtures = scheduler.schedule(stage, self.slots, lobby_size=3)
+        self.assertEqual(len(fixtures), 3)
+        self.assertEqual(Fixture.players.through.objects.filter(fixture__stage=stage).count(), 9)
+        # Seeds 1-3 and 4-6 are spread over all three lobbies
+        for seeds in (users[-3:], users[3:6]):
+            self.assertEqual(Fixture.objects.filter(stage=stage, players__in=seeds).distinct().count(), 3)
+        for fixture in fixtures:
+            self.assertEqual(fixture.players.count(), 3)
+
+    def test_team_stage_seeds_squads_on_team_xp(self):
+        stage = GameStage.objects.create(cohort=self.cohort, name='Squad Finals', game_mode=self.squad_mode)
+        users = self.enter_players(GameStage.objects.create(cohort=self.cohort, name='Unused', game_mode=self.solo_mode), 4)
+        squads = [TeamUP.objects.create(name=f'Squad {i}', captain=users[i], game_mode=self.squad_mode) for i in range(4)]
+        for i, squad in enumerate(squads):
+            squad.players.add(users[i])
+            TeamLeaderboardEntry.objects.create(team=squad, total_xp=i * 100)
+            StageParticipants.objects.create(cohort=self.cohort, stage=stage, teamup=squad)
+
+        fixtures = scheduler.schedule(stage, self.slots, lobby_size=2)
+        lobbies = [set(fixture.teamups.values_list('name', flat=True)) for fixture in fixtures]
+        self.assertEqual(lobbies, [{'Squad 3', 'Squad 0'}, {'Squad 2', 'Squad 1'}])
+
+    def test_existing_fixtures_are_only_replaced_on_request(self):
+        stage = GameStage.objects.create(cohort=self.cohort, name='Qualifiers', game_mode=self.solo_mode)
+        self.enter_players(stage, 5)
+        self.client.get(reverse('brackets', args=[self.cohort.id]))
+        call_command('schedule_fixtures', stage.id, '--start', '2026-11-01 18:00', stdout=StringIO())
+        self.assertContains(self.client.get(reverse('brackets', args=[self.cohort.id])), 'Seed4')
+
+        with self.assertRaises(CommandError):
+            call_command('schedule_fixtures', stage.id, '--start', '2026-11-01 18:00', stdout=StringIO())
+        call_command(
+            'schedule_fixtures', stage.id, '--start', '2026-11-01 18:00', '--lobby-size', '2', '--replace', stdout=StringIO()
+        )
+        self.assertEqual(Fixture.objects.filter(stage=stage).count(), 3)
+
+
+class FakeDaraja:
+    """Minimal local stand-in for the Daraja API, served from a background thread."""
+
+    def __init__(self, expires_in=3599, delay=0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.token_requests = 0
+        self.pushes = []
+        self.queries = []
+        self.query_results = {}  # CheckoutRequestID -> ResultCode; anything else is still processing
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, status=200):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.startswith('/oauth/v1/generate'):
+                    time.sleep(fake.delay)
+                    with fake.lock:
+                        fake.token_requests += 1
+                        token = f'token-{fake.token_requests}'
+                    self.reply({'access_token': token, 'expires_in': str(fake.expires_in)})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path == '/mpesa/stkpushquery/v1/query':
+                    with fake.lock:
+                        fake.queries.append(body['CheckoutRequestID'])
+                    result_code = fake.query_results.get(body['CheckoutRequestID'])
+                    if result_code is None:
+                        self.reply({'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}, 500)
+                    else:
+                        self.reply({
+                            'ResponseCode': '0', 'CheckoutRequestID': body['CheckoutRequestID'],
+                            'ResultCode': str(result_code), 'ResultDesc': 'Processed',
+                        })
+                    return
+                with fake.lock:
+                    fake.pushes.append((self.headers['Authorization'], body))
+                    n = len(fake.pushes)
+                if self.path == '/mpesa/stkpush/v1/processrequest':
+                    self.reply({
+                        'MerchantRequestID': f'merchant-{n}', 'CheckoutRequestID': f'ws_CO_{n}',
+                        'ResponseCode': '0', 'ResponseDescription': 'Success. Request accepted for processing',
+                    })
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.handle_error = lambda request, address: None  # clients that timed out hang up mid-reply
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, **kwargs):
+        return mpesa.MPesaClient('key', 'secret', '174379', 'passkey', 'https://example.com/cb', base_url=self.url, **kwargs)
+
+
+class MPesaClientTests(TestCase):
+    def setUp(self):
+        self.daraja = FakeDaraja()
+        self.addCleanup(self.daraja.close)
+
+    def test_token_is_reused_across_pushes(self):
+        client = self.daraja.client()
+        for _ in range(3):
+            self.assertEqual(client.stk_push(100, '254700000000', 'GM1', 'Test')['ResponseCode'], '0')
+        self.assertEqual(self.daraja.token_requests, 1)
+        self.assertEqual({auth for auth, _ in self.daraja.pushes}, {'Bearer token-1'})
+
+    def test_token_refreshes_near_expiry(self):
+        self.daraja.expires_in = mpesa.MPesaClient.TOKEN_REFRESH_MARGIN  # already inside the refresh margin
+        client = self.daraja.client()
+        client.get_access_token()
+        self.assertEqual(client.get_access_token(), 'token-2')
+
+    def test_concurrent_callers_share_one_refresh(self):
+        self.daraja.delay = 0.2
+        client = self.daraja.client()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            tokens = set(pool.map(lambda _: client.get_access_token(), range(8)))
+        self.assertEqual((tokens, self.daraja.token_requests), ({'token-1'}, 1))
+
+    def test_slow_daraja_raises_instead_of_hanging(self):
+        self.daraja.delay = 0.5
+        client = self.daraja.client(timeout=(1, 0.1))
+        with self.assertRaises(mpesa.MPesaError):
+            client.get_access_token()
+
+    def test_initiate_payment_records_pending_transaction(self):
+        now = timezone.now()
+        mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        user = User.objects.create_user(
+            email='payer@example.com', phone_number='0766000000', password='password123', gamer_tag='Payer'
+        )
+        self.client.force_login(user)
+        client = self.daraja.client()
+        with mock.patch('home.mpesa.get_client', return_value=client):
+            response = self.client.post(reverse('initiate_payment', args=[mode.id, cohort.id]), {'phone_number': '0766000000'})
+        # Nothing is sent to Daraja until the worker runs
+        payment_request = PaymentRequest.objects.get(user=user)
+        self.assertRedirects(response, reverse('payment_status', args=[payment_request.id]))
+        self.assertEqual((payment_request.status, self.daraja.pushes), ('QUEUED', []))
+
+        self.assertEqual(payments.dispatch(client=client), (1, 0))
+        transaction = MPesaTransaction.objects.get(user=user)
+        self.assertEqual((transaction.status, transaction.phone_number), ('PENDING', '254766000000'))
+        self.assertEqual(self.daraja.pushes[0][1]['Amount'], 100)
+
+        response = self.client.get(reverse('payment_status', args=[payment_request.id]), HTTP_HX_REQUEST='true')
+        self.assertEqual(response.context['payment_request'].progress, 'SENT')
+        self.assertContains(response, 'hx-trigger="every 2s"')
+
+        MPesaTransaction.objects.filter(id=transaction.id).update(status='SUCCESS')
+        response = self.client.get(reverse('payment_status', args=[payment_request.id]), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'Payment confirmed')
+        self.assertNotContains(response, 'hx-trigger')
+
+    def test_worker_marks_unreachable_daraja_as_failed(self):
+        now = timezone.now()
+        mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        user = User.objects.create_user(
+            email='payer@example.com', phone_number='0766000000', password='password123', gamer_tag='Payer'
+        )
+        payment_request = payments.enqueue(user, cohort, mode, '254766000000')
+        self.daraja.delay = 0.5
+        self.assertEqual(payments.dispatch(client=self.daraja.client(timeout=(1, 0.1))), (0, 1))
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.progress, 'FAILED')
+
+    def test_requests_abandoned_mid_send_are_failed(self):
+        now = timezone.now()
+        mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        user = User.objects.create_user(
+            email='payer@example.com', phone_number='0766000000', password='password123', gamer_tag='Payer'
+        )
+        stale, fresh = (payments.enqueue(user, cohort, mode, '254766000000') for _ in range(2))
+        # A worker claimed both and died before pushing either
+        payments.claim_batch(2)
+        PaymentRequest.objects.filter(id=stale.id).update(
+            updated_at=now - payments.sending_timeout(2, self.daraja.client()) * 2
+        )
+
+        self.assertEqual(payments.dispatch(batch_size=2, client=self.daraja.client()), (0, 1))
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, fresh.status, self.daraja.pushes), ('FAILED', 'SENDING', []))
+        self.assertTrue(stale.error)
+
+    def test_expired_requests_are_never_marked_sent(self):
+        now = timezone.now()
+        mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        user = User.objects.create_user(
+            email='payer@example.com', phone_number='0766000000', password='password123', gamer_tag='Payer'
+        )
+        client = self.daraja.client()
+        for _ in range(2):
+            payments.enqueue(user, cohort, mode, '254766000000')
+        before, during = payments.claim_batch(2)
+        later = now + timedelta(days=1)
+
+        # Another worker expires the request before its turn: nothing is pushed
+        payments.expire_stale(timedelta(0), now=later)
+        self.assertFalse(payments.send(before, client))
+        self.assertEqual(self.daraja.pushes, [])
+
+        # Or while its push is in flight: the prompt went out, but the FAILED status stands
+        PaymentRequest.objects.filter(id=during.id).update(status='SENDING')
+        stk_push = client.stk_push
+
+        def expire_then_push(**kwargs):
+            payments.expire_stale(timedelta(0), now=later)
+            return stk_push(**kwargs)
+
+        with mock.patch.object(client, 'stk_push', side_effect=expire_then_push):
+            self.assertFalse(payments.send(during, client))
+        self.assertEqual(len(self.daraja.pushes), 1)
+        self.assertEqual(
+            set(PaymentRequest.objects.values_list('status', 'transaction')), {('FAILED', None)}
+        )
+        self.assertFalse(MPesaTransaction.objects.exists())
+
+
+class MPesaCallbackTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        self.cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.user = User.objects.create_user(
+            email='payer@example.com', phone_number='0766000000', password='password123', gamer_tag='Payer'
+        )
+        self.profile = PersonalProfile.objects.create(user=self.user)
+        self.payment = MPesaTransaction.objects.create(
+            merchant_request_id='merchant-1', checkout_request_id='ws_CO_1', amount=100,
+            phone_number='254766000000', user=self.user, cohort=self.cohort, game_mode=self.mode
+        )
+
+    def callback(self, checkout_request_id='ws_CO_1', result_code=0):
+        return self.client.post(reverse('mpesa_callback'), json.dumps({'Body': {'stkCallback': {
+            'MerchantRequestID': 'merchant-1', 'CheckoutRequestID': checkout_request_id,
+            'ResultCode': result_code, 'ResultDesc': 'Processed',
+        }}}), content_type='application/json')
+
+    def test_callback_is_acknowledged_before_it_is_applied(self):
+        with self.assertNumQueries(1):
+            response = self.callback()
+        self.assertEqual(response.json(), {'status': 'Success'})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'PENDING')
+
+    def test_duplicate_callbacks_apply_once(self):
+        self.callback()
+        self.callback()
+        self.assertEqual(payments.apply_callbacks(), 2)
+        self.callback()
+        payments.apply_callbacks()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'SUCCESS')
+        self.assertTrue(self.cohort.participants.filter(id=self.profile.id).exists())
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 1)
+        self.assertEqual(
+            sorted(MPesaCallback.objects.values_list('outcome', flat=True)), ['duplicate', 'duplicate', 'success']
+        )
+
+    def test_callback_for_a_reconciled_transaction_is_a_duplicate(self):
+        self.callback()
+        payments.settle([(self.payment, 0, 'Processed by reconcile')])
+        payments.apply_callbacks()
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 1)
+        self.assertEqual(list(MPesaCallback.objects.values_list('outcome', flat=True)), ['duplicate'])
+
+    def test_unknown_and_malformed_callbacks_are_recorded(self):
+        self.callback(checkout_request_id='ws_CO_missing')
+        self.client.post(reverse('mpesa_callback'), 'not json', content_type='application/json')
+        self.callback(result_code=1032)
+        payments.apply_callbacks()
+        self.assertEqual(
+            sorted(MPesaCallback.objects.values_list('outcome', flat=True)), ['failed', 'invalid payload', 'transaction not found']
+        )
+        self.assertFalse(self.cohort.participants.exists())
+
+
+class MPesaReconcileTests(TestCase):
+    def setUp(self):
+        self.daraja = FakeDaraja()
+        self.addCleanup(self.daraja.close)
+        now = timezone.now()
+        self.mode = GameMode.objects.create(name='Solo', amount=100, max_players=1)
+        self.cohort = Cohort.objects.create(
+            name='Season 1', start_date=now, end_date=now + timedelta(days=30), closes_at=now + timedelta(days=5)
+        )
+        self.payments = []
+        for i in range(5):
+            user = User.objects.create_user(
+                email=f'payer{i}@example.com', phone_number=f'076600000{i}', password='password123', gamer_tag=f'Payer{i}'
+            )
+            self.payments.append(MPesaTransaction.objects.create(
+                merchant_request_id=f'merchant-{i}', checkout_request_id=f'ws_CO_{i}', amount=100,
+                phone_number=f'25476600000{i}', user=user, cohort=self.cohort, game_mode=self.mode
+            ))
+        MPesaTransaction.objects.update(created_at=now - timedelta(minutes=10))
+
+    def test_aged_pending_transactions_are_settled_in_bulk(self):
+        self.daraja.query_results = {'ws_CO_0': 0, 'ws_CO_1': 0, 'ws_CO_2': 1032}
+        recent = self.payments[4]
+        MPesaTransaction.objects.filter(id=recent.id).update(created_at=timezone.now())
+
+        metrics = payments.reconcile(batch_size=2, workers=3, rate=0, client=self.daraja.client())
+
+        self.assertEqual(dict(metrics), {'queried': 4, 'success': 2, 'failed': 1, 'pending': 1})
+        self.assertEqual(sorted(self.daraja.queries), ['ws_CO_0', 'ws_CO_1', 'ws_CO_2', 'ws_CO_3'])
+        self.assertEqual(
+            dict(MPesaTransaction.objects.values_list('checkout_request_id', 'status')),
+            {'ws_CO_0': 'SUCCESS', 'ws_CO_1': 'SUCCESS', 'ws_CO_2': 'FAILED', 'ws_CO_3': 'PENDING', 'ws_CO_4': 'PENDING'},
+        )
+        self.assertEqual(self.cohort.participants.count(), 2)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_settling_payers_without_profiles_costs_the_same_for_any_batch(self):
+        def settle(batch):
+            with CaptureQueriesContext(connection) as queries:
+                payments.settle([(payment, 0, 'Processed') for payment in batch])
+            return len(queries)
+
+        self.assertEqual(settle(self.payments[:2]), settle(self.payments[2:]))
+        self.assertEqual(self.cohort.participants.count(), 5)
+
+    def test_query_errors_are_counted_and_left_pending(self):
+        self.daraja.delay = 0.5  # token fetch times out
+        metrics = payments.reconcile(client=self.daraja.client(timeout=(1, 0.1)))
+        self.assertEqual((metrics['queried'], metrics['errors']), (5, 5))
+        self.assertFalse(MPesaTransaction.objects.exclude(status='PENDING').exists())
+
+    def test_queries_are_rate_limited(self):
+        client = self.daraja.client()
+        client.get_access_token()
+        started = time.monotonic()
+        payments.reconcile(workers=5, rate=20, client=client)
+        # Five queries spaced 1/20s apart take at least four intervals
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
@@ -16,6 +16,7 @@ urlpatterns = [
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('cohort/<int:cohort_id>/join/', views.join_cohort_view, name='join_cohort'),
     path('leaderboard/', views.leaderboard_view, name='leaderboard'),
+    path('leaderboard/squads/', views.team_leaderboard_view, name='team_leaderboard'),
     path('player/<str:gamer_tag>/analytics/', views.player_analytics_view, name='player_analytics'),
     path('admin-dashboard/', views.admin_dashboard_view, name='admin_dashboard'),
     path('fixture-solo/<int:fixture_id>/record-stats/', views.record_solo_stats_view, name='record_solo_stats'),
@@ -24,11 +25,14 @@ urlpatterns = [
     # Squad Management
     path('squad/create/', views.create_squad_view, name='create_squad'),
     path('squad/<int:team_id>/manage/', views.manage_squad_view, name='manage_squad'),
+    path('squad/<int:team_id>/invite-suggestions/', views.invite_suggestions_view, name='invite_suggestions'),
     path('invite/<int:invite_id>/respond/', views.respond_invite_view, name='respond_invite'),
     
     # Notifications
     path('notifications/', views.notifications_view, name='notifications'),
     path('notification/<int:notification_id>/read/', views.mark_notification_read, name='mark_notification_read'),
+    path('notifications/read-all/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
+    path('notifications/stream/', views.notification_stream_view, name='notification_stream'),
     
     # Brackets
     path('cohort/<int:cohort_id>/brackets/', views.bracket_view, name='brackets'),
@@ -36,6 +40,7 @@ urlpatterns = [
     # Game Modes & M-Pesa
     path('gamemode/<int:mode_id>/', views.gamemode_detail_view, name='gamemode_detail'),
     path('gamemode/<int:mode_id>/pay/<int:cohort_id>/', views.initiate_payment_view, name='initiate_payment'),
+    path('payment/<int:request_id>/status/', views.payment_status_view, name='payment_status'),
     path('mpesa/callback/', views.mpesa_callback_view, name='mpesa_callback'),
     # Recruitment
     path('recruitment/', views.recruitment_center_view, name='recruitment_center'),
@@ -1,69 +1,37 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.utils import timezone
-from django.db.models import Sum, Count, Avg, Q
-from .models import Cohort, GameMode, Fixture, TeamUPFixture, Round, RoundPlayerStats, TeamUPRound, TeamUPRoundStats, TeamUPPlayerRoundStats, GameStage, TeamUP, Notification, TeamUPInvite, MPesaTransaction, FreeAgent, SquadRecruitment, JoinRequest
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Sum, Avg, Q
+from .models import Cohort, GameMode, Fixture, TeamUPFixture, RoundPlayerStats, TeamUPRoundStats, TeamUPPlayerRoundStats, GameStage, TeamUP, Notification, TeamUPInvite, FreeAgent, SquadRecruitment, JoinRequest, PaymentRequest
 from users.models import User
-import requests
+from users import search
 import json
-import base64
-from datetime import datetime
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from .ai_service import ai_service
-import os
+from . import brackets, career, cohorts, dashboard, leaderboard, mpesa, notifications, payments, ranking, readiness, results
 from dotenv import load_dotenv
 
 load_dotenv()
+
+LEADERBOARD_PAGE_SIZE = 50
+NOTIFICATIONS_PAGE_SIZE = 20
+STREAM_KEEPALIVE = 25
+STREAM_LIFETIME = 300
+STREAM_RETRY_MS = 5000
+
 def landing_page_view(request):
     return render(request, 'home/index.html')
 
 @login_required
 def dashboard_view(request):
-    profile = getattr(request.user, 'profile', None)
-    active_cohorts = Cohort.objects.filter(is_open_to_join=True).order_by('-start_date')
-    game_modes = GameMode.objects.all()
-    
-    # Fetch fixtures (Showing both upcoming and played)
-    now = timezone.now()
-    solo_fixtures = Fixture.objects.filter(players=request.user, match_date__gte=now - timezone.timedelta(days=1)).order_by('match_date')[:10]
-    team_fixtures = TeamUPFixture.objects.filter(teamups__players=request.user, match_date__gte=now - timezone.timedelta(days=1)).distinct().order_by('match_date')[:10]
-    
-    # Fetch results
-    recent_solo_results = RoundPlayerStats.objects.filter(player=request.user).order_by('-round_instance__match_date')[:5]
-    recent_team_results = TeamUPRoundStats.objects.filter(team__players=request.user).distinct().order_by('-round_instance__match_date')[:5]
-    
-    # Squad Management
-    user_squads = request.user.teamups.all()
-    pending_invites = TeamUPInvite.objects.filter(invitee=request.user, status='PENDING')
-    
-    # Squad Readiness for active cohorts
-    squad_readiness = []
-    for squad in user_squads:
-        for cohort in active_cohorts:
-            squad_readiness.append({
-                'squad': squad,
-                'cohort': cohort,
-                'is_ready': squad.is_ready(cohort),
-                'paid_count': sum(1 for p in squad.get_payment_status(cohort) if p['paid']),
-                'total_needed': squad.game_mode.max_players
-            })
-    
-    context = {
-        'profile': profile,
-        'active_cohorts': active_cohorts,
-        'game_modes': game_modes,
-        'solo_fixtures': solo_fixtures,
-        'team_fixtures': team_fixtures,
-        'recent_solo_results': recent_solo_results,
-        'recent_team_results': recent_team_results,
-        'user_squads': user_squads,
-        'pending_invites': pending_invites,
-        'squad_readiness': squad_readiness,
-    }
-    return render(request, 'home/dashboard.html', context)
+    return render(request, 'home/dashboard.html', dashboard.load(request.user))
 
 def leaderboard_view(request):
     mode_id = request.GET.get('mode')
@@ -71,31 +39,39 @@ def leaderboard_view(request):
     stage_id = request.GET.get('stage')
     q = request.GET.get('q', '')
     
-    # Base queryset for users who have stats
-    users_qs = User.objects.all()
+    # Precomputed per-scope totals, kept current by home.leaderboard
+    leaderboard_data = leaderboard.scope_filter(mode_id, cohort_id, stage_id).select_related('player__profile')
     
     if q:
-        users_qs = users_qs.filter(gamer_tag__icontains=q)
-    
-    # Define filters for annotations
-    stats_filters = {}
-    if mode_id:
-        stats_filters['player_stats__round_instance__stage__game_mode_id'] = mode_id
-    if cohort_id:
-        stats_filters['player_stats__round_instance__cohort_id'] = cohort_id
-    if stage_id:
-        stats_filters['player_stats__round_instance__stage_id'] = stage_id
-        
-    # Aggregate stats per player
-    leaderboard_data = users_qs.filter(player_stats__isnull=False).filter(**stats_filters).annotate(
-        total_kills=Sum('player_stats__kills'),
-        total_damage=Sum('player_stats__damage'),
-        total_xp=Sum('player_stats__xp'),
-        matches_played=Count('player_stats')
-    ).select_related('profile').order_by('-total_xp', '-total_kills').distinct()
+        leaderboard_data = leaderboard_data.filter(player__in=search.search_users(q))
+    
+    # Keyset pagination: later pages are fetched by the infinite-scroll sentinel
+    cursor = leaderboard.decode_cursor(request.GET.get('after'))
+    if cursor:
+        podium = []
+        rows, has_more = leaderboard.keyset_page(leaderboard_data, cursor, LEADERBOARD_PAGE_SIZE)
+        first_rank = cursor[3] + 1
+    else:
+        first_page, has_more = leaderboard.keyset_page(leaderboard_data, None, LEADERBOARD_PAGE_SIZE + 3)
+        podium, rows = first_page[:3], first_page[3:]
+        first_rank = 4
+    
+    for position, entry in enumerate(rows, start=first_rank):
+        entry.position = position
+    
+    next_query = None
+    if has_more:
+        params = request.GET.copy()
+        params['after'] = leaderboard.encode_cursor(rows[-1], rows[-1].position)
+        next_query = params.urlencode()
+    
+    if cursor:
+        return render(request, 'home/partials/leaderboard_rows.html', {'rows': rows, 'next_query': next_query})
     
     context = {
-        'leaderboard': leaderboard_data,
+        'podium': podium,
+        'rows': rows,
+        'next_query': next_query,
         'game_modes': GameMode.objects.all(),
         'cohorts': Cohort.objects.all(),
         'stages': GameStage.objects.all(),
@@ -110,6 +86,44 @@ def leaderboard_view(request):
         
     return render(request, 'home/leaderboard.html', context)
 
+def team_leaderboard_view(request):
+    mode_id = request.GET.get('mode')
+    cohort_id = request.GET.get('cohort')
+    stage_id = request.GET.get('stage')
+    
+    standings = leaderboard.team_scope_filter(mode_id, cohort_id, stage_id).select_related('team__game_mode')
+    
+    cursor = leaderboard.decode_cursor(request.GET.get('after'))
+    rows, has_more = leaderboard.keyset_page(standings, cursor, LEADERBOARD_PAGE_SIZE)
+    first_rank = cursor[3] + 1 if cursor else 1
+    for position, entry in enumerate(rows, start=first_rank):
+        entry.position = position
+    
+    next_query = None
+    if has_more:
+        params = request.GET.copy()
+        params['after'] = leaderboard.encode_cursor(rows[-1], rows[-1].position)
+        next_query = params.urlencode()
+    
+    if cursor:
+        return render(request, 'home/partials/team_leaderboard_rows.html', {'rows': rows, 'next_query': next_query})
+    
+    context = {
+        'rows': rows,
+        'next_query': next_query,
+        'game_modes': GameMode.objects.exclude(name='Solo'),
+        'cohorts': Cohort.objects.all(),
+        'stages': GameStage.objects.exclude(game_mode__name='Solo'),
+        'selected_mode': mode_id,
+        'selected_cohort': cohort_id,
+        'selected_stage': stage_id,
+    }
+    
+    if request.headers.get('HX-Request'):
+        return render(request, 'home/partials/team_leaderboard_results.html', context)
+        
+    return render(request, 'home/team_leaderboard.html', context)
+
 @login_required
 def join_cohort_view(request, cohort_id):
     cohort = get_object_or_404(Cohort, id=cohort_id)
@@ -121,8 +135,8 @@ def join_cohort_view(request, cohort_id):
         profile, created = PersonalProfile.objects.get_or_create(user=request.user)
     
     if cohort.is_open_to_join:
-        if profile not in cohort.participants.all():
-            cohort.participants.add(profile)
+        if cohorts.join(cohort, profile):
+            dashboard.bump([request.user.id], 'cohorts')
             messages.success(request, f"Successfully joined {cohort.name}!")
         else:
             messages.info(request, f"You are already a participant in {cohort.name}.")
@@ -135,53 +149,15 @@ def player_analytics_view(request, gamer_tag):
     user = get_object_or_404(User, gamer_tag=gamer_tag)
     profile = getattr(user, 'profile', None)
     
-    # Career Stats (Solo)
-    solo_stats = RoundPlayerStats.objects.filter(player=user).aggregate(
-        total_kills=Sum('kills'),
-        total_damage=Sum('damage'),
-        total_xp=Sum('xp'),
-        matches_played=Count('id'),
-        wins=Count('id', filter=Q(rank=1))
-    )
-    
-    # Career Stats (Team) - combat stats from player's personal performance, context from team stats
-    team_combat_stats = TeamUPPlayerRoundStats.objects.filter(player=user).aggregate(
-        total_kills=Sum('kills'),
-        total_damage=Sum('damage'),
-        total_xp=Sum('xp'),
-    )
-    
-    team_context_stats = TeamUPRoundStats.objects.filter(team__players=user).aggregate(
-        matches_played=Count('id'),
-        wins=Count('id', filter=Q(rank=1))
-    )
-    
-    team_stats = {**team_combat_stats, **team_context_stats}
-    
-    # Recent History
-    from django.db.models import OuterRef, Subquery
-    
-    team_rank_subquery = TeamUPRoundStats.objects.filter(
-        round_instance=OuterRef('round_instance'),
-        team=OuterRef('team')
-    ).values('rank')[:1]
-
-    recent_solo = RoundPlayerStats.objects.filter(player=user).select_related('round_instance__stage').order_by('-round_instance__match_date')[:10]
-    recent_team = TeamUPPlayerRoundStats.objects.filter(player=user).select_related('team', 'round_instance__stage').annotate(
-        team_rank=Subquery(team_rank_subquery)
-    ).order_by('-round_instance__match_date')[:10]
-    
-    # Teams
-    teams = user.teamups.all()
+    # Stats only change when results are recorded, which bumps profile.stats_version
+    summary = career.summary(user, profile)
+    teams = user.teamups.select_related('game_mode').prefetch_related('players')
     
     context = {
         'player': user,
         'profile': profile,
-        'solo_stats': solo_stats,
-        'team_stats': team_stats,
-        'recent_solo': recent_solo,
-        'recent_team': recent_team,
         'teams': teams,
+        **summary,
     }
     return render(request, 'home/analytics.html', context)
 
@@ -197,7 +173,7 @@ def admin_dashboard_view(request):
     
     # Aggregated Stats
     stats = {
-        'total_players': selected_cohort.participants.count() if selected_cohort else 0,
+        'total_players': cohorts.participant_count(selected_cohort.id) if selected_cohort else 0,
         'total_teams': selected_cohort.teamups.count() if selected_cohort else 0,
     }
     
@@ -255,32 +231,44 @@ def record_team_stats_view(request, fixture_id):
     fixture = get_object_or_404(TeamUPFixture, id=fixture_id)
     
     # Get or create the Round instance
-    round_instance, created = TeamUPRound.objects.get_or_create(
-        fixture=fixture,
-        defaults={
-            'cohort': fixture.cohort,
-            'stage': fixture.stage,
-            'match_date': fixture.match_date,
-        }
-    )
-    
-    if created:
-        for team in fixture.teamups.all():
-            round_instance.teamup.add(team)
+    round_instance = results.team_round_for_fixture(fixture)
 
     if request.method == 'POST':
         action = request.POST.get('action')
         
-        if action == 'save_team_rank':
+        if action == 'save_all':
+            teams = fixture.teamups.prefetch_related('players')
+            rows, errors = results.parse_team_grid(request.POST, teams)
+            if errors:
+                for error in errors:
+                    messages.error(request, error)
+            elif not rows:
+                messages.error(request, "Enter a rank for at least one squad.")
+            else:
+                saved = results.save_team_results(round_instance, rows, request.user)
+                if saved:
+                    ranking.request([fixture.stage.game_mode_id])
+                messages.success(request, f"Results saved for {saved} squads.")
+
+        elif action == 'save_team_rank':
             team_id = request.POST.get('team_id')
             team = get_object_or_404(TeamUP, id=team_id)
             rank = request.POST.get('rank') or 0
             
-            TeamUPRoundStats.objects.update_or_create(
-                round_instance=round_instance,
-                team=team,
-                defaults={'rank': rank}
-            )
+            with transaction.atomic():
+                previous = TeamUPRoundStats.objects.filter(
+                    round_instance=round_instance, team=team
+                ).values('rank', 'kills', 'damage', 'xp').first()
+                team_stats, _ = TeamUPRoundStats.objects.update_or_create(
+                    round_instance=round_instance,
+                    team=team,
+                    defaults={'rank': rank}
+                )
+                leaderboard.apply_team_stat(team_stats, previous)
+                career.touch(TeamUPPlayerRoundStats.objects.filter(
+                    round_instance=round_instance, team=team
+                ).values('player_id'))
+                dashboard.bump(team.players.values_list('id', flat=True), 'results')
             messages.success(request, f"Rank updated for {team.name}")
             
         elif action == 'save_player_stats':
@@ -289,21 +277,27 @@ def record_team_stats_view(request, fixture_id):
             player = get_object_or_404(User, id=player_id)
             team = get_object_or_404(TeamUP, id=team_id)
             
-            player_stat, _ = TeamUPPlayerRoundStats.objects.update_or_create(
-                round_instance=round_instance,
-                team=team,
-                player=player,
-                defaults={
-                    'kills': request.POST.get('kills') or 0,
-                    'deaths': request.POST.get('deaths') or 0,
-                    'damage': request.POST.get('damage') or 0,
-                    'xp': request.POST.get('xp') or 0,
-                }
-            )
+            with transaction.atomic():
+                previous_player = TeamUPPlayerRoundStats.objects.filter(
+                    round_instance=round_instance, team=team, player=player
+                ).values('kills', 'deaths', 'xp').first()
+                player_stat, _ = TeamUPPlayerRoundStats.objects.update_or_create(
+                    round_instance=round_instance,
+                    team=team,
+                    player=player,
+                    defaults={
+                        'kills': request.POST.get('kills') or 0,
+                        'deaths': request.POST.get('deaths') or 0,
+                        'damage': request.POST.get('damage') or 0,
+                        'xp': request.POST.get('xp') or 0,
+                    }
+                )
+                career.apply_stat(player_stat, previous_player)
             
             # Re-aggregate team stats
             team_stats = TeamUPRoundStats.objects.filter(round_instance=round_instance, team=team).first()
             if team_stats:
+                previous = {'rank': team_stats.rank, 'kills': team_stats.kills, 'damage': team_stats.damage, 'xp': team_stats.xp}
                 all_member_stats = TeamUPPlayerRoundStats.objects.filter(round_instance=round_instance, team=team).aggregate(
                     total_kills=Sum('kills'),
                     total_damage=Sum('damage'),
@@ -314,8 +308,11 @@ def record_team_stats_view(request, fixture_id):
                 team_stats.damage = all_member_stats['total_damage'] or 0
                 team_stats.xp = all_member_stats['total_xp'] or 0
                 team_stats.deaths = all_member_stats['total_deaths'] or 0
-                team_stats.save()
+                with transaction.atomic():
+                    team_stats.save()
+                    leaderboard.apply_team_stat(team_stats, previous)
                 
+            ranking.request([fixture.stage.game_mode_id])
             messages.success(request, f"Stats updated for {player.gamer_tag} ({team.name})")
             
             # Trigger notification for player
@@ -340,7 +337,7 @@ def record_team_stats_view(request, fixture_id):
             player_stats_map[s.team.id] = {}
         player_stats_map[s.team.id][s.player.id] = s
     
-    for team in fixture.teamups.all():
+    for team in fixture.teamups.prefetch_related('players'):
         teams_data.append({
             'team': team,
             'stat_summary': round_team_stats.get(team.id),
@@ -360,37 +357,52 @@ def record_solo_stats_view(request, fixture_id):
     fixture = get_object_or_404(Fixture, id=fixture_id)
     
     # Get or create the Round instance
-    round_instance, created = Round.objects.get_or_create(
-        fixture=fixture,
-        defaults={
-            'cohort': fixture.cohort,
-            'stage': fixture.stage,
-            'match_date': fixture.match_date,
-        }
-    )
-    
-    # Ensure participants are synced (optional but good for data integrity)
-    if created:
-        for player in fixture.players.all():
-            round_instance.participants.add(player)
+    round_instance = results.round_for_fixture(fixture)
+
+    if request.method == 'POST' and 'player_id' not in request.POST:
+        # Whole-lobby grid submission
+        rows, errors = results.parse_solo_grid(request.POST, fixture.players.all())
+        if errors:
+            for error in errors:
+                messages.error(request, error)
+        elif not rows:
+            messages.error(request, "Enter results for at least one player.")
+        else:
+            created_count, updated_count = results.save_solo_results(round_instance, rows, request.user)
+            if created_count or updated_count:
+                ranking.request([fixture.stage.game_mode_id])
+            messages.success(request, f"Results saved: {created_count} recorded, {updated_count} updated.")
+        return redirect('record_solo_stats', fixture_id=fixture_id)
 
     if request.method == 'POST':
         player_id = request.POST.get('player_id')
         player = get_object_or_404(User, id=player_id)
+        errors = []
+        time_alive = results.parse_duration(request.POST.get('time_alive'), "Time alive", errors)
+        if errors:
+            messages.error(request, errors[0])
+            return redirect('record_solo_stats', fixture_id=fixture_id)
         
         try:
-            RoundPlayerStats.objects.update_or_create(
-                round_instance=round_instance,
-                player=player,
-                defaults={
-                    'rank': request.POST.get('rank') or 0,
-                    'kills': request.POST.get('kills') or 0,
-                    'deaths': request.POST.get('deaths') or 0,
-                    'damage': request.POST.get('damage') or 0,
-                    'xp': request.POST.get('xp') or 0,
-                    'time_alive': request.POST.get('time_alive', ''),
-                }
-            )
+            with transaction.atomic():
+                previous = RoundPlayerStats.objects.filter(
+                    round_instance=round_instance, player=player
+                ).values('kills', 'deaths', 'damage', 'xp', 'time_alive_seconds').first()
+                stat, _ = RoundPlayerStats.objects.update_or_create(
+                    round_instance=round_instance,
+                    player=player,
+                    defaults={
+                        'rank': request.POST.get('rank') or 0,
+                        'kills': request.POST.get('kills') or 0,
+                        'deaths': request.POST.get('deaths') or 0,
+                        'damage': request.POST.get('damage') or 0,
+                        'xp': request.POST.get('xp') or 0,
+                        'time_alive_seconds': time_alive,
+                    }
+                )
+                leaderboard.apply_stat(stat, previous)
+                career.apply_stat(stat, previous)
+            ranking.request([fixture.stage.game_mode_id])
             messages.success(request, f"Stats updated for {player.gamer_tag}")
             
             # Trigger notification for player
@@ -431,6 +443,7 @@ def create_squad_view(request):
             game_mode=game_mode
         )
         team.players.add(request.user)
+        dashboard.bump([request.user.id], 'squads', 'fixtures', 'results')
         
         messages.success(request, f"Squad '{name}' created successfully!")
         return redirect('manage_squad', team_id=team.id)
@@ -440,7 +453,7 @@ def create_squad_view(request):
 
 @login_required
 def manage_squad_view(request, team_id):
-    team = get_object_or_404(TeamUP, id=team_id)
+    team = get_object_or_404(TeamUP.objects.select_related('game_mode'), id=team_id)
     if team.captain != request.user:
         messages.error(request, "Only the captain can manage this squad.")
         return redirect('dashboard')
@@ -455,7 +468,7 @@ def manage_squad_view(request, team_id):
             messages.error(request, f"Squad full. Capacity for {team.game_mode.name} is {team.game_mode.max_players} (including pending invites).")
         else:
             try:
-                invitee = User.objects.get(gamer_tag__iexact=gamer_tag)
+                invitee = search.find_by_tag(gamer_tag)
                 if invitee in team.players.all():
                     messages.info(request, f"{gamer_tag} is already in the squad.")
                 else:
@@ -481,24 +494,40 @@ def manage_squad_view(request, team_id):
                 messages.error(request, f"Operator with tag '{gamer_tag}' not found.")
         return redirect('manage_squad', team.id)
             
-    active_cohorts = Cohort.objects.filter(is_open_to_join=True).order_by('-start_date')
-    member_statuses = []
-    for cohort in active_cohorts:
-        member_statuses.append({
-            'cohort': cohort,
-            'statuses': team.get_payment_status(cohort)
-        })
+    active_cohorts = list(Cohort.objects.filter(is_open_to_join=True).order_by('-start_date'))
+    resolved = readiness.resolve((team, cohort) for cohort in active_cohorts)
+    member_statuses = [
+        {'cohort': cohort, 'statuses': resolved[(team.id, cohort.id)]['statuses']}
+        for cohort in active_cohorts
+    ]
+    
+    # Per-member payment badges: {player_id: [{'cohort', 'paid'}, ...]}
+    member_payments = {}
+    for item in member_statuses:
+        for status in item['statuses']:
+            member_payments.setdefault(status['player'].id, []).append({'cohort': item['cohort'], 'paid': status['paid']})
 
+    squad_readiness = readiness.lookup([team], active_cohorts).values()
+    
     invites = team.invites.filter(status='PENDING')
     context = {
         'team': team, 
+        'squad_readiness': squad_readiness,
         'invites': invites,
         'member_statuses': member_statuses,
+        'member_payments': member_payments,
         'active_cohorts': active_cohorts
     }
     return render(request, 'home/manage_squad.html', context)
             
 
+@login_required
+def invite_suggestions_view(request, team_id):
+    team = get_object_or_404(TeamUP, id=team_id, captain=request.user)
+    term = request.GET.get('gamer_tag', '')
+    suggestions = search.autocomplete(term, exclude_ids=team.players.values('id'))
+    return render(request, 'home/partials/invite_suggestions.html', {'suggestions': suggestions, 'term': term})
+
 def normalize_phone(phone):
     """Normalize phone number to 254XXXXXXXXX format."""
     phone = str(phone).strip()
@@ -541,112 +570,30 @@ def initiate_payment_view(request, mode_id, cohort_id):
     if team_id:
         team = get_object_or_404(TeamUP, id=team_id)
 
-    # M-Pesa Integration Logic
-    consumer_key = os.getenv('MPESA_CONSUMER_KEY')
-    consumer_secret = os.getenv('MPESA_CONSUMER_SECRET')
-    shortcode = os.getenv('MPESA_PAYBILL')
-    passkey = os.getenv('MPESA_PASSKEY')
-    callback_url = os.getenv('MPESA_CALLBACK_URL')
-    mpesa_env = os.getenv('MPESA_ENVIRONMENT', 'sandbox')
-
-    if not all([consumer_key, consumer_secret, shortcode, passkey, callback_url]):
+    if mpesa.get_client() is None:
         messages.error(request, "M-Pesa credentials not configured.")
         return redirect('gamemode_detail', mode_id=mode.id)
 
-    # 1. Get Access Token
-    base_url = "https://api.safaricom.co.ke" if mpesa_env == 'production' else "https://sandbox.safaricom.co.ke"
-    
-    auth_url = f"{base_url}/oauth/v1/generate?grant_type=client_credentials"
-    r = requests.get(auth_url, auth=(consumer_key, consumer_secret))
-    access_token = r.json().get('access_token')
-
-    # 2. Initiate STK Push
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    password = base64.b64encode(f"{shortcode}{passkey}{timestamp}".encode()).decode()
-    
-    payment_url = f"{base_url}/mpesa/stkpush/v1/processrequest"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    # Use mode.amount but allow override for testing if needed
-    amount = int(mode.amount)
-    if os.getenv('DEBUG') == 'True' and mpesa_env == 'production':
-        # Safaricom Production doesn't usually allow 1 KSh, but for testing purposes
-        # we might want to keep it dynamic. Let's stick to mode.amount for realism.
-        pass
-
-    payload = {
-        "BusinessShortCode": shortcode,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": amount,
-        "PartyA": phone_number,
-        "PartyB": shortcode,
-        "PhoneNumber": phone_number,
-        "CallBackURL": callback_url,
-        "AccountReference": f"GM{mode.id}",
-        "TransactionDesc": f"Participation in {mode.name}"
-    }
-
-    response = requests.post(payment_url, json=payload, headers=headers)
-    res_data = response.json()
+    # The STK push itself is sent by the payment worker (manage.py run_payment_worker)
+    payment_request = payments.enqueue(request.user, cohort, mode, phone_number, team=team)
+    return redirect('payment_status', request_id=payment_request.id)
 
-    if res_data.get('ResponseCode') == '0':
-        # Create Pending Transaction
-        MPesaTransaction.objects.create(
-            merchant_request_id=res_data.get('MerchantRequestID'),
-            checkout_request_id=res_data.get('CheckoutRequestID'),
-            amount=mode.amount,
-            phone_number=phone_number,
-            user=request.user,
-            cohort=cohort,
-            game_mode=mode,
-            team=team,
-            status='PENDING'
-        )
-        messages.success(request, f"STK Push sent to {phone_number}. Please enter your M-Pesa PIN.")
-    else:
-        messages.error(request, f"Failed to initiate payment: {res_data.get('ResponseDescription')}")
-
-    return redirect('dashboard')
+@login_required
+def payment_status_view(request, request_id):
+    payment_request = get_object_or_404(
+        PaymentRequest.objects.select_related('transaction', 'game_mode', 'cohort'), id=request_id, user=request.user
+    )
+    context = {'payment_request': payment_request}
+    if request.headers.get('HX-Request'):
+        return render(request, 'home/partials/payment_status.html', context)
+    return render(request, 'home/payment_status.html', context)
 
 @csrf_exempt
 def mpesa_callback_view(request):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        stk_callback = data.get('Body', {}).get('stkCallback', {})
-        merchant_request_id = stk_callback.get('MerchantRequestID')
-        checkout_request_id = stk_callback.get('CheckoutRequestID')
-        result_code = stk_callback.get('ResultCode')
-        result_desc = stk_callback.get('ResultDesc')
-
-        try:
-            transaction = MPesaTransaction.objects.get(
-                merchant_request_id=merchant_request_id,
-                checkout_request_id=checkout_request_id
-            )
-            transaction.result_code = result_code
-            transaction.result_description = result_desc
-
-            if result_code == 0:
-                transaction.status = 'SUCCESS'
-                # Enroll user in cohort
-                profile = transaction.user.profile
-                transaction.cohort.participants.add(profile)
-                
-                # Notify User
-                Notification.objects.create(
-                    recipient=transaction.user,
-                    message=f"Payment of KSh {transaction.amount} successful! You are now enrolled in {transaction.cohort.name}.",
-                    notification_type='RESULT'
-                )
-            else:
-                transaction.status = 'FAILED'
-            
-            transaction.save()
-            return JsonResponse({"status": "Success"})
-        except MPesaTransaction.DoesNotExist:
-            return JsonResponse({"status": "Transaction not found"}, status=404)
+        # Persist and acknowledge; run_callback_worker applies the result
+        payments.receive_callback(request.body)
+        return JsonResponse({"status": "Success"})
     
     return JsonResponse({"status": "Invalid request"}, status=400)
 
@@ -658,6 +605,7 @@ def respond_invite_view(request, invite_id):
     if action == 'accept':
         invite.status = 'ACCEPTED'
         invite.team.players.add(request.user)
+        readiness.refresh_team(invite.team)
         messages.success(request, f"Joined '{invite.team.name}'!")
         
         # Notify captain
@@ -774,6 +722,7 @@ def manage_join_request_view(request, request_id, action):
             messages.error(request, "Squad is at maximum capacity.")
         else:
             join_request.team.players.add(join_request.player)
+            readiness.refresh_team(join_request.team)
             join_request.status = 'APPROVED'
             join_request.save()
             
@@ -843,35 +792,86 @@ def sitemap_view(request):
     
 @login_required
 def notifications_view(request):
-    notifications = request.user.notifications.all()
-    # Mark all as read when viewed? Or provide a specific view for it.
-    # For now, let's just show them.
-    return render(request, 'home/notifications.html', {'notifications': notifications})
+    # Keyset pagination: later pages are fetched by the infinite-scroll sentinel
+    cursor = notifications.decode_cursor(request.GET.get('after'))
+    page, has_more = notifications.inbox_page(request.user.id, cursor, NOTIFICATIONS_PAGE_SIZE)
+    
+    next_query = None
+    if has_more:
+        params = request.GET.copy()
+        params['after'] = notifications.encode_cursor(page[-1])
+        next_query = params.urlencode()
+    
+    context = {'notifications': page, 'next_query': next_query}
+    if cursor:
+        return render(request, 'home/partials/notification_rows.html', context)
+    return render(request, 'home/notifications.html', context)
+
+async def notification_stream_view(request):
+    """Streams the user's new notifications and unread-count changes as Server-Sent Events.
+
+    Served through COD.asgi: an idle stream waits on its in-process queue,
+    so connected clients cost no database polling. Streams end after
+    STREAM_LIFETIME seconds and the browser reconnects; this bounds how
+    long a stream outlives a client that disconnected without notice.
+    Under WSGI the whole stream would be consumed before any of it is
+    sent, tying up a worker, so those requests get a 204, which tells
+    EventSource to stop reconnecting.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return HttpResponse(status=401)
+
+    async def events():
+        queue = notifications.broker.subscribe(user.id)
+        try:
+            unread = await sync_to_async(notifications.unread_count)(user.id)
+            yield f"retry: {STREAM_RETRY_MS}\n" + notifications.format_event({'type': 'unread', 'unread': unread})
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + STREAM_LIFETIME
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    event = await asyncio.wait_for(queue.get(), min(STREAM_KEEPALIVE, remaining))
+                except asyncio.TimeoutError:
+                    # Comment lines keep proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield notifications.format_event(event)
+        finally:
+            notifications.broker.unsubscribe(user.id, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def mark_all_notifications_read(request):
+    if request.method == 'POST':
+        updated = notifications.mark_all_read(request.user.id)
+        messages.success(request, f"Marked {updated} notifications as read.")
+    return redirect('notifications')
 
 @login_required
 def mark_notification_read(request, notification_id):
     notification = get_object_or_404(Notification, id=notification_id, recipient=request.user)
-    notification.is_read = True
-    notification.save()
+    notifications.mark_read(notification)
     if notification.link:
         return redirect(notification.link)
     return redirect('notifications')
 
 def bracket_view(request, cohort_id):
     cohort = get_object_or_404(Cohort, id=cohort_id)
-    stages = GameStage.objects.filter(cohort=cohort).order_by('order')
-    
-    bracket_data = []
-    for stage in stages:
-        stage_fixtures = Fixture.objects.filter(cohort=cohort, stage=stage)
-        team_fixtures = TeamUPFixture.objects.filter(cohort=cohort, stage=stage)
-        bracket_data.append({
-            'stage': stage,
-            'solo_fixtures': stage_fixtures,
-            'team_fixtures': team_fixtures
-        })
-    
-    return render(request, 'home/brackets.html', {'cohort': cohort, 'bracket_data': bracket_data})
+    # The stages queryset only runs when the cached bracket has to be re-rendered
+    return render(request, 'home/brackets.html', {
+        'cohort': cohort,
+        'stages': brackets.load(cohort),
+        'bracket_version': brackets.version(cohort.id),
+        'bracket_timeout': brackets.BRACKET_TIMEOUT,
+    })
+
 @csrf_exempt
 def ai_chat_view(request):
     if request.method == 'POST':
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from .models import User
+from . import search
 
 from django.core.exceptions import ValidationError
 import re
@@ -27,7 +28,7 @@ class RegistrationStep2Form(forms.ModelForm):
         gamer_tag = self.cleaned_data.get('gamer_tag')
         if not gamer_tag:
             raise ValidationError("Gamer Tag is required.")
-        if User.objects.filter(gamer_tag=gamer_tag).exists():
+        if search.tag_taken(gamer_tag):
             raise ValidationError("This Gamer Tag is already taken.")
         return gamer_tag
 
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from users.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recomputes normalized gamer tags and the trigram search index for every user'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding gamer tag index...")
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} users."))
@@ -29,6 +29,8 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     phone_number = models.CharField(max_length=15, unique=True)
     gamer_tag = models.CharField(max_length=50, unique=True, null=True, blank=True)
+    # Lowercased copy of gamer_tag for indexed case-insensitive lookups (see users.search)
+    gamer_tag_normalized = models.CharField(max_length=50, null=True, blank=True, db_index=True, editable=False)
     full_name = models.CharField(max_length=255, null=True, blank=True)
     county = models.CharField(max_length=100, null=True, blank=True)
 
@@ -38,6 +40,18 @@ class User(AbstractUser):
 
     objects = CustomUserManager()
 
+    def save(self, *args, **kwargs):
+        from .search import normalize_tag, index_gamer_tag
+        update_fields = kwargs.get('update_fields')
+        tag_changed = update_fields is None or 'gamer_tag' in update_fields
+        if tag_changed:
+            self.gamer_tag_normalized = normalize_tag(self.gamer_tag)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'gamer_tag_normalized'}
+        super().save(*args, **kwargs)
+        if tag_changed:
+            index_gamer_tag(self)
+
     def __str__(self):
         return f"{self.gamer_tag or self.email} ({self.full_name or 'No Name'})"
 
@@ -48,5 +62,18 @@ class PersonalProfile(models.Model):
     total_xp = models.IntegerField(default=0)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     deaths = models.IntegerField(default=0)
+    # Bumped whenever any of the player's results change; keys the cached career summary
+    stats_version = models.PositiveIntegerField(default=0)
     def __str__(self):
         return f"Profile of {self.user.gamer_tag}"
+
+
+class GamerTagTrigram(models.Model):
+    """One row per distinct three-character slice of a user's normalized gamer tag."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='gamer_tag_trigrams')
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trigram', 'user'], name='gamer_tag_trigram_idx'),
+        ]
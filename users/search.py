@@ -0,0 +1,81 @@
+from django.db.models import Count
+
+from .models import GamerTagTrigram, User
+
+TRIGRAM_SIZE = 3
+
+
+def normalize_tag(gamer_tag):
+    """Canonical form used for every gamer tag comparison."""
+    if gamer_tag is None:
+        return None
+    return gamer_tag.strip().lower() or None
+
+
+def trigrams(value):
+    """Distinct three-character slices of a normalized value."""
+    return {value[i:i + TRIGRAM_SIZE] for i in range(len(value) - TRIGRAM_SIZE + 1)}
+
+
+def index_gamer_tag(user):
+    """Replaces the trigram rows for user; called from User.save."""
+    GamerTagTrigram.objects.filter(user=user).delete()
+    if user.gamer_tag_normalized:
+        GamerTagTrigram.objects.bulk_create(
+            GamerTagTrigram(user=user, trigram=gram) for gram in trigrams(user.gamer_tag_normalized)
+        )
+
+
+def rebuild_index(batch_size=1000):
+    """Recomputes normalized tags and trigrams for every user. Returns the user count."""
+    users = list(User.objects.only('id', 'gamer_tag'))
+    grams = []
+    for user in users:
+        user.gamer_tag_normalized = normalize_tag(user.gamer_tag)
+        if user.gamer_tag_normalized:
+            grams.extend(GamerTagTrigram(user_id=user.id, trigram=gram) for gram in trigrams(user.gamer_tag_normalized))
+    User.objects.bulk_update(users, ['gamer_tag_normalized'], batch_size=batch_size)
+    GamerTagTrigram.objects.all().delete()
+    GamerTagTrigram.objects.bulk_create(grams, batch_size=batch_size)
+    return len(users)
+
+
+def find_by_tag(gamer_tag):
+    """Case-insensitive exact lookup. Raises User.DoesNotExist like .get()."""
+    return User.objects.get(gamer_tag_normalized=normalize_tag(gamer_tag) or '')
+
+
+def tag_taken(gamer_tag):
+    return User.objects.filter(gamer_tag_normalized=normalize_tag(gamer_tag) or '').exists()
+
+
+def search_users(term):
+    """Users whose gamer tag contains term, case-insensitively.
+
+    Short terms fall back to an indexed prefix match; longer ones intersect the
+    trigram index and only re-check the surviving candidates for a real substring.
+    """
+    term = normalize_tag(term)
+    if not term:
+        return User.objects.none()
+    if len(term) < TRIGRAM_SIZE:
+        return User.objects.filter(gamer_tag_normalized__startswith=term)
+
+    grams = trigrams(term)
+    candidates = GamerTagTrigram.objects.filter(trigram__in=grams).values('user_id').annotate(
+        hits=Count('trigram', distinct=True)
+    ).filter(hits=len(grams)).values('user_id')
+    return User.objects.filter(id__in=candidates, gamer_tag_normalized__contains=term)
+
+
+def autocomplete(term, limit=8, exclude_ids=()):
+    """Suggestions for an input box: prefix matches first, then other substring matches."""
+    term = normalize_tag(term)
+    if not term:
+        return []
+    matches = search_users(term).exclude(id__in=exclude_ids).only('id', 'gamer_tag', 'gamer_tag_normalized')
+    prefix = list(matches.filter(gamer_tag_normalized__startswith=term).order_by('gamer_tag_normalized')[:limit])
+    if len(prefix) < limit and len(term) >= TRIGRAM_SIZE:
+        rest = matches.exclude(id__in=[user.id for user in prefix]).order_by('gamer_tag_normalized')[:limit - len(prefix)]
+        prefix.extend(rest)
+    return prefix
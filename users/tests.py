@@ -1,6 +1,7 @@
 from django.test import TestCase
 from django.urls import reverse
 from .models import User
+from . import search
 
 class UserAuthTests(TestCase):
     def test_registration_flow(self):
@@ -46,3 +47,34 @@ class UserAuthTests(TestCase):
         response = self.client.get(reverse('profile'))
         self.assertEqual(response.status_code, 302)
         self.assertIn(reverse('login'), response.url)
+
+
+class GamerTagSearchTests(TestCase):
+    def setUp(self):
+        for i, tag in enumerate(['ShadowWalker', 'GhostRider', 'VoidWalker', 'Xi']):
+            User.objects.create_user(
+                email=f'p{i}@example.com', phone_number=f'07000000{i:02d}', password='password123', gamer_tag=tag
+            )
+
+    def test_exact_lookup_is_case_insensitive(self):
+        self.assertEqual(search.find_by_tag('  shadowWALKER ').gamer_tag, 'ShadowWalker')
+        self.assertTrue(search.tag_taken('GHOSTRIDER'))
+        self.assertFalse(search.tag_taken('Ghost'))
+
+    def test_substring_and_prefix_search(self):
+        tags = lambda qs: sorted(qs.values_list('gamer_tag', flat=True))
+        self.assertEqual(tags(search.search_users('walker')), ['ShadowWalker', 'VoidWalker'])
+        self.assertEqual(tags(search.search_users('xi')), ['Xi'])
+        # every trigram of "walkerx" is present in no single tag
+        self.assertEqual(tags(search.search_users('walkerx')), [])
+
+    def test_renaming_reindexes_trigrams(self):
+        user = search.find_by_tag('GhostRider')
+        user.gamer_tag = 'NightOwl'
+        user.save()
+        self.assertFalse(search.search_users('rider').exists())
+        self.assertEqual(list(search.search_users('owl')), [user])
+
+    def test_check_gamer_tag_probe(self):
+        response = self.client.get(reverse('check_gamer_tag'), {'gamer_tag': 'voidwalker'})
+        self.assertContains(response, 'already taken')
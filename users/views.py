@@ -4,7 +4,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.forms import AuthenticationForm
 from .forms import RegistrationStep1Form, RegistrationStep2Form
-from .models import User
+from . import search
 from django.http import HttpResponse
 
 def check_gamer_tag(request):
@@ -12,7 +12,7 @@ def check_gamer_tag(request):
     if not gamer_tag:
         return HttpResponse('<div style="color: #94a3b8; margin-bottom: 1rem;">Enter a gamer tag to continue.</div>')
     
-    if User.objects.filter(gamer_tag=gamer_tag).exists():
+    if search.tag_taken(gamer_tag):
         return HttpResponse('<div style="color: #ef4444; margin-bottom: 1rem;">This Gamer Tag is already taken.</div>')
     
     # If unique, show the rest of the form